@@ -0,0 +1,80 @@
+"""
+Requests per second of the sync DRF endpoints versus their ASGI-native
+counterparts, both served by the ASGI application at fixed concurrency.
+
+    python -m benchmarks.async_vs_sync --concurrency 1 10 50 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from .common import BenchEnvironment, summarize
+
+SCENARIOS = {
+    'read': ('GET', '/api/user/profile/', '/api/user/async/profile/'),
+    'login': ('POST', '/api/user/firebase-login/', '/api/user/async/firebase-login/'),
+}
+
+
+async def drive(client, method, url, concurrency, total, **kwargs):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{method} {url} -> {response.status_code}: {response.text}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+async def run(env, concurrency_levels, total):
+    import httpx
+    from django.core.asgi import get_asgi_application
+
+    application = get_asgi_application()
+    token = env.signer.sign('bench-uid', 'bench@example.com')
+    headers = {'Authorization': f'Bearer {token}'}
+    results = []
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application),
+                                 base_url='http://testserver') as client:
+        for name, (method, sync_url, async_url) in SCENARIOS.items():
+            kwargs = {'headers': headers}
+            if method == 'POST':
+                kwargs['json'] = {'id_token': token}
+            for concurrency in concurrency_levels:
+                for variant, url in (('sync', sync_url), ('async', async_url)):
+                    await drive(client, method, url, concurrency, min(total, 20), **kwargs)  # warm up
+                    stats = await drive(client, method, url, concurrency, total, **kwargs)
+                    results.append({'scenario': name, 'variant': variant, 'concurrency': concurrency, **stats})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    with BenchEnvironment() as env:
+        env.create_user('bench-uid', 'bench@example.com')
+        results = asyncio.run(run(env, args.concurrency, args.requests))
+
+    print(f"{'scenario':<8} {'variant':<6} {'conc':>5} {'rps':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for row in results:
+        print(f"{row['scenario']:<8} {row['variant']:<6} {row['concurrency']:>5} "
+              f"{row['rps']:>9} {row['p50_ms']:>8} {row['p99_ms']:>8}")
+    if args.json:
+        with open(args.json, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compare two ``benchmarks.load`` result files and flag regressions.
+
+    python -m benchmarks.compare OLD.json NEW.json --threshold 10
+
+A row regresses when RPS drops or p95 latency grows by more than
+``--threshold`` percent, or when it issues more queries per request. Exits
+with status 1 if any row regressed.
+"""
+import argparse
+import json
+import sys
+
+
+def pct_change(old, new):
+    return (new - old) / old * 100 if old else 0.0
+
+
+def compare(old, new, threshold):
+    """``(rows, regressed)`` for every scenario/concurrency pair present in both runs."""
+    baseline = {(row['scenario'], row['concurrency']): row for row in old['results']}
+    rows, regressed = [], False
+    for row in new['results']:
+        before = baseline.get((row['scenario'], row['concurrency']))
+        if before is None:
+            continue
+        rps = pct_change(before['rps'], row['rps'])
+        p95 = pct_change(before['p95_ms'], row['p95_ms'])
+        queries = row['queries_per_request'] - before['queries_per_request']
+        flagged = rps < -threshold or p95 > threshold or queries > 0
+        regressed = regressed or flagged
+        rows.append({
+            'scenario': row['scenario'], 'concurrency': row['concurrency'],
+            'rps_change': round(rps, 1), 'p95_change': round(p95, 1),
+            'queries_change': round(queries, 2), 'regressed': flagged,
+        })
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='allowed RPS/p95 change in percent')
+    args = parser.parse_args()
+
+    with open(args.old) as fh:
+        old = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+
+    print(f"{old['meta'].get('revision')} -> {new['meta'].get('revision')}")
+    print(f"{'scenario':<15} {'conc':>5} {'rps %':>8} {'p95 %':>8} {'q/req':>6}")
+    rows, regressed = compare(old, new, args.threshold)
+    for row in rows:
+        print(f"{row['scenario']:<15} {row['concurrency']:>5} {row['rps_change']:>+8} "
+              f"{row['p95_change']:>+8} {row['queries_change']:>+6}{'  REGRESSED' if row['regressed'] else ''}")
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""
+Load benchmark for the user API against a local threaded HTTP server.
+
+The project's WSGI application is served on an ephemeral port (a throwaway
+on-disk SQLite database, tokens signed by a ``LocalTokenSigner``) and each
+scenario is driven by a pool of client threads at every requested
+concurrency level. Queries per request are read from the ``Server-Timing``
+header written by ``RequestTimingMiddleware``.
+
+    python -m benchmarks.load --concurrency 1 10 50 --requests 300 \\
+        --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from .common import BenchEnvironment, summarize
+
+SCENARIOS = ('read', 'create', 'login', 'update_phone', 'reset_password')
+PASSWORD = 'Str0ng!Passw0rd'
+USERS = 50
+
+_DB_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def queries_from_header(server_timing):
+    """Query count recorded in a ``Server-Timing`` header (0 if none ran)."""
+    match = _DB_QUERIES.search(server_timing or '')
+    return int(match.group(1)) if match else 0
+
+
+def phone_number(n):
+    return f'080{n:08d}'
+
+
+class Scenarios:
+    """
+    Builds the request list for each scenario up front, so token signing and
+    payload construction stay out of the measured time.
+    """
+
+    def __init__(self, env, users):
+        self.env = env
+        self.users = users
+        self.bearers = [env.bearer(user.firebase_uid, user.email) for user in users]
+        self.serial = itertools.count(1)
+
+    def _user(self, i):
+        return i % len(self.users)
+
+    def read(self, i):
+        return 'GET', '/api/user/profile/', {'Authorization': self.bearers[self._user(i)]}, None
+
+    def create(self, i):
+        # Fresh uids: every request creates a profile (hashing a password on the way).
+        n = next(self.serial)
+        uid, email = f'bench-new-{n}', f'bench-new-{n}@example.com'
+        body = {
+            'first_name': 'Bench', 'last_name': 'Create', 'phone_number': phone_number(5_000_000 + n),
+            'password': PASSWORD, 'retype_password': PASSWORD,
+        }
+        return 'POST', '/api/user/profile/create/', {'Authorization': self.env.bearer(uid, email)}, body
+
+    def login(self, i):
+        bearer = self.bearers[self._user(i)]
+        # FirebaseAuthentication runs on every DRF view, so the header is required here too.
+        return 'POST', '/api/user/firebase-login/', {'Authorization': bearer}, {'id_token': bearer[len('Bearer '):]}
+
+    def update_phone(self, i):
+        user = self.users[self._user(i)]
+        body = {'phone_number': phone_number(1_000_000 + next(self.serial))}
+        return 'PATCH', f'/api/user/profile/{user.pk}/update-phone/', {'Authorization': self.bearers[self._user(i)]}, body
+
+    def reset_password(self, i):
+        user = self.users[self._user(i)]
+        body = {'email': user.email, 'new_password': PASSWORD, 'confirm_password': PASSWORD}
+        return 'POST', '/api/user/reset-password/', {'Authorization': self.bearers[self._user(i)]}, body
+
+    def build(self, name, total):
+        return [getattr(self, name)(i) for i in range(total)]
+
+
+class LocalServer:
+    """The project's WSGI app on a threaded server in a background thread."""
+
+    def __enter__(self):
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+        from django.core.wsgi import get_wsgi_application
+
+        class QuietHandler(WSGIRequestHandler):
+            # Otherwise Nagle + delayed ACKs add ~40ms to keep-alive responses.
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=True)
+        self.httpd.set_app(get_wsgi_application())
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        host, port = self.httpd.server_address
+        self.base_url = f'http://{host}:{port}'
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def drive(base_url, planned, concurrency):
+    import requests
+
+    local = threading.local()
+    latencies, queries, errors = [], [], {}
+    lock = threading.Lock()
+
+    def one(spec):
+        method, path, headers, body = spec
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        response = session.request(method, base_url + path, headers=headers, json=body)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            queries.append(queries_from_header(response.headers.get('Server-Timing')))
+            if response.status_code >= 400:
+                errors[response.status_code] = errors.get(response.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, planned))
+    stats = summarize(latencies, time.perf_counter() - started)
+    stats['queries_per_request'] = round(sum(queries) / len(queries), 2) if queries else 0.0
+    stats['errors'] = {str(code): count for code, count in sorted(errors.items())}
+    return stats
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scenarios, concurrency_levels, total, warmup):
+    import django
+
+    with BenchEnvironment(file_database=True, SERVER_TIMING_HEADER='True') as env:
+        users = [
+            env.create_user(f'bench-{i}', f'bench-{i}@example.com', phone_number=phone_number(i))
+            for i in range(USERS)
+        ]
+        plans = Scenarios(env, users)
+        results = []
+        with LocalServer() as server:
+            for name in scenarios:
+                for concurrency in concurrency_levels:
+                    if warmup:
+                        drive(server.base_url, plans.build(name, warmup), concurrency)
+                    stats = drive(server.base_url, plans.build(name, total), concurrency)
+                    results.append({'scenario': name, 'concurrency': concurrency, **stats})
+                    print(f"{name:<15} {concurrency:>5} {stats['rps']:>9} {stats['p50_ms']:>8} "
+                          f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['queries_per_request']:>6} "
+                          f"{sum(stats['errors'].values()):>6}", flush=True)
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'cpus': os.cpu_count(),
+            'requests': total,
+            'password_hasher': os.environ.get('PASSWORD_HASHER', 'pbkdf2'),
+        },
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=300, help='measured requests per scenario and level')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests before each run')
+    parser.add_argument('--output', help='write the results (with run metadata) as JSON to this file')
+    args = parser.parse_args()
+
+    print(f"{'scenario':<15} {'conc':>5} {'rps':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/req':>6} {'errors':>6}")
+    report = run(args.scenarios, args.concurrency, args.requests, args.warmup)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Per-request cost of logging under different configurations.
+
+Drives POST /api/user/firebase-login/ (the chattiest endpoint) through the
+test client and reports the mean time per request for:
+
+* ``off``: logging disabled, the baseline;
+* ``legacy``: the previous setup, i.e. its exact ``LOGGING`` (root logger at
+  DEBUG writing synchronously through a plain ``StreamHandler`` to stderr,
+  default format) and the login view's old log calls, which built f-strings
+  of the request data, the verified claims and the response on the request
+  thread;
+* ``current``: ``settings.LOGGING`` (INFO, JSON, redaction, background queue);
+* ``current-debug``: the same pipeline with the root logger at DEBUG.
+
+Log lines go to a temporary file (stderr, for ``legacy``) so every
+configuration pays for real I/O.
+
+    python -m benchmarks.logging_overhead --requests 2000 --rounds 3
+"""
+import argparse
+import contextlib
+import copy
+import logging
+import logging.config
+import tempfile
+import time
+from unittest import mock
+
+from .common import BenchEnvironment
+
+# settings.LOGGING before the structured pipeline, verbatim.
+LEGACY_LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {'console': {'class': 'logging.StreamHandler'}},
+    'loggers': {'': {'handlers': ['console'], 'level': 'DEBUG'}},
+}
+
+
+@contextlib.contextmanager
+def legacy_login_logging():
+    """
+    Make the login view log what it used to, in the same order and with the
+    same eager f-strings, instead of its current calls.
+    """
+    from user import views
+
+    logger = logging.getLogger('user.views')
+    verify = views.verify_firebase_id_token
+    post = views.FirebaseLoginAPIView.post
+
+    def legacy_verify(id_token, request=None):
+        logger.debug("Attempting to verify Firebase token")
+        user_info = verify(id_token, request=request)
+        logger.debug(f"Token verified successfully: {user_info}")
+        logger.debug(f"Creating/getting user with UID: {user_info['uid']}")
+        return user_info
+
+    def legacy_post(view, request):
+        logger.debug(f"Firebase login request data: {request.data}")
+        response = post(view, request)
+        if response.status_code == 200:
+            logger.debug(f"Returning success response: {response.data}")
+        return response
+
+    silenced = logging.getLogger('benchmarks.logging_overhead.silenced')
+    silenced.disabled = True
+    with mock.patch.object(views, 'logger', silenced), \
+            mock.patch.object(views, 'verify_firebase_id_token', legacy_verify), \
+            mock.patch.object(views.FirebaseLoginAPIView, 'post', legacy_post):
+        yield
+
+
+def configurations(log_file):
+    from django.conf import settings
+
+    def current(level):
+        config = copy.deepcopy(settings.LOGGING)
+        config['handlers']['background']['stream'] = log_file
+        config['loggers']['']['level'] = level
+        return config
+
+    return {
+        'off': None, 'legacy': copy.deepcopy(LEGACY_LOGGING),
+        'current': current('INFO'), 'current-debug': current('DEBUG'),
+    }
+
+
+def reset_root():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+
+
+def measure(client, token, total):
+    started = time.perf_counter()
+    for _ in range(total):
+        client.post(
+            '/api/user/firebase-login/', {'id_token': token},
+            content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+        )
+    return (time.perf_counter() - started) / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with BenchEnvironment(quiet=False) as env, tempfile.TemporaryFile('w') as log_file:
+        from django.test import Client
+
+        env.create_user('bench-uid', 'bench@example.com')
+        token = env.signer.sign('bench-uid', 'bench@example.com')
+        client = Client()
+        configs = configurations(log_file)
+        results = {}
+        # Interleaved rounds, best of each, to keep machine noise out of the comparison.
+        for _ in range(args.rounds):
+            for name, config in configs.items():
+                reset_root()
+                logging.disable(logging.NOTSET)
+                legacy = name == 'legacy'
+                if config is None:
+                    logging.disable(logging.CRITICAL)
+                elif legacy:
+                    # The StreamHandler binds to sys.stderr when it's built.
+                    with contextlib.redirect_stderr(log_file):
+                        logging.config.dictConfig(config)
+                else:
+                    logging.config.dictConfig(config)
+                with legacy_login_logging() if legacy else contextlib.nullcontext():
+                    measure(client, token, min(args.requests, 100))  # warm up
+                    seconds = measure(client, token, args.requests)
+                results[name] = min(seconds, results.get(name, seconds))
+        reset_root()
+
+    baseline = results['off']
+    print(f"{'config':<14} {'us/request':>11} {'overhead us':>12}")
+    for name, seconds in results.items():
+        print(f"{name:<14} {seconds * 1e6:>11.1f} {(seconds - baseline) * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Cost of turning profiles into response bytes, old path versus fast path.
+
+* ``drf``: model instances -> ``UserProfileSerializer(many=True)`` ->
+  ``JSONRenderer`` (stdlib json), as the list endpoint used to do;
+* ``rows``: ``.values()`` rows -> ``PROFILE_ROWS`` -> ``ORJSONRenderer``.
+
+Each stage (fetch, serialize, render) is timed separately, best of
+``--repeat`` runs, for each profile count. Both paths must produce the same
+bytes; the script exits with an error if they don't.
+
+    python -m benchmarks.serialization --sizes 1 100 10000 --repeat 20
+"""
+import argparse
+import json
+import time
+
+from .common import BenchEnvironment
+
+
+def best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def paths():
+    from rest_framework.renderers import JSONRenderer
+
+    from user.models import CustomUser
+    from user.renderers import ORJSONRenderer
+    from user.serializers import PROFILE_ROWS, UserProfileSerializer
+
+    queryset = CustomUser.objects.order_by('id')
+    return {
+        'drf': (
+            lambda n: list(queryset.only(*PROFILE_ROWS.fields)[:n]),
+            lambda objs: UserProfileSerializer(objs, many=True).data,
+            JSONRenderer().render,
+        ),
+        'rows': (
+            lambda n: list(PROFILE_ROWS.values(queryset)[:n]),
+            PROFILE_ROWS.many,
+            ORJSONRenderer().render,
+        ),
+    }
+
+
+def run(sizes, repeat):
+    from user.models import CustomUser
+
+    CustomUser.objects.bulk_create(
+        CustomUser(
+            email=f'user{i}@example.com', firebase_uid=f'uid-{i}', first_name='Adaé',
+            last_name=f'Lovelace {i}', phone_number=f'0803{i:07d}', password='!',
+        )
+        for i in range(max(sizes))
+    )
+    results = []
+    for size in sizes:
+        rendered = {}
+        for name, (fetch, serialize, render) in paths().items():
+            fetch_s, objs = best_of(repeat, lambda: fetch(size))
+            serialize_s, data = best_of(repeat, lambda: serialize(objs))
+            render_s, body = best_of(repeat, lambda: render(data))
+            rendered[name] = body
+            results.append({
+                'path': name, 'profiles': size,
+                'fetch_us': round(fetch_s * 1e6, 1),
+                'serialize_us': round(serialize_s * 1e6, 1),
+                'render_us': round(render_s * 1e6, 1),
+                'total_us': round((fetch_s + serialize_s + render_s) * 1e6, 1),
+            })
+        if rendered['drf'] != rendered['rows']:
+            raise SystemExit(f"Outputs differ for {size} profiles")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 100, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help='print one JSON result per row')
+    args = parser.parse_args()
+
+    with BenchEnvironment():
+        results = run(args.sizes, args.repeat)
+
+    if args.json:
+        for row in results:
+            print(json.dumps(row))
+        return
+    totals = {(row['path'], row['profiles']): row['total_us'] for row in results}
+    print(f"{'path':<5} {'profiles':>8} {'fetch us':>10} {'serialize us':>13} {'render us':>10} "
+          f"{'total us':>10} {'speedup':>8}")
+    for row in results:
+        speedup = totals[('drf', row['profiles'])] / row['total_us'] if row['total_us'] else 0.0
+        print(f"{row['path']:<5} {row['profiles']:>8} {row['fetch_us']:>10} {row['serialize_us']:>13} "
+              f"{row['render_us']:>10} {row['total_us']:>10} {speedup:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
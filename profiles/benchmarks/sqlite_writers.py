@@ -0,0 +1,144 @@
+"""
+Concurrent SQLite writers: error rate and tail latency with and without the
+SQLite tuning (WAL, busy_timeout, synchronous=NORMAL, IMMEDIATE
+transactions) and the lock retry.
+
+Writers sign up new users through POST /api/user/firebase-login/ (two
+``get_or_create`` writes per request) against one on-disk database. They
+are spread over several processes, like a multi-worker deployment, because
+threads in a single interpreter mostly serialize on the GIL and rarely
+contend for the database lock. Every mode runs in its own interpreter, since
+the tuning is applied from settings at startup.
+
+    python -m benchmarks.sqlite_writers --writers 50 --processes 10 --writes 20
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from .common import BenchEnvironment, summarize
+
+MODES = {
+    'default': {'DB_SQLITE_TUNING': 'False', 'DB_LOCK_RETRY_ATTEMPTS': '1'},
+    'tuned': {'DB_SQLITE_TUNING': 'True', 'DB_LOCK_RETRY_ATTEMPTS': '1'},
+    'tuned+retry': {'DB_SQLITE_TUNING': 'True', 'DB_LOCK_RETRY_ATTEMPTS': '5'},
+}
+
+
+def worker_process(token_lists, barrier, results):
+    """One worker process: a thread per writer, all started together."""
+    import django
+
+    django.setup()
+    logging.disable(logging.CRITICAL)
+    from django.test import Client
+
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def writer(tokens):
+        client = Client(raise_request_exception=False)
+        for token in tokens:
+            started = time.perf_counter()
+            response = client.post(
+                '/api/user/firebase-login/', {'id_token': token},
+                content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}',
+            )
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=writer, args=(tokens,)) for tokens in token_lists]
+    barrier.wait()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, failures))
+
+
+def run_mode(mode, writers, processes, writes):
+    with BenchEnvironment(file_database=True, PASSWORD_HASHING_WORKERS='0', **MODES[mode]) as env:
+        from django.db import connection
+
+        tokens = [
+            [env.signer.sign(f'w{w}-{i}', f'w{w}-{i}@example.com') for i in range(writes)]
+            for w in range(writers)
+        ]
+        # Spawned workers rebuild settings from the environment; point them at the test database.
+        os.environ['DB_NAME'] = str(connection.settings_dict['NAME'])
+        connection.close()
+
+        context = multiprocessing.get_context('spawn')
+        barrier = context.Barrier(processes + 1)
+        results = context.Queue()
+        workers = [
+            context.Process(target=worker_process, args=(tokens[index::processes], barrier, results))
+            for index in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        barrier.wait()
+        started = time.perf_counter()
+        latencies, failures = [], []
+        for _ in workers:
+            worker_latencies, worker_failures = results.get()
+            latencies += worker_latencies
+            failures += worker_failures
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+
+    stats = summarize(latencies, elapsed)
+    stats['errors'] = len(failures)
+    stats['error_rate'] = round(len(failures) / len(latencies), 4) if latencies else 0.0
+    return {'mode': mode, 'writers': writers, 'processes': processes, 'journal_mode': journal_mode, **stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=10, help='worker processes the writers are spread over')
+    parser.add_argument('--writes', type=int, default=20, help='signups per writer')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--json', action='store_true', help='print one JSON result per mode')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)  # child process
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.writers, args.processes, args.writes)))
+        return
+
+    results = []
+    for mode in args.modes:
+        child = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_writers', '--mode', mode,
+             '--writers', str(args.writers), '--processes', str(args.processes), '--writes', str(args.writes)],
+            capture_output=True, text=True, check=True, env=os.environ.copy(),
+        )
+        results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        for row in results:
+            print(json.dumps(row))
+        return
+    print(f"{'mode':<12} {'writers':>7} {'rps':>8} {'p50 ms':>8} {'p99 ms':>9} {'errors':>7} {'rate':>7}")
+    for row in results:
+        print(f"{row['mode']:<12} {row['writers']:>7} {row['rps']:>8} {row['p50_ms']:>8} "
+              f"{row['p99_ms']:>9} {row['errors']:>7} {row['error_rate']:>7.2%}")
+
+
+if __name__ == '__main__':
+    main()
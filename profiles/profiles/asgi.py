@@ -14,3 +14,13 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "profiles.settings")
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from user.validators import prewarm as prewarm_validators  # noqa: E402
+
+prewarm_validators()
+
+if settings.FIREBASE_PREWARM:
+    from user.firebase_client import prewarm
+
+    prewarm()
@@ -1,8 +1,6 @@
 from pathlib import Path
 import os
-import firebase_admin
-from firebase_admin import credentials
-from decouple import config
+from decouple import Csv, config
 
 # 1. Paths
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -12,19 +10,41 @@ SECRET_KEY = config("DJANGO_SECRET_KEY", default="your-fallback-dev-key")
 DEBUG = config("DEBUG", default=True, cast=bool)
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", default="").split(",")
 
-# 3. Firebase setup
-FIREBASE_CREDENTIALS = config("FIREBASE_CREDENTIALS")
+# 3. Firebase setup. The Admin SDK is initialized lazily from this file on
+# first use (user.firebase_client), not at import time.
+FIREBASE_CREDENTIALS = config("FIREBASE_CREDENTIALS", default=str(BASE_DIR / "firebase_credentials.json"))
+# Initialize the SDK / fetch signing keys when a WSGI/ASGI worker starts
+# instead of on its first request.
+FIREBASE_PREWARM = config("FIREBASE_PREWARM", default=False, cast=bool)
 
-# Optional check to debug issues
-print("FIREBASE_CREDENTIALS:", FIREBASE_CREDENTIALS)
-print("File exists?", os.path.exists(FIREBASE_CREDENTIALS))
-
-if not firebase_admin._apps:
-    if os.path.exists(FIREBASE_CREDENTIALS):
-        cred = credentials.Certificate(FIREBASE_CREDENTIALS)
-        firebase_admin.initialize_app(cred)
-    else:
-        raise FileNotFoundError(f"Firebase credentials not found at: {FIREBASE_CREDENTIALS}")
+# ID token verification: "local" checks tokens in-process against cached Google
+# certificates, "sdk" uses firebase_admin.auth.verify_id_token.
+FIREBASE_TOKEN_VERIFIER = config("FIREBASE_TOKEN_VERIFIER", default="local")
+# Defaults to the project_id in FIREBASE_CREDENTIALS.
+FIREBASE_PROJECT_ID = config("FIREBASE_PROJECT_ID", default="")
+# URL or local file path of the signing certificates (x509 map or JWKS).
+FIREBASE_KEY_SOURCE = config(
+    "FIREBASE_KEY_SOURCE",
+    default="https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com",
+)
+FIREBASE_TOKEN_LEEWAY = config("FIREBASE_TOKEN_LEEWAY", default=0, cast=int)
+# Verified tokens are cached (by SHA-256 digest) until they expire, capped at TTL seconds.
+FIREBASE_TOKEN_CACHE_SIZE = config("FIREBASE_TOKEN_CACHE_SIZE", default=10000, cast=int)
+FIREBASE_TOKEN_CACHE_TTL = config("FIREBASE_TOKEN_CACHE_TTL", default=3600, cast=int)
+# Rejected tokens (bad signature, expired, ...) are answered from memory this long.
+FIREBASE_REJECTED_TOKEN_CACHE_SIZE = config("FIREBASE_REJECTED_TOKEN_CACHE_SIZE", default=10000, cast=int)
+FIREBASE_REJECTED_TOKEN_CACHE_TTL = config("FIREBASE_REJECTED_TOKEN_CACHE_TTL", default=60, cast=int)
+# Calls to Google (SDK verification, signing key fetches) go through
+# user.resilience: at most MAX_CONCURRENT_CALLS in flight (waiting up to
+# QUEUE_TIMEOUT seconds for a slot), each abandoned after CALL_TIMEOUT
+# seconds. BREAKER_FAILURES failures in a row open the circuit breaker for
+# BREAKER_RESET seconds; meanwhile new tokens get 503 and already verified
+# tokens keep working from the cache.
+FIREBASE_MAX_CONCURRENT_CALLS = config("FIREBASE_MAX_CONCURRENT_CALLS", default=8, cast=int)
+FIREBASE_QUEUE_TIMEOUT = config("FIREBASE_QUEUE_TIMEOUT", default=0.5, cast=float)
+FIREBASE_CALL_TIMEOUT = config("FIREBASE_CALL_TIMEOUT", default=5.0, cast=float)
+FIREBASE_BREAKER_FAILURES = config("FIREBASE_BREAKER_FAILURES", default=5, cast=int)
+FIREBASE_BREAKER_RESET = config("FIREBASE_BREAKER_RESET", default=30, cast=int)
 
 # 4. Installed apps
 INSTALLED_APPS = [
@@ -48,6 +68,11 @@ INSTALLED_APPS = [
 
 # 5. Middleware
 MIDDLEWARE = [
+    # First, so its timings cover the whole middleware stack.
+    "user.instrumentation.RequestTimingMiddleware",
+    "user.log.RequestIdMiddleware",
+    # Before sessions/auth, so a throttled request is rejected for almost nothing.
+    "user.throttling.RateLimitMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -58,6 +83,17 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-stage timings (verify, db, serialize, render, ...) are always recorded in
+# the /metrics histograms; this controls echoing them in a Server-Timing header.
+# Off unless DEBUG: the header tells any client how long verification, queries
+# and hashing took.
+SERVER_TIMING_HEADER = config("SERVER_TIMING_HEADER", default=DEBUG, cast=bool)
+# /metrics is only served to these client IPs (comma-separated; resolved like
+# RATE_LIMIT_CLIENT_IP_HEADER) and to "Authorization: Bearer <METRICS_TOKEN>".
+# With neither set it is open only when DEBUG is on.
+METRICS_ALLOWED_IPS = config("METRICS_ALLOWED_IPS", default="", cast=Csv())
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+
 ROOT_URLCONF = "profiles.urls"
 
 TEMPLATES = [
@@ -78,25 +114,197 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "profiles.wsgi.application"
 
-# 6. Database
-DATABASES = {
-    "default": {
+# 6. Database: SQLite by default, DB_ENGINE=postgres for PostgreSQL.
+DB_ENGINE = config("DB_ENGINE", default="sqlite")
+if DB_ENGINE == "postgres":
+    _db = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": config("DB_NAME", default="profiles"),
+        "USER": config("DB_USER", default="postgres"),
+        "PASSWORD": config("DB_PASSWORD", default=""),
+        "HOST": config("DB_HOST", default="localhost"),
+        "PORT": config("DB_PORT", default="5432"),
+        # Persistent connections, re-checked before reuse.
+        "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=60, cast=int),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
+    }
+    # psycopg 3 connection pool (needs psycopg[pool]); replaces CONN_MAX_AGE.
+    DB_POOL_MAX_SIZE = config("DB_POOL_MAX_SIZE", default=0, cast=int)
+    if DB_POOL_MAX_SIZE:
+        _db["CONN_MAX_AGE"] = 0
+        _db["OPTIONS"]["pool"] = {
+            "min_size": config("DB_POOL_MIN_SIZE", default=2, cast=int),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": config("DB_POOL_TIMEOUT", default=10, cast=int),
+        }
+else:
+    _db = {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": config("DB_NAME", default=str(BASE_DIR / "db.sqlite3")),
+        "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=0, cast=int),
+    }
+    # Single-node tuning, applied on every connection: WAL lets reads run
+    # alongside the writer, busy_timeout waits for the write lock instead of
+    # failing at once, and IMMEDIATE transactions take that lock up front
+    # rather than failing on a read->write upgrade mid-transaction.
+    if config("DB_SQLITE_TUNING", default=True, cast=bool):
+        _db["OPTIONS"] = {
+            "init_command": ";".join([
+                "PRAGMA journal_mode=WAL",
+                f"PRAGMA busy_timeout={config('DB_SQLITE_BUSY_TIMEOUT_MS', default=5000, cast=int)}",
+                "PRAGMA synchronous=NORMAL",
+                f"PRAGMA mmap_size={config('DB_SQLITE_MMAP_SIZE', default=128 * 1024 * 1024, cast=int)}",
+            ]),
+            "transaction_mode": "IMMEDIATE",
+        }
+DATABASES = {"default": _db}
+
+# Read replica: set DB_REPLICA_HOST (Postgres) and/or DB_REPLICA_NAME (e.g. a
+# second SQLite file locally) to add a "replica" alias. Read-only profile
+# lookups go there (user.routers); everything else stays on "default".
+DB_REPLICA_HOST = config("DB_REPLICA_HOST", default="")
+DB_REPLICA_NAME = config("DB_REPLICA_NAME", default="")
+if DB_REPLICA_HOST or DB_REPLICA_NAME:
+    DATABASES["replica"] = {
+        **_db,
+        "NAME": DB_REPLICA_NAME or _db["NAME"],
+        "TEST": {"MIRROR": "default"},
+    }
+    if DB_REPLICA_HOST:
+        DATABASES["replica"]["HOST"] = DB_REPLICA_HOST
+DATABASE_ROUTERS = ["user.routers.PrimaryReplicaRouter"]
+# Writes that still hit "database is locked" are retried with jittered
+# exponential backoff (user.retry).
+DB_LOCK_RETRY_ATTEMPTS = config("DB_LOCK_RETRY_ATTEMPTS", default=5, cast=int)
+DB_LOCK_RETRY_BASE_DELAY = config("DB_LOCK_RETRY_BASE_DELAY", default=0.05, cast=float)
+DB_LOCK_RETRY_MAX_DELAY = config("DB_LOCK_RETRY_MAX_DELAY", default=1.0, cast=float)
+# Reads of a just-written user stay on the primary this long (replica lag).
+DATABASE_REPLICA_STICKY_SECONDS = config("DATABASE_REPLICA_STICKY_SECONDS", default=5, cast=int)
+
+# 6b. Cache: in-process locmem by default, Redis when REDIS_URL is set
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "profiles",
+        }
     }
+
+# Serialized profiles served by GET /api/user/profile/ and /profile/<pk>/
+PROFILE_CACHE_ALIAS = config("PROFILE_CACHE_ALIAS", default="default")
+PROFILE_CACHE_TTL = config("PROFILE_CACHE_TTL", default=300, cast=int)
+# Firebase uids without a profile are remembered as missing this long.
+PROFILE_MISSING_CACHE_TTL = config("PROFILE_MISSING_CACHE_TTL", default=30, cast=int)
+PROFILE_BATCH_MAX_IDS = config("PROFILE_BATCH_MAX_IDS", default=300, cast=int)
+
+# Bulk profile import (POST /api/user/profiles/bulk/, manage.py import_profiles).
+# The endpoint hashes through the shared PASSWORD_HASHING_WORKERS pool (8b);
+# HASH_WORKERS sizes the command's own pool.
+BULK_IMPORT_CHUNK_SIZE = config("BULK_IMPORT_CHUNK_SIZE", default=500, cast=int)
+BULK_IMPORT_HASH_WORKERS = config("BULK_IMPORT_HASH_WORKERS", default=os.cpu_count() or 1, cast=int)
+
+# Streaming profile export (GET /api/user/profiles/export/, manage.py
+# export_profiles): rows fetched per database round trip.
+EXPORT_CHUNK_SIZE = config("EXPORT_CHUNK_SIZE", default=2000, cast=int)
+
+# 6c. Rate limits per URL name (user/urls.py), checked by user.throttling:
+# ip/email rules before any Firebase verification or password hashing, uid
+# rules once the token's signature has been verified. Rules are
+# "<ip|uid|email>:<count>/<s|m|h|d>" over a sliding window. "memory" counts
+# per process; "cache" shares the counters through RATE_LIMIT_CACHE_ALIAS.
+RATE_LIMIT_ENABLED = config("RATE_LIMIT_ENABLED", default=True, cast=bool)
+RATE_LIMIT_BACKEND = config("RATE_LIMIT_BACKEND", default="cache" if REDIS_URL else "memory")
+RATE_LIMIT_CACHE_ALIAS = config("RATE_LIMIT_CACHE_ALIAS", default="default")
+# Set to e.g. HTTP_X_FORWARDED_FOR only behind a proxy that overwrites it.
+RATE_LIMIT_CLIENT_IP_HEADER = config("RATE_LIMIT_CLIENT_IP_HEADER", default="")
+_LOGIN_LIMITS = ["ip:60/m", "uid:20/m"]
+_CREATE_LIMITS = ["ip:20/m", "uid:5/m"]
+RATE_LIMITS = {
+    "firebase_login_api": _LOGIN_LIMITS,
+    "async_firebase_login_api": _LOGIN_LIMITS,
+    "create_user_profile_api": _CREATE_LIMITS,
+    "async_create_user_profile_api": _CREATE_LIMITS,
+    "reset_password_api": ["ip:10/m", "uid:5/m", "email:5/h"],
 }
 
+# 6d. Transactional outbox of profile changes (user.outbox), published by
+# "manage.py relay_outbox" to OUTBOX_SINK: an http(s) webhook URL, or a
+# JSON Lines file path.
+OUTBOX_SINK = config("OUTBOX_SINK", default=str(BASE_DIR / "outbox.jsonl"))
+OUTBOX_BATCH_SIZE = config("OUTBOX_BATCH_SIZE", default=100, cast=int)
+OUTBOX_FLUSH_INTERVAL = config("OUTBOX_FLUSH_INTERVAL", default=1.0, cast=float)
+OUTBOX_WEBHOOK_TIMEOUT = config("OUTBOX_WEBHOOK_TIMEOUT", default=5, cast=float)
+# Published events are deleted after this many hours.
+OUTBOX_RETENTION_HOURS = config("OUTBOX_RETENTION_HOURS", default=168, cast=int)
+
+# 6e. Background jobs (user.jobs): a queue in the database, run by
+# "manage.py runworker". Failed jobs retry with jittered exponential backoff;
+# a running job whose worker stops is requeued after JOB_LEASE_SECONDS.
+JOB_CONCURRENCY = config("JOB_CONCURRENCY", default=4, cast=int)
+JOB_POLL_INTERVAL = config("JOB_POLL_INTERVAL", default=1.0, cast=float)
+JOB_MAX_ATTEMPTS = config("JOB_MAX_ATTEMPTS", default=5, cast=int)
+JOB_RETRY_BASE_DELAY = config("JOB_RETRY_BASE_DELAY", default=5, cast=float)
+JOB_RETRY_MAX_DELAY = config("JOB_RETRY_MAX_DELAY", default=600, cast=float)
+JOB_LEASE_SECONDS = config("JOB_LEASE_SECONDS", default=300, cast=int)
+# Finished jobs are deleted after this many hours.
+JOB_RETENTION_HOURS = config("JOB_RETENTION_HOURS", default=168, cast=int)
+
+# Emails sent by background jobs (user.tasks). The console backend prints
+# them; set EMAIL_BACKEND to django.core.mail.backends.smtp.EmailBackend
+# (plus EMAIL_HOST etc.) to deliver.
+EMAIL_BACKEND = config("EMAIL_BACKEND", default="django.core.mail.backends.console.EmailBackend")
+EMAIL_HOST = config("EMAIL_HOST", default="localhost")
+EMAIL_PORT = config("EMAIL_PORT", default=25, cast=int)
+EMAIL_HOST_USER = config("EMAIL_HOST_USER", default="")
+EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD", default="")
+EMAIL_USE_TLS = config("EMAIL_USE_TLS", default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config("DEFAULT_FROM_EMAIL", default="no-reply@localhost")
+
 # 7. Authentication
 AUTH_USER_MODEL = 'user.CustomUser'
+# The slim auth record (id, uid, active/staff/superuser flags and permission
+# set) is cached under PROFILE_CACHE_ALIAS this long (user.principal).
+AUTH_PRINCIPAL_CACHE_TTL = config("AUTH_PRINCIPAL_CACHE_TTL", default=300, cast=int)
+# last_login is written at most once per this many seconds per user (user.login).
+LAST_LOGIN_UPDATE_INTERVAL = config("LAST_LOGIN_UPDATE_INTERVAL", default=900, cast=int)
 
 # 8. Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator', 'OPTIONS': {'min_length': 8}},
-    {'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator'},
+    # Django's list, loaded once per process into a shared frozenset.
+    {'NAME': 'user.validators.CommonPasswordValidator'},
     {'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator'},
 ]
 
+# 8b. Password hashing. PASSWORD_HASHER picks the algorithm for new hashes; the
+# others stay listed so existing hashes still verify (and upgrade on login).
+# "argon2" needs the argon2-cffi package.
+_PASSWORD_HASHERS = {
+    "argon2": "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "scrypt": "django.contrib.auth.hashers.ScryptPasswordHasher",
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+}
+PASSWORD_HASHER = config("PASSWORD_HASHER", default="pbkdf2")
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ["django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher"]
+# Hashes run in a process pool off the request thread (0 = inline). Beyond
+# MAX_PENDING queued/running hashes, requests get 503 + Retry-After.
+PASSWORD_HASHING_WORKERS = config("PASSWORD_HASHING_WORKERS", default=os.cpu_count() or 1, cast=int)
+PASSWORD_HASHING_MAX_PENDING = config("PASSWORD_HASHING_MAX_PENDING", default=4 * (os.cpu_count() or 1), cast=int)
+PASSWORD_HASHING_TIMEOUT = config("PASSWORD_HASHING_TIMEOUT", default=30, cast=int)
+PASSWORD_HASHING_RETRY_AFTER = config("PASSWORD_HASHING_RETRY_AFTER", default=1, cast=int)
+
 # 9. Internationalization
 LANGUAGE_CODE = "en-us"
 TIME_ZONE = "Africa/Lagos"
@@ -111,16 +319,21 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 # 12. Django REST Framework (optional customization)
+# "orjson" renders/parses API JSON with orjson (same output, falls back to the
+# stdlib when it isn't installed); "json" uses DRF's stdlib classes.
+API_JSON_BACKEND = config("API_JSON_BACKEND", default="orjson")
+_ORJSON = API_JSON_BACKEND == "orjson"
+
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "user.authentication.FirebaseAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": [],
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "user.renderers.ORJSONRenderer" if _ORJSON else "user.renderers.TimedJSONRenderer",
     ],
     'DEFAULT_PARSER_CLASSES': [
-        'rest_framework.parsers.JSONParser',
+        'user.renderers.ORJSONParser' if _ORJSON else 'rest_framework.parsers.JSONParser',
     ],
     'EXCEPTION_HANDLER': 'user.firebase_utils.custom_exception_handler',
     
@@ -129,24 +342,34 @@ REST_FRAMEWORK = {
 # 13. CORS
 CORS_ALLOW_ALL_ORIGINS = True  # consider setting this to False in production
 
-# 14. Logging configuration
-import logging.config
+# 14. Logging: JSON lines (LOG_FORMAT=text for plain lines) written from a
+# background thread, with request IDs and passwords/tokens/claims redacted.
+LOG_LEVEL = config("LOG_LEVEL", default="INFO")
+LOG_FORMAT = config("LOG_FORMAT", default="json")
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    
+
+    'filters': {
+        'request_id': {'()': 'user.log.RequestIdFilter'},
+        'redact': {'()': 'user.log.RedactingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'user.log.JsonFormatter'},
+        'text': {'format': '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'},
+    },
     'handlers': {
-        'console': {
-            'class': 'logging.StreamHandler',
+        'background': {
+            'class': 'user.log.BackgroundHandler',
+            'filters': ['request_id', 'redact'],
+            'formatter': LOG_FORMAT,
         },
     },
 
     'loggers': {
         '': {  # root logger
-            'handlers': ['console'],
-            'level': 'DEBUG',
+            'handlers': ['background'],
+            'level': LOG_LEVEL,
         },
     },
 }
-
-                
\ No newline at end of file
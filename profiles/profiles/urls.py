@@ -18,11 +18,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
+from user.metrics import metrics_view
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path("api/test-connection/", lambda request: JsonResponse({"message": "Connected ✅"})),
+    path("metrics", metrics_view, name="metrics"),
 ]
     # Include the user app's URLs for user profile management
\ No newline at end of file
@@ -2,6 +2,9 @@
 from django.contrib import admin
 from .models import CustomUser
 
-admin.site.register(CustomUser)
+
+@admin.register(CustomUser)
+class CustomUserAdmin(admin.ModelAdmin):
+    ordering = ['email']
 
 # Register your models here.
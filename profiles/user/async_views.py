@@ -0,0 +1,190 @@
+"""
+ASGI-native versions of the profile read, create/upsert and firebase-login
+endpoints.
+
+These are plain async Django views rather than DRF views, so under ASGI they
+run on the event loop without a per-request thread handoff. Token
+verification is served from the verified-token cache when possible and
+otherwise runs in a worker thread; profile reads use the async cache and ORM
+APIs. The sync endpoints in ``views.py`` are unchanged.
+"""
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import serializers
+
+from . import profile_cache
+from .firebase_utils import averify_firebase_id_token
+from .hashing import HashingUnavailable
+from .instrumentation import stage
+from .login import aget_login_user, atouch_last_login
+from .resilience import FirebaseUnavailable
+from .throttling import RateLimited
+from .routers import replica_reads
+from .serializers import UserProfileCreateSerializer
+from .views import upsert_profile
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_CREATE_FIELDS = ['first_name', 'last_name', 'phone_number', 'password', 'retype_password']
+
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def unavailable(exc):
+    """503 + Retry-After for ``HashingUnavailable``/``FirebaseUnavailable``."""
+    response = error(str(exc.detail), 503)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def rate_limited(exc):
+    """429 + Retry-After for a verified uid over its ``RATE_LIMITS``."""
+    response = error(str(exc.detail), 429)
+    response['Retry-After'] = str(exc.wait)
+    return response
+
+
+def profile_response(request, entry):
+    with stage('render'):
+        response = JsonResponse(entry['data'])
+    response['ETag'] = entry['etag']
+    last_modified = entry['last_modified']
+    if last_modified is not None:
+        last_modified = int(last_modified)
+        response['Last-Modified'] = http_date(last_modified)
+    return get_conditional_response(
+        request, etag=entry['etag'], last_modified=last_modified, response=response
+    )
+
+
+def parse_json(request):
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+class AsyncFirebaseView(View):
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except FirebaseUnavailable as e:
+            return unavailable(e)
+        except RateLimited as e:
+            return rate_limited(e)
+
+    async def verify_bearer_token(self, request):
+        """Decoded claims for the request's Bearer token, or None."""
+        auth_header = request.headers.get('Authorization', '')
+        if not auth_header.startswith('Bearer '):
+            return None
+        try:
+            return await averify_firebase_id_token(auth_header[7:], request=request)
+        except ValueError as e:
+            logger.warning("Token verification failed: %s", e)
+            return None
+
+
+class AsyncCurrentUserProfileView(AsyncFirebaseView):
+    """GET /api/user/async/profile/"""
+
+    async def get(self, request):
+        claims = await self.verify_bearer_token(request)
+        if claims is None:
+            return error('Authorization header missing or invalid.', 401)
+        with replica_reads(firebase_uid=claims['uid']):
+            entry = await profile_cache.aget_profile(firebase_uid=claims['uid'])
+        if entry is None:
+            return error('Profile not found.', 404)
+        return profile_response(request, entry)
+
+
+class AsyncUserProfileRetrieveView(AsyncFirebaseView):
+    """GET /api/user/async/profile/<pk>/"""
+
+    async def get(self, request, pk):
+        claims = await self.verify_bearer_token(request)
+        if claims is None:
+            return error('Authorization header missing or invalid.', 401)
+        # Same rule as IsFirebaseAuthenticated: the caller must have a profile.
+        with replica_reads(firebase_uid=claims['uid']):
+            caller = await profile_cache.aget_profile(firebase_uid=claims['uid'])
+        if caller is None:
+            return error('Profile not found for this account.', 403)
+        with replica_reads(pk=pk):
+            entry = await profile_cache.aget_profile(pk=pk)
+        if entry is None:
+            return error('Profile not found.', 404)
+        return profile_response(request, entry)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserProfileCreateView(AsyncFirebaseView):
+    """POST /api/user/async/profile/create/"""
+
+    async def post(self, request):
+        claims = await self.verify_bearer_token(request)
+        if claims is None:
+            return error('Authorization header missing or invalid.', 401)
+
+        data = parse_json(request)
+        if data is None:
+            return error('Request body must be a JSON object.', 400)
+        missing_fields = [field for field in REQUIRED_CREATE_FIELDS if not data.get(field)]
+        if missing_fields:
+            return error(f"Missing required fields: {missing_fields}", 400)
+
+        data['firebase_uid'] = claims['uid']
+        data['email'] = claims.get('email', '')
+        try:
+            # Validation, hashing and the write run together in one thread hop.
+            instance = await sync_to_async(upsert_profile)(data)
+        except HashingUnavailable as e:
+            return unavailable(e)
+        except serializers.ValidationError as e:
+            return error(f"Invalid data: {e}", 400)
+        except Exception as e:
+            logger.exception("Error occurred while creating user profile")
+            return error(f"Failed to create user profile: {e}", 500)
+        with stage('serialize'):
+            data = UserProfileCreateSerializer(instance).data
+        with stage('render'):
+            return JsonResponse(data, status=201)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncFirebaseLoginView(AsyncFirebaseView):
+    """POST /api/user/async/firebase-login/"""
+
+    async def post(self, request):
+        data = parse_json(request)
+        id_token = data.get('id_token') if data else None
+        if not id_token:
+            return error('ID token required.', 400)
+        try:
+            user_info = await averify_firebase_id_token(id_token, request=request)
+        except ValueError as e:
+            return error(str(e), 401)
+
+        uid = user_info['uid']
+        email = user_info.get('email')
+        user, created = await aget_login_user(user_info)
+        await atouch_last_login(user)
+        return JsonResponse({
+            'message': 'Login successful.',
+            'uid': uid,
+            'email': email,
+            'created': created,
+            'full_name': f"{user.first_name} {user.last_name}" if user.last_name else user.first_name,
+        })
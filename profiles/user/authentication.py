@@ -1,7 +1,11 @@
-from firebase_admin import   auth
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
-from .models import CustomUser
+from .firebase_utils import verify_firebase_id_token
+from .login import get_login_user
+from .principal import cached_principal, principal_for
+from .resilience import FirebaseUnavailable
+from .throttling import RateLimited
+from .token_cache import remember_principal, remembered_principal
 
 
 class FirebaseAuthentication(BaseAuthentication):
@@ -12,7 +16,9 @@ class FirebaseAuthentication(BaseAuthentication):
 
         id_token = auth_header.split(' ').pop()
         try:
-             decoded_token = auth.verify_id_token(id_token)
+             decoded_token = verify_firebase_id_token(id_token, request=request)
+        except (FirebaseUnavailable, RateLimited):
+            raise  # 503/429 + Retry-After, not a bad token
         except Exception as e:
             raise AuthenticationFailed(f"Invalid Firebase token: {str(e)}")
 
@@ -22,9 +28,14 @@ class FirebaseAuthentication(BaseAuthentication):
         if not uid or not email:
             raise AuthenticationFailed("Invalid Firebase token payload")
 
-        user, _ = CustomUser.objects.get_or_create(
-            firebase_uid=uid,
-            defaults={"email": email}
-        )
+        # request.user is a slim cached Principal, not a CustomUser row. On a
+        # cache miss the login lookup (read-only unless the uid is new) fills
+        # it, and leaves the row for the views of this request.
+        principal = remembered_principal(request, uid) or cached_principal(uid)
+        if principal is None:
+            user, _ = get_login_user(decoded_token, request=request)
+            principal = principal_for(user)
+        # Shared with IsFirebaseAuthenticated for this request.
+        remember_principal(request, principal)
 
-        return (user, None)
+        return (principal, decoded_token)
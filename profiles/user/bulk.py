@@ -0,0 +1,202 @@
+"""
+Bulk profile import for batch onboarding.
+
+Rows arrive as JSON Lines or CSV, are validated with the
+``UserProfileCreateSerializer`` rules (one serializer instance for the
+whole import, via ``validators.BatchValidator``), have their passwords hashed
+by a ``hashing.PasswordHashingService`` (the shared one for HTTP imports, one
+of ``workers`` processes for the management command) and are upserted in chunks with a single
+``bulk_create(update_conflicts=True)`` per key: ``firebase_uid`` when the row
+has one, ``email`` otherwise. Every rejected row is reported with its line
+number and errors; a chunk that trips a database constraint is retried row by
+row so one bad row does not sink its neighbours.
+"""
+import csv
+import json
+import logging
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import jobs, outbox, profile_cache, routers, tasks
+from .hashing import PasswordHashingService
+from .models import CustomUser
+from .serializers import BulkProfileRowSerializer
+from .validators import BatchValidator
+
+logger = logging.getLogger(__name__)
+
+UPSERT_FIELDS = ['email', 'first_name', 'last_name', 'phone_number', 'password', 'updated_at']
+
+
+def _text_lines(stream):
+    if isinstance(stream, (bytes, str)):
+        stream = stream.splitlines(keepends=True)
+    for line in stream:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def iter_rows(stream, fmt='jsonl'):
+    """
+    Yield ``(line_number, row)`` pairs from a file, an ``HttpRequest`` or any
+    iterable of lines. Lines that are not JSON objects yield ``row=None``.
+    """
+    lines = _text_lines(stream)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if value not in (None, '')}
+        return
+
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+class BulkImporter:
+    def __init__(self, chunk_size=None, workers=None, hashing_service=None):
+        self.chunk_size = chunk_size or getattr(settings, 'BULK_IMPORT_CHUNK_SIZE', 500)
+        self.workers = getattr(settings, 'BULK_IMPORT_HASH_WORKERS', os.cpu_count()) if workers is None else workers
+        # Hash through this service; without one, run() starts one of ``workers`` processes.
+        self.hashing_service = hashing_service
+        self.report = {'total': 0, 'created': 0, 'updated': 0, 'errors': []}
+        self.validator = BatchValidator(BulkProfileRowSerializer)
+
+    def run(self, rows):
+        """Import ``(line_number, row)`` pairs and return the report."""
+        service = self.hashing_service
+        if service is None:
+            service = PasswordHashingService(
+                workers=self.workers, timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 30),
+            )
+        try:
+            rows = iter(rows)
+            while chunk := list(islice(rows, self.chunk_size)):
+                self._import_chunk(chunk, service)
+        finally:
+            if service is not self.hashing_service:
+                service.shutdown(wait=True)
+        return self.report
+
+    def _error(self, line_number, errors):
+        self.report['errors'].append({'row': line_number, 'errors': errors})
+
+    def _validate(self, chunk):
+        valid = []
+        seen = set()
+        for line_number, row in chunk:
+            self.report['total'] += 1
+            if row is None:
+                self._error(line_number, {'non_field_errors': ['Row is not a JSON object.']})
+                continue
+            data, errors = self.validator.validate(row)
+            if errors is not None:
+                self._error(line_number, errors)
+                continue
+            data = dict(data)
+            data.pop('retype_password', None)
+            data['email'] = CustomUser.objects.normalize_email(data['email'])
+            key = data.get('firebase_uid') or data['email']
+            if key in seen:
+                self._error(line_number, {'non_field_errors': ['Duplicate row in this batch.']})
+                continue
+            seen.add(key)
+            valid.append((line_number, data))
+        return valid
+
+    def _import_chunk(self, chunk, hashing_service):
+        valid = self._validate(chunk)
+        if not valid:
+            return
+
+        passwords = [data.pop('password') for _, data in valid]
+        hashed = hashing_service.hash_many(passwords)
+        users = [CustomUser(password=encoded, **data) for (_, data), encoded in zip(valid, hashed)]
+
+        existing = self._existing_keys(users)
+        for line_number, user in zip((n for n, _ in valid), users):
+            key = ('uid', user.firebase_uid) if user.firebase_uid else ('email', user.email)
+            user._bulk_created = key not in existing
+            user._bulk_line = line_number
+
+        by_uid = [user for user in users if user.firebase_uid]
+        by_email = [user for user in users if not user.firebase_uid]
+        for group, unique_field in ((by_uid, 'firebase_uid'), (by_email, 'email')):
+            if group:
+                self._upsert(group, unique_field)
+
+    def _existing_keys(self, users):
+        uids = [user.firebase_uid for user in users if user.firebase_uid]
+        emails = [user.email for user in users if not user.firebase_uid]
+        existing = {('uid', uid) for uid in CustomUser.objects.filter(firebase_uid__in=uids)
+                    .values_list('firebase_uid', flat=True)} if uids else set()
+        if emails:
+            existing |= {('email', email) for email in CustomUser.objects.filter(email__in=emails)
+                         .values_list('email', flat=True)}
+        return existing
+
+    def _upsert(self, users, unique_field):
+        update_fields = [field for field in UPSERT_FIELDS if field != unique_field]
+        try:
+            with transaction.atomic():
+                self._bulk_upsert(users, unique_field, update_fields)
+            imported = users
+        except IntegrityError:
+            imported = []
+            for user in users:
+                try:
+                    with transaction.atomic():
+                        self._bulk_upsert([user], unique_field, update_fields)
+                    imported.append(user)
+                except IntegrityError as e:
+                    self._error(user._bulk_line, {'non_field_errors': [f"Conflicts with an existing profile: {e}"]})
+
+        for user in imported:
+            self.report['created' if user._bulk_created else 'updated'] += 1
+        self._invalidate_cached_profiles(imported, unique_field)
+
+    def _bulk_upsert(self, users, unique_field, update_fields):
+        CustomUser.objects.bulk_create(
+            users,
+            update_conflicts=True,
+            unique_fields=[unique_field],
+            update_fields=update_fields,
+        )
+        # Same transaction as the upsert, like CustomUser.save does for single
+        # rows. bulk_create sends no post_save either, so the welcome emails
+        # signals.enqueue_welcome_email queues for other new profiles are
+        # queued here.
+        keys = [getattr(user, unique_field) for user in users]
+        created_ids = outbox.record_bulk(
+            CustomUser.objects.filter(**{f'{unique_field}__in': keys}),
+            created_keys={getattr(user, unique_field) for user in users if user._bulk_created},
+            key_field=unique_field,
+            changed=set(update_fields) - {'updated_at'},
+        )
+        if created_ids:
+            jobs.enqueue_many(tasks.WELCOME_EMAIL, [{'user_id': user_id} for user_id in created_ids])
+
+    def _invalidate_cached_profiles(self, users, unique_field):
+        # bulk_create skips post_save, so drop cached profiles (and pin the
+        # rows to the primary) here.
+        values = [getattr(user, unique_field) for user in users]
+        lookup = {f'{unique_field}__in': values}
+        for pk, firebase_uid in CustomUser.objects.filter(**lookup).values_list('pk', 'firebase_uid'):
+            profile_cache.invalidate(pk=pk, firebase_uid=firebase_uid)
+            routers.mark_written(pk=pk, firebase_uid=firebase_uid)
+
+
+def import_profiles(stream, fmt='jsonl', chunk_size=None, workers=None, hashing_service=None):
+    """
+    Import a JSON Lines or CSV stream of profiles and return the per-row
+    report. Pass ``hashing_service`` to hash through it; otherwise a service
+    of ``workers`` processes is started for this import.
+    """
+    return BulkImporter(chunk_size, workers, hashing_service).run(iter_rows(stream, fmt))
@@ -0,0 +1,83 @@
+"""
+The single place the Firebase Admin SDK is initialized.
+
+Nothing imports ``firebase_admin`` at module level: the default app is
+created from ``settings.FIREBASE_CREDENTIALS`` the first time something
+needs it (an ``"sdk"`` token verification), so ``manage.py`` commands,
+migrations and worker boot don't pay for it. ``prewarm`` does that work up
+front, and is called from ``wsgi.py``/``asgi.py`` when
+``FIREBASE_PREWARM`` is set.
+"""
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .token_verifier import InvalidFirebaseToken
+
+logger = logging.getLogger(__name__)
+
+# google.auth messages for "iat in the future" and "kid not in the current certificates".
+TRANSIENT_SDK_ERRORS = re.compile(r'Token used too early|Certificate for key id')
+
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_firebase_app():
+    """Return the default Firebase app, initializing it on first call."""
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                import firebase_admin
+                from firebase_admin import credentials
+
+                try:
+                    _app = firebase_admin.get_app()
+                except ValueError:
+                    path = settings.FIREBASE_CREDENTIALS
+                    if not os.path.exists(path):
+                        raise ImproperlyConfigured(f"Firebase credentials not found at: {path}")
+                    logger.debug("Initializing Firebase Admin SDK from %s", path)
+                    _app = firebase_admin.initialize_app(credentials.Certificate(path))
+    return _app
+
+
+def verify_id_token(id_token):
+    """``firebase_admin.auth.verify_id_token`` against the lazily created app."""
+    from firebase_admin import auth
+
+    from .resilience import get_firebase_guard
+
+    def verify():
+        try:
+            return auth.verify_id_token(id_token, app=get_firebase_app())
+        except auth.InvalidIdTokenError as e:
+            # Expired, revoked or malformed: the same token will always fail. Key
+            # fetch and other transient errors propagate unchanged, and clock
+            # skew or a not yet fetched key are rejected without being cached.
+            raise InvalidFirebaseToken(str(e), cacheable=not TRANSIENT_SDK_ERRORS.search(str(e))) from e
+
+    # Bounded, timed and behind the circuit breaker (FirebaseUnavailable).
+    return get_firebase_guard().call(verify)
+
+
+def prewarm():
+    """
+    Do the first-request work at worker start: initialize the SDK app for the
+    ``"sdk"`` verifier, or fetch the signing keys for the ``"local"`` one.
+    Failures are logged; the worker still boots and retries on first use.
+    """
+    try:
+        if getattr(settings, 'FIREBASE_TOKEN_VERIFIER', 'local') == 'sdk':
+            get_firebase_app()
+        else:
+            from .token_verifier import get_token_verifier
+
+            get_token_verifier().key_cache.refresh()
+    except Exception:
+        logger.exception("Firebase prewarm failed")
@@ -1,47 +1,120 @@
-import firebase_admin
-from firebase_admin import credentials, auth
-import os
 import logging
-from rest_framework.views import exception_handler
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from rest_framework.response import Response
 from rest_framework import status
+from . import firebase_client
+from .instrumentation import stage
+from .resilience import FirebaseUnavailable, note_cache_hit
+from .throttling import check_verified
+from .token_cache import (
+    NEGATIVE_CACHE_HITS,
+    NEGATIVE_CACHE_MISSES,
+    get_rejected_tokens,
+    get_token_cache,
+    request_memo,
+    token_digest,
+)
+from .token_verifier import InvalidFirebaseToken, get_token_verifier
 
 
 logger = logging.getLogger(__name__)
 
-# Path to your Firebase credentials JSON
-FIREBASE_CRED_PATH = os.path.join(
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
-    'firebase_credentials.json')
-try:
-    # Initialize Firebase Admin SDK with credentials
-    if not firebase_admin._apps:
-        logger.debug(f"Loading Firebase credentials from: {FIREBASE_CRED_PATH}")
-        cred = firebase_admin.credentials.Certificate(FIREBASE_CRED_PATH)
-        firebase_admin.initialize_app(cred)
-except Exception as e:
-    logger.error(f"Failed to initialize Firebase Admin SDK: {str(e)}")
-    raise
-
 # Function to verify Firebase ID Token and email verification status
-def verify_firebase_id_token(id_token):
-    try:
-        decoded_token = auth.verify_id_token(id_token)
-        logger.debug(f"Decoded Firebase token: {decoded_token}")
+def verify_firebase_id_token(id_token, request=None):
+    """
+    Verify ``id_token`` and return its decoded claims.
+
+    Successful verifications are cached until the token expires, rejections
+    for ``FIREBASE_REJECTED_TOKEN_CACHE_TTL`` seconds; passing the current
+    ``request`` also memoizes the result for the rest of that request.
+    Raises ``FirebaseUnavailable`` when Google can't be reached in time (see
+    ``user.resilience``); cached tokens are still accepted then. With
+    ``request``, raises ``throttling.RateLimited`` when the verified uid is
+    over a ``uid`` rate limit of the request's URL.
+    """
+    digest = token_digest(id_token)
+    memo = request_memo(request) if request is not None else None
+    if memo is not None and digest in memo:
+        return memo[digest]
+
+    cache = get_token_cache()
+    decoded_token = cache.get(digest)
+    if decoded_token is None:
+        rejected = get_rejected_tokens()
+        reason = rejected.get(digest)
+        if reason is not None:
+            NEGATIVE_CACHE_HITS.inc(kind='token')
+            raise ValueError(f"Invalid Firebase ID token: {reason}")
+        try:
+            # "local" checks signatures against cached Google certificates in-process,
+            # "sdk" defers to firebase_admin and its own certificate handling.
+            with stage('verify'):
+                if getattr(settings, 'FIREBASE_TOKEN_VERIFIER', 'local') == 'sdk':
+                    decoded_token = firebase_client.verify_id_token(id_token)
+                else:
+                    decoded_token = get_token_verifier().verify(id_token)
+            logger.debug("Verified Firebase token for uid %s", decoded_token.get('uid'))
 
-        # 🚫 Check if the user's email has been verified, commenting to temporarly bypass email verification
-        # if not decoded_token.get('email_verified'):
-        #     raise ValueError("Email not verified. Please verify your email before continuing.")
+            # 🚫 Check if the user's email has been verified, commenting to temporarly bypass email verification
+            # if not decoded_token.get('email_verified'):
+            #     raise ValueError("Email not verified. Please verify your email before continuing.")
 
-        return decoded_token
+        except InvalidFirebaseToken as e:
+            # Only definite rejections are remembered; a failed key fetch, an
+            # unknown key id or clock skew may pass next time.
+            if e.cacheable:
+                NEGATIVE_CACHE_MISSES.inc(kind='token')
+                rejected.set(digest, str(e))
+            raise ValueError(f"Invalid Firebase ID token: {e}")
+        except FirebaseUnavailable:
+            raise
+        except Exception as e:
+            raise ValueError(f"Invalid Firebase ID token: {e}")
+        cache.set(digest, decoded_token)
+    else:
+        note_cache_hit()
 
-    except Exception as e:
-        raise ValueError(f"Invalid Firebase ID token: {e}")
+    if request is not None:
+        # uid rate limits are only ever charged to a verified uid.
+        check_verified(request, decoded_token)
+    if memo is not None:
+        memo[digest] = decoded_token
+    return decoded_token
+
+async def averify_firebase_id_token(id_token, request=None):
+    """
+    Async counterpart of ``verify_firebase_id_token``. Cache hits (positive
+    and negative) are served on the event loop; only a real verification (which may fetch signing keys)
+    runs in a worker thread.
+    """
+    digest = token_digest(id_token)
+    memo = request_memo(request) if request is not None else None
+    if memo is not None and digest in memo:
+        return memo[digest]
+    decoded_token = get_token_cache().get(digest)
+    if decoded_token is None:
+        reason = get_rejected_tokens().get(digest)
+        if reason is not None:
+            NEGATIVE_CACHE_HITS.inc(kind='token')
+            raise ValueError(f"Invalid Firebase ID token: {reason}")
+        decoded_token = await sync_to_async(verify_firebase_id_token, thread_sensitive=False)(id_token)
+    else:
+        note_cache_hit()
+    if request is not None:
+        check_verified(request, decoded_token)
+    if memo is not None:
+        memo[digest] = decoded_token
+    return decoded_token
 
 def custom_exception_handler(exc, context):
     """
     Custom exception handler to return a more user-friendly error response.
     """
+    # Imported here: rest_framework.views loads DEFAULT_AUTHENTICATION_CLASSES,
+    # which imports this module through user.authentication.
+    from rest_framework.views import exception_handler
+
     response = exception_handler(exc, context)
     if response is None:
         return Response({'error': str(exc)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
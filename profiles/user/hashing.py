@@ -0,0 +1,221 @@
+"""
+Password hashing off the request thread.
+
+Hashes are computed by ``make_password`` (so ``PASSWORD_HASHERS[0]`` picks the
+algorithm) in a bounded process pool. The request thread only waits on a
+future, which releases the GIL for other requests in the same worker. When
+``PASSWORD_HASHING_MAX_PENDING`` hashes are already queued or running, new
+requests fail fast with ``HashingUnavailable`` (503 + Retry-After) instead of
+piling up behind them. ``PASSWORD_HASHING_WORKERS = 0`` hashes inline.
+
+Workers are spawned, not forked: a fork of a threaded server process would
+copy its locks and open database and cache connections mid-use.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .instrumentation import stage
+from .metrics import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+HASH_SECONDS = Histogram(
+    'password_hash_seconds', 'Time spent computing one password hash.',
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+)
+HASH_REJECTED = Counter(
+    'password_hash_rejected_total', 'Hash requests refused because the pool was saturated.'
+)
+
+QUEUE_DEPTH = Gauge(
+    'password_hash_queue_depth', 'Password hashes queued or running.',
+    lambda: _service.queue_depth if _service is not None else 0,
+)
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Password hashing is saturated, please retry shortly.'
+    default_code = 'hashing_unavailable'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        # DRF's exception handler turns ``wait`` into a Retry-After header.
+        self.wait = wait
+
+
+def init_worker(settings_module, password_hashers=None):
+    """
+    Process pool initializer: spawned workers start a fresh interpreter and
+    need Django set up. ``password_hashers`` is the parent's setting, which
+    the settings module alone wouldn't reproduce once it's been overridden.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+
+    django.setup()
+    if password_hashers is not None:
+        settings.PASSWORD_HASHERS = password_hashers
+
+
+def _timed_make_password(raw_password):
+    started = time.perf_counter()
+    encoded = make_password(raw_password)
+    return encoded, time.perf_counter() - started
+
+
+class PasswordHashingService:
+    def __init__(self, workers=0, max_pending=None, timeout=30, retry_after=1):
+        self.workers = workers
+        self.max_pending = max_pending or max(workers, 1) * 4
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def queue_depth(self):
+        return self._pending
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=init_worker,
+                        initargs=(
+                            os.environ.get('DJANGO_SETTINGS_MODULE', 'profiles.settings'),
+                            list(settings.PASSWORD_HASHERS),
+                        ),
+                    )
+        return self._executor
+
+    def hash(self, raw_password):
+        if not self.workers:
+            self._acquire()
+            try:
+                encoded, seconds = _timed_make_password(raw_password)
+            finally:
+                self._release()
+            HASH_SECONDS.observe(seconds)
+            return encoded
+        return self._result(self._submit(raw_password))
+
+    def hash_many(self, raw_passwords):
+        """
+        Hash a batch (bulk import) in order, with at most ``workers`` of it in
+        the pool at a time. Its jobs count towards the pending limit, so
+        interactive requests see the load, but the batch itself waits for
+        the pool rather than being refused.
+        """
+        if not self.workers:
+            return [self.hash(raw_password) for raw_password in raw_passwords]
+        results = []
+        in_flight = deque()
+        try:
+            for raw_password in raw_passwords:
+                if len(in_flight) >= self.workers:
+                    results.append(self._result(in_flight.popleft()))
+                in_flight.append(self._submit(raw_password, reject=False))
+            while in_flight:
+                results.append(self._result(in_flight.popleft()))
+        finally:
+            for future in in_flight:
+                future.cancel()
+        return results
+
+    def _submit(self, raw_password, reject=True):
+        self._acquire(reject)
+        try:
+            future = self._get_executor().submit(_timed_make_password, raw_password)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the job really ends: a timed-out hash that is
+        # already running can't be cancelled and still holds a worker.
+        future.add_done_callback(self._release)
+        return future
+
+    def _result(self, future):
+        try:
+            encoded, seconds = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HashingUnavailable(self.retry_after, 'Password hashing timed out.')
+        HASH_SECONDS.observe(seconds)
+        return encoded
+
+    def _acquire(self, reject=True):
+        with self._lock:
+            if reject and self._pending >= self.max_pending:
+                HASH_REJECTED.inc()
+                raise HashingUnavailable(self.retry_after)
+            self._pending += 1
+
+    def _release(self, future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def shutdown(self, wait=False):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_hashing_service():
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = PasswordHashingService(
+                    workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 0),
+                    max_pending=getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', None),
+                    timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 30),
+                    retry_after=getattr(settings, 'PASSWORD_HASHING_RETRY_AFTER', 1),
+                )
+    return _service
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _service
+    if setting.startswith('PASSWORD_HASH'):
+        with _service_lock:
+            if _service is not None:
+                _service.shutdown()
+            _service = None
+
+
+def hash_password(raw_password):
+    with stage('hash'):
+        return get_hashing_service().hash(raw_password)
+
+
+def set_password(user, raw_password):
+    """Offloaded equivalent of ``user.set_password(raw_password)``."""
+    if raw_password is None:
+        user.set_unusable_password()
+        return
+    user.password = hash_password(raw_password)
+    # Lets AbstractBaseUser.save() notify password validators, as set_password does.
+    user._password = raw_password
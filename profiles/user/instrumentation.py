@@ -0,0 +1,134 @@
+"""
+Per-request stage timings.
+
+``RequestTimingMiddleware`` opens a ``RequestTimings`` for each request;
+code on the hot path marks its work with ``with stage('verify'):`` and every
+ORM query is counted and timed by a ``connection.execute_wrapper`` installed
+on each database connection. At the end of the request the timings are sent
+back as a ``Server-Timing`` header and folded into the latency histograms
+served at ``/metrics``, labelled with the URL name from ``user/urls.py``.
+
+The current timings live in a context variable, so async views and the
+threads ``sync_to_async`` runs them in report into the same request.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import Counter, Histogram
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Request latency by URL name.'
+)
+STAGE_SECONDS = Histogram(
+    'http_request_stage_seconds', 'Time spent per stage (verify, db, serialize, render, ...) by URL name.'
+)
+DB_QUERIES = Counter(
+    'http_request_db_queries_total', 'Database queries issued, by URL name.'
+)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def server_timing(self, total):
+        parts = []
+        for name, seconds in self.stages.items():
+            part = f'{name};dur={seconds * 1000:.2f}'
+            if name == 'db':
+                part += f';desc="{self.queries} queries"'
+            parts.append(part)
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Attribute the enclosed block's wall time to ``name`` for this request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+def query_timer(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.add('db', time.perf_counter() - started)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """``connection_created`` receiver: time every query on every connection."""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+class RequestTimingMiddleware:
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header_enabled = getattr(settings, 'SERVER_TIMING_HEADER', False)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings)
+
+    def finish(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        match = getattr(request, 'resolver_match', None)
+        url_name = (match.url_name if match else None) or 'unmatched'
+
+        REQUEST_SECONDS.observe(total, url_name=url_name, method=request.method)
+        for name, seconds in timings.stages.items():
+            STAGE_SECONDS.observe(seconds, url_name=url_name, stage=name)
+        if timings.queries:
+            DB_QUERIES.inc(timings.queries, url_name=url_name)
+        if self.header_enabled:
+            response['Server-Timing'] = timings.server_timing(total)
+        return response
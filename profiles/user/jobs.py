@@ -0,0 +1,250 @@
+"""
+Database-backed job queue for side effects that don't have to finish inside
+the request (emails, notifications).
+
+Tasks are plain functions registered with ``@task``; ``enqueue`` writes a
+``Job`` row, so a job enqueued inside a transaction exists only if that
+transaction commits, and no broker is needed beyond the database.
+``manage.py runworker`` runs ``Worker``, which claims due jobs with a
+conditional UPDATE (portable to SQLite), runs up to ``concurrency`` of them
+at once, and retries failures with jittered exponential backoff until
+``max_attempts``. A job whose worker died mid-run is requeued once its lease
+expires, so tasks run at least once and should be safe to repeat.
+
+An ``idempotency_key`` makes enqueueing idempotent: the second enqueue with
+the same key returns the first job instead of adding another.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import Counter
+from .models import Job
+from .retry import retry_on_lock
+
+logger = logging.getLogger(__name__)
+
+ENQUEUED = Counter('jobs_enqueued_total', 'Jobs added to the queue.')
+DUPLICATES = Counter('jobs_duplicate_total', 'Enqueues skipped because the idempotency key already existed.')
+SUCCEEDED = Counter('jobs_succeeded_total', 'Jobs that ran to completion.')
+RETRIED = Counter('jobs_retried_total', 'Failed job attempts scheduled to run again.')
+FAILED = Counter('jobs_failed_total', 'Jobs that failed on their last attempt.')
+
+# Seconds between requeueing expired leases and purging finished jobs.
+HOUSEKEEPING_INTERVAL = 60
+
+
+@dataclass(frozen=True)
+class Task:
+    name: str
+    func: object
+    queue: str = 'default'
+    max_attempts: int = None
+
+
+TASKS = {}
+
+
+def task(name, queue='default', max_attempts=None):
+    """Register the decorated function as the task ``name``."""
+
+    def decorator(func):
+        if name in TASKS:
+            raise ValueError(f"Task {name!r} is already registered")
+        TASKS[name] = Task(name, func, queue, max_attempts)
+        return func
+
+    return decorator
+
+
+def enqueue(name, *, key=None, delay=0, using=None, **kwargs):
+    """
+    Queue task ``name`` to run with ``kwargs`` (JSON-serializable) after
+    ``delay`` seconds; returns the ``Job``. With ``key``, returns the job
+    already queued under that key if there is one.
+    """
+    fields = _job_fields(name, kwargs, key, delay)
+    using = using or router.db_for_write(Job)
+    if key is None:
+        job = Job.objects.using(using).create(**fields)
+    else:
+        try:
+            with transaction.atomic(using=using):
+                job = Job.objects.using(using).create(**fields)
+        except IntegrityError:
+            DUPLICATES.inc()
+            return Job.objects.using(using).get(idempotency_key=key)
+    ENQUEUED.inc()
+    return job
+
+
+def enqueue_many(name, kwargs_list, *, delay=0, using=None):
+    """``enqueue`` for a batch (without idempotency keys), in one INSERT."""
+    jobs = [Job(**_job_fields(name, kwargs, None, delay)) for kwargs in kwargs_list]
+    jobs = Job.objects.using(using or router.db_for_write(Job)).bulk_create(jobs)
+    ENQUEUED.inc(len(jobs))
+    return jobs
+
+
+def _job_fields(name, kwargs, key, delay):
+    if name not in TASKS:
+        raise LookupError(f"Unknown task {name!r}")
+    registered = TASKS[name]
+    return {
+        'task': name,
+        'queue': registered.queue,
+        'kwargs': kwargs,
+        'idempotency_key': key,
+        'max_attempts': registered.max_attempts or getattr(settings, 'JOB_MAX_ATTEMPTS', 5),
+        'run_at': timezone.now() + timedelta(seconds=delay),
+    }
+
+
+def retry_delay(attempt):
+    """Seconds before retry number ``attempt`` (1-based): full-jitter exponential backoff."""
+    base_delay = getattr(settings, 'JOB_RETRY_BASE_DELAY', 5)
+    max_delay = getattr(settings, 'JOB_RETRY_MAX_DELAY', 600)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class Worker:
+    """
+    Runs queued jobs until stopped. With ``concurrency`` above 1 jobs run in
+    a thread pool (each thread uses its own database connection); with 1
+    they run in the calling thread.
+    """
+
+    def __init__(self, concurrency=None, queues=None, poll_interval=None, lease=None, retention=None,
+                 name=None, using=None):
+        if poll_interval is None:
+            poll_interval = getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+        if lease is None:
+            lease = timedelta(seconds=getattr(settings, 'JOB_LEASE_SECONDS', 300))
+        if retention is None:
+            retention = timedelta(hours=getattr(settings, 'JOB_RETENTION_HOURS', 168))
+        self.concurrency = concurrency or getattr(settings, 'JOB_CONCURRENCY', 4)
+        self.queues = list(queues or ['default'])
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retention = retention
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.using = using or router.db_for_write(Job)
+        self._stop = threading.Event()
+        self._housekeeping_at = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def jobs(self):
+        return Job.objects.using(self.using)
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due jobs as running by this worker and return them."""
+        if limit <= 0:
+            return []
+        now = timezone.now()
+        candidates = list(
+            self.jobs().filter(status=Job.QUEUED, queue__in=self.queues, run_at__lte=now)
+            .order_by('run_at', 'id').values_list('pk', flat=True)[:limit]
+        )
+        claimed = [
+            pk for pk in candidates
+            # Only one worker's UPDATE still finds the job queued.
+            if retry_on_lock(self.jobs().filter(pk=pk, status=Job.QUEUED).update, using=self.using)(
+                status=Job.RUNNING, locked_by=self.name, locked_at=now, attempts=F('attempts') + 1,
+            )
+        ]
+        return list(self.jobs().filter(pk__in=claimed).order_by('run_at', 'id')) if claimed else []
+
+    def execute(self, job):
+        """Run one claimed job and record the outcome."""
+        registered = TASKS.get(job.task)
+        try:
+            if registered is None:
+                raise LookupError(f"Unknown task {job.task!r}")
+            registered.func(**job.kwargs)
+        except Exception as e:
+            self.failed(job, e)
+        else:
+            SUCCEEDED.inc()
+            self.finish(job, status=Job.SUCCEEDED, finished_at=timezone.now(), last_error='')
+
+    def finish(self, job, **fields):
+        retry_on_lock(self.jobs().filter(pk=job.pk, locked_by=self.name).update, using=self.using)(
+            locked_by='', locked_at=None, **fields,
+        )
+
+    def failed(self, job, error):
+        message = f'{type(error).__name__}: {error}'[:1000]
+        if job.attempts >= job.max_attempts:
+            FAILED.inc()
+            logger.error("Job %s (%s) failed after %d attempts: %s", job.pk, job.task, job.attempts, message)
+            self.finish(job, status=Job.FAILED, finished_at=timezone.now(), last_error=message)
+            return
+        delay = retry_delay(job.attempts)
+        RETRIED.inc()
+        logger.warning("Job %s (%s) attempt %d failed, retrying in %.0fs: %s",
+                       job.pk, job.task, job.attempts, delay, message)
+        self.finish(job, status=Job.QUEUED, run_at=timezone.now() + timedelta(seconds=delay), last_error=message)
+
+    def _execute_in_thread(self, job):
+        try:
+            self.execute(job)
+        finally:
+            connections.close_all()
+
+    def housekeeping(self):
+        """Requeue (or fail) jobs whose lease expired and delete old finished jobs."""
+        now = timezone.now()
+        expired = self.jobs().filter(status=Job.RUNNING, locked_at__lt=now - self.lease)
+        expired.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.FAILED, finished_at=now, locked_by='', locked_at=None, last_error='Lease expired',
+        )
+        requeued = expired.update(status=Job.QUEUED, locked_by='', locked_at=None, last_error='Lease expired')
+        if requeued:
+            logger.warning("Requeued %d jobs whose worker stopped mid-run", requeued)
+        self.jobs().filter(finished_at__lt=now - self.retention).delete()
+
+    def run(self, once=False):
+        """
+        Process jobs until stopped (or, with ``once``, until none are due);
+        returns how many ran. A stop lets jobs already started finish.
+        """
+        processed = 0
+        running = set()
+        pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix='job') if self.concurrency > 1 else None
+        with pool or nullcontext():
+            while not self._stop.is_set():
+                if time.monotonic() - self._housekeeping_at >= HOUSEKEEPING_INTERVAL:
+                    self.housekeeping()
+                    self._housekeeping_at = time.monotonic()
+                jobs = self.claim(self.concurrency - len(running))
+                for job in jobs:
+                    if pool is None:
+                        self.execute(job)
+                        processed += 1
+                    else:
+                        running.add(pool.submit(self._execute_in_thread, job))
+                if running:
+                    done, running = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    processed += len(done)
+                elif not jobs:
+                    if once:
+                        break
+                    self._stop.wait(self.poll_interval)
+            if running:
+                wait(running)
+                processed += len(running)
+        return processed
@@ -0,0 +1,158 @@
+"""
+Logging plumbing: request IDs, redaction, JSON records and a queue handler.
+
+``BackgroundHandler`` formats a record on the calling thread and hands the
+finished line to a ``QueueListener`` thread that does the actual write, so a
+request never blocks on log I/O. ``RedactingFilter`` masks passwords, tokens
+and token claims (by key in dict arguments and ``extra``, and by pattern in
+the message) before anything is formatted, and ``RequestIdFilter`` stamps
+each record with the ID assigned by ``RequestIdMiddleware``. All three are
+wired up in ``settings.LOGGING``.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import re
+import sys
+import uuid
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+REDACTED = '[redacted]'
+SENSITIVE_KEYS = frozenset({
+    'password', 'retype_password', 'new_password', 'confirm_password',
+    'id_token', 'token', 'access_token', 'refresh_token', 'authorization',
+    'private_key', 'claims', 'decoded_token', 'user_info',
+})
+# A JWT (three base64url segments, header starting '{"') or a Bearer credential.
+SENSITIVE_PATTERN = re.compile(r'eyJ[\w-]+\.[\w-]+\.[\w-]+|(?<=Bearer )\S+')
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Attributes every LogRecord has; anything else on a record came from ``extra``.
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_request_id = contextvars.ContextVar('request_id', default='-')
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def redact(value):
+    """Copy of ``value`` with sensitive keys and token-like strings masked."""
+    if isinstance(value, Mapping):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, str):
+        return SENSITIVE_PATTERN.sub(REDACTED, value)
+    return value
+
+
+class RedactingFilter(logging.Filter):
+    def filter(self, record):
+        if isinstance(record.msg, str):
+            record.msg = SENSITIVE_PATTERN.sub(REDACTED, record.msg)
+        if record.args:
+            record.args = redact(record.args)
+        for key in record.__dict__.keys() - _RECORD_ATTRS:
+            value = record.__dict__[key]
+            record.__dict__[key] = REDACTED if key.lower() in SENSITIVE_KEYS else redact(value)
+        return True
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        request_id = _request_id.get()
+        if request_id == '-':
+            # django.request logs 4xx/5xx responses after RequestIdMiddleware
+            # has returned, but passes the request along.
+            request_id = getattr(getattr(record, 'request', None), 'request_id', None) or '-'
+        record.request_id = request_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra`` fields are included as-is."""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key in record.__dict__.keys() - _RECORD_ATTRS - {'request_id'}:
+            entry[key] = record.__dict__[key]
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Queue in front of a ``StreamHandler``. Filters and the formatter run on
+    the logging thread (``prepare``); the listener thread only writes lines.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(SimpleQueue())
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        self.target.close()
+        super().close()
+
+
+class RequestIdMiddleware:
+    """Takes ``X-Request-ID`` from the request (or makes one) and echoes it back."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def request_id(self, request):
+        incoming = request.headers.get('X-Request-ID', '')
+        return incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.request_id = self.request_id(request)
+        token = _request_id.set(request.request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
+
+    async def __acall__(self, request):
+        request.request_id = self.request_id(request)
+        token = _request_id.set(request.request_id)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response['X-Request-ID'] = request.request_id
+        return response
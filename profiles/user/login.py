@@ -0,0 +1,111 @@
+"""
+The ``CustomUser`` behind a verified Firebase token.
+
+Known uids (almost every request) are found with one indexed read of the
+columns the auth path, the login response and the profile serializer use;
+the password hash and permission flags stay in the database. Only a uid
+seen for the first time takes the write path (``get_or_create``).
+
+The login endpoints record ``last_login`` with ``touch_last_login``, which
+is coalesced: it writes at most once per ``LAST_LOGIN_UPDATE_INTERVAL``
+seconds per user, with a conditional UPDATE that bypasses ``save()`` (no
+signals, no outbox event, no ``updated_at`` bump), so repeat logins are
+read-only. Other authenticated requests don't touch it.
+"""
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .metrics import Counter
+from .models import CustomUser
+from .retry import retry_on_lock
+from .token_cache import remember_user, remembered_user, remembered_user_created
+
+LAST_LOGIN_WRITES = Counter('last_login_writes_total', 'Coalesced last_login updates written.')
+
+# Everything the auth path, the login response and UserProfileSerializer read.
+LOGIN_FIELDS = (
+    'id', 'firebase_uid', 'email', 'first_name', 'last_name', 'phone_number',
+    'is_active', 'is_staff', 'is_superuser', 'last_login', 'updated_at',
+)
+
+
+def login_queryset():
+    return CustomUser.objects.only(*LOGIN_FIELDS)
+
+
+def new_user_defaults(claims):
+    """Columns for a profile created from ``claims`` on first sight of its uid."""
+    name = claims.get('name') or ''
+    return {
+        'email': claims.get('email'),
+        'first_name': name.split()[0] if name else '',
+    }
+
+
+def _interval():
+    return timedelta(seconds=getattr(settings, 'LAST_LOGIN_UPDATE_INTERVAL', 900))
+
+
+def _stale_last_login(user, now):
+    """The UPDATE recording ``now`` as ``user``'s last login, or None if it's recent enough."""
+    cutoff = now - _interval()
+    if user.last_login is not None and user.last_login >= cutoff:
+        return None
+    # Re-checked in the WHERE clause so concurrent requests write it once.
+    return CustomUser.objects.filter(
+        Q(last_login__isnull=True) | Q(last_login__lt=cutoff), pk=user.pk,
+    )
+
+
+def touch_last_login(user, now=None):
+    now = now or timezone.now()
+    queryset = _stale_last_login(user, now)
+    if queryset is not None and retry_on_lock(queryset.update)(last_login=now):
+        LAST_LOGIN_WRITES.inc()
+        user.last_login = now
+
+
+async def atouch_last_login(user, now=None):
+    now = now or timezone.now()
+    queryset = _stale_last_login(user, now)
+    if queryset is not None and await queryset.aupdate(last_login=now):
+        LAST_LOGIN_WRITES.inc()
+        user.last_login = now
+
+
+def get_login_user(claims, request=None):
+    """
+    ``(user, created)`` for verified ``claims``. With ``request``, the
+    result is shared with later lookups in that request.
+    """
+    uid = claims['uid']
+    if request is not None:
+        user = remembered_user(request, uid)
+        if user is not None:
+            return user, remembered_user_created(request)
+    try:
+        # Retried too: under SQLite shared cache (the test database) even a
+        # read can hit "table is locked" while another connection writes.
+        user, created = retry_on_lock(login_queryset().get)(firebase_uid=uid), False
+    except CustomUser.DoesNotExist:
+        user, created = retry_on_lock(CustomUser.objects.get_or_create)(
+            firebase_uid=uid, defaults=new_user_defaults(claims),
+        )
+    if request is not None:
+        remember_user(request, user, created)
+    return user, created
+
+
+async def aget_login_user(claims):
+    """Async ``get_login_user``; the rare create runs in a worker thread."""
+    uid = claims['uid']
+    try:
+        return await login_queryset().aget(firebase_uid=uid), False
+    except CustomUser.DoesNotExist:
+        return await sync_to_async(retry_on_lock(CustomUser.objects.get_or_create))(
+            firebase_uid=uid, defaults=new_user_defaults(claims),
+        )
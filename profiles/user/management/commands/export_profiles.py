@@ -0,0 +1,59 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.export import (
+    DEFAULT_FIELDS,
+    EXPORT_FIELDS,
+    FORMATS,
+    iter_export,
+    parse_fields,
+    parse_since,
+    parse_since_id,
+)
+
+
+class Command(BaseCommand):
+    help = "Stream user profiles to a CSV or JSON Lines file (use '-' or omit for stdout)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument(
+            '--fields', default='',
+            help=f"Comma-separated columns (default {','.join(DEFAULT_FIELDS)}; allowed {','.join(EXPORT_FIELDS)}).",
+        )
+        parser.add_argument('--since-id', type=parse_since_id, help="Only profiles with a larger id.")
+        parser.add_argument('--since', help="Only profiles updated after this ISO 8601 date or datetime.")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output (implied by a .gz path).")
+        parser.add_argument('--chunk-size', type=int, help="Rows per database fetch (EXPORT_CHUNK_SIZE).")
+        parser.add_argument('--database', help="Database alias to read from; defaults to the replica if configured.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        compress = options['gzip'] or path.endswith('.gz')
+        name = path[:-3] if path.endswith('.gz') else path
+        fmt = options['format'] or ('jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv')
+        try:
+            fields = parse_fields(options['fields'])
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        chunks = iter_export(
+            fields, fmt, since_id=options['since_id'], since=since, compress=compress,
+            chunk_size=options['chunk_size'], using=options['database'],
+        )
+        try:
+            if path == '-':
+                out = sys.stdout.buffer
+                for chunk in chunks:
+                    out.write(chunk)
+                out.flush()
+                return
+            with open(path, 'wb') as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+        except OSError as e:
+            raise CommandError(str(e))
+        self.stderr.write(self.style.SUCCESS(f"Exported profiles to {path}"))
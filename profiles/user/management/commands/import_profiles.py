@@ -0,0 +1,35 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from user.bulk import import_profiles
+
+
+class Command(BaseCommand):
+    help = "Upsert user profiles from a JSON Lines or CSV file (use '-' for stdin)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['jsonl', 'csv'], help="Defaults to the file extension, else jsonl.")
+        parser.add_argument('--chunk-size', type=int, help="Rows per bulk upsert (BULK_IMPORT_CHUNK_SIZE).")
+        parser.add_argument('--workers', type=int, help="Password hashing processes; 0 hashes inline.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        try:
+            if path == '-':
+                report = import_profiles(sys.stdin, fmt, options['chunk_size'], options['workers'])
+            else:
+                with open(path, encoding='utf-8', newline='') as fh:
+                    report = import_profiles(fh, fmt, options['chunk_size'], options['workers'])
+        except OSError as e:
+            raise CommandError(str(e))
+
+        for error in report['errors']:
+            self.stderr.write(json.dumps(error))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['total']} rows: {report['created']} created, "
+            f"{report['updated']} updated, {len(report['errors'])} rejected"
+        ))
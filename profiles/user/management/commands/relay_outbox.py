@@ -0,0 +1,33 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from user.outbox import OutboxRelay, sink_from_setting
+
+
+class Command(BaseCommand):
+    help = "Publish pending profile change events from the outbox to OUTBOX_SINK (a file or webhook URL)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', help="JSON Lines file path or http(s) webhook URL (OUTBOX_SINK).")
+        parser.add_argument('--batch-size', type=int, help="Events per publish (OUTBOX_BATCH_SIZE).")
+        parser.add_argument('--flush-interval', type=float,
+                            help="Seconds to wait when the outbox has no full batch (OUTBOX_FLUSH_INTERVAL).")
+        parser.add_argument('--once', action='store_true', help="Exit once nothing is pending.")
+
+    def handle(self, *args, **options):
+        relay = OutboxRelay(
+            sink_from_setting(options['sink'] or settings.OUTBOX_SINK),
+            batch_size=options['batch_size'],
+            flush_interval=options['flush_interval'],
+        )
+        # Finish the batch in flight, then exit.
+        signal.signal(signal.SIGTERM, lambda *_: relay.stop())
+        try:
+            published = relay.run(once=options['once'])
+        except KeyboardInterrupt:
+            relay.stop()
+            published = None
+        if published is not None:
+            self.stdout.write(self.style.SUCCESS(f"{published} events published"))
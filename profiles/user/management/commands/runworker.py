@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from user.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (welcome and password-change emails) until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help="Jobs run at once (JOB_CONCURRENCY).")
+        parser.add_argument('--queue', action='append', dest='queues',
+                            help="Queue to take jobs from; repeat for several (default: default).")
+        parser.add_argument('--poll-interval', type=float,
+                            help="Seconds to wait when no job is due (JOB_POLL_INTERVAL).")
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due.")
+
+    def handle(self, *args, **options):
+        worker = Worker(
+            concurrency=options['concurrency'],
+            queues=options['queues'],
+            poll_interval=options['poll_interval'],
+        )
+        # Finish the jobs in flight, then exit.
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        try:
+            processed = worker.run(once=options['once'])
+        except KeyboardInterrupt:
+            worker.stop()
+            processed = None
+        if processed is not None:
+            self.stdout.write(self.style.SUCCESS(f"{processed} jobs processed"))
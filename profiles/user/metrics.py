@@ -0,0 +1,145 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Metrics are per process: when running several workers, scrape each one (or
+put the workers behind a sidecar that aggregates). ``metrics_view`` serves
+everything registered here at ``/metrics``, to the scraper only: callers
+from ``METRICS_ALLOWED_IPS`` or presenting ``METRICS_TOKEN`` as a Bearer
+token (and anyone when neither is set and ``DEBUG`` is on).
+"""
+import hmac
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Monotonic counter; by convention the name ends in ``_total``."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """A gauge whose value is read from ``callback`` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        return [('', (), self.callback())]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def count(self, **labels):
+        series = self._series.get(tuple(sorted(labels.items())))
+        return series[1] if series else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, summed) in self._series.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append(('_bucket', key + (('le', bound),), count))
+                samples.append(('_bucket', key + (('le', '+Inf'),), total))
+                samples.append(('_count', key, total))
+                samples.append(('_sum', key, round(summed, 6)))
+        return samples
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def metrics_allowed(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+    if token:
+        supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if hmac.compare_digest(supplied.encode(), token.encode()):
+            return True
+    if allowed_ips:
+        from .throttling import client_ip
+
+        return client_ip(request) in allowed_ips
+    return not token and settings.DEBUG
+
+
+def metrics_view(request):
+    if not metrics_allowed(request):
+        return HttpResponseForbidden('Forbidden\n', content_type='text/plain')
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("user", "0002_customuser_updated_at"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="customuser",
+            options={"verbose_name": "user", "verbose_name_plural": "users"},
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(
+                fields=["is_active", "email", "id"], name="user_active_email_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(fields=["phone_number"], name="user_phone_number_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(fields=["first_name"], name="user_first_name_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="customuser",
+            index=models.Index(fields=["last_name"], name="user_last_name_idx"),
+        ),
+    ]
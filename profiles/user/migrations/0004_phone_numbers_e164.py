@@ -0,0 +1,43 @@
+import re
+
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+# A frozen copy of user.validators.to_e164 as of this migration, so later
+# changes to the validator don't change what this migration does.
+PHONE_PATTERN = re.compile(r'^(?:\+?234|0)([789][01]\d{8})$')
+PHONE_SEPARATORS = re.compile(r'[\s.()-]')
+
+
+def to_e164(value):
+    match = PHONE_PATTERN.match(PHONE_SEPARATORS.sub('', value))
+    return '+234' + match.group(1) if match else None
+
+
+def normalize_phone_numbers(apps, schema_editor):
+    """Rewrite stored numbers to E.164; values that aren't valid numbers are left alone."""
+    CustomUser = apps.get_model('user', 'CustomUser')
+    users = CustomUser.objects.using(schema_editor.connection.alias).exclude(phone_number__startswith='+')
+    changed = []
+    for user in users.only('id', 'phone_number').iterator(chunk_size=BATCH_SIZE):
+        normalized = to_e164(user.phone_number)
+        if normalized and normalized != user.phone_number:
+            user.phone_number = normalized
+            changed.append(user)
+        if len(changed) >= BATCH_SIZE:
+            CustomUser.objects.using(schema_editor.connection.alias).bulk_update(changed, ['phone_number'])
+            changed = []
+    if changed:
+        CustomUser.objects.using(schema_editor.connection.alias).bulk_update(changed, ['phone_number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0003_profile_list_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_phone_numbers, reverse_code=migrations.RunPython.noop, elidable=True),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("user", "0004_phone_numbers_e164"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "event_type",
+                    models.CharField(
+                        choices=[
+                            ("profile.created", "Profile created"),
+                            ("profile.updated", "Profile updated"),
+                            ("profile.phone_changed", "Phone number changed"),
+                            ("profile.password_changed", "Password changed"),
+                            ("profile.deleted", "Profile deleted"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("user_id", models.BigIntegerField()),
+                (
+                    "firebase_uid",
+                    models.CharField(blank=True, max_length=255, null=True),
+                ),
+                ("payload", models.JSONField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("published_at", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, default="")),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("published_at__isnull", True)),
+                        fields=["id"],
+                        name="outbox_pending_idx",
+                    ),
+                    models.Index(
+                        fields=["published_at"], name="outbox_published_at_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
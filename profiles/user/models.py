@@ -1,20 +1,21 @@
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
 from django.contrib.auth.base_user import BaseUserManager
-from django.core.exceptions import ValidationError
-
-def non_empty_string(value):
-    if not value.strip():
-        raise ValidationError("This field cannot be empty.")
+from .hashing import set_password
+from .retry import retry_on_lock
+from .validators import non_empty_string, to_e164
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
         if not email:
             raise ValueError('The Email must be set')
         email = self.normalize_email(email)
+        if extra_fields.get('phone_number'):
+            extra_fields['phone_number'] = to_e164(extra_fields['phone_number']) or extra_fields['phone_number']
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
-        user.save(using=self._db)
+        set_password(user, password)
+        retry_on_lock(user.save)(using=self._db)
         return user
 
     def create_superuser(self, email, password=None, **extra_fields):
@@ -36,17 +37,133 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     phone_number = models.CharField(max_length=15, validators=[non_empty_string])
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'phone_number']
 
+    # Columns whose changes are published as outbox events (see user.outbox).
+    OUTBOX_FIELDS = frozenset({
+        'firebase_uid', 'email', 'first_name', 'last_name', 'phone_number', 'is_active', 'password',
+    })
+
     def __str__(self):
         return self.email
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Loaded values, so a save can tell which published columns it changes.
+        instance._outbox_loaded = {
+            name: value for name, value in zip(field_names, values) if name in cls.OUTBOX_FIELDS
+        }
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The row and its OutboxEvent (written by the post_save receiver in
+        # user.signals) commit or roll back together.
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'user'
         verbose_name_plural = 'users'
-        ordering = ['email']
+        # No default ordering: it forced an ORDER BY onto every lookup. The list
+        # endpoint and the admin order explicitly.
+        indexes = [
+            # Keyset pagination on (email, id), optionally filtered by is_active.
+            models.Index(fields=['is_active', 'email', 'id'], name='user_active_email_id_idx'),
+            # Uniqueness check in UserProfileUpdatePhoneAPIView and phone prefix search.
+            models.Index(fields=['phone_number'], name='user_phone_number_idx'),
+            # Name prefix search.
+            models.Index(fields=['first_name'], name='user_first_name_idx'),
+            models.Index(fields=['last_name'], name='user_last_name_idx'),
+        ]
+
+
+class OutboxEvent(models.Model):
+    """
+    A ``CustomUser`` change, written in the same transaction as the change
+    itself and published by ``manage.py relay_outbox`` (user.outbox).
+    """
+    PROFILE_CREATED = 'profile.created'
+    PROFILE_UPDATED = 'profile.updated'
+    PHONE_CHANGED = 'profile.phone_changed'
+    PASSWORD_CHANGED = 'profile.password_changed'
+    PROFILE_DELETED = 'profile.deleted'
+    EVENT_TYPES = [
+        (PROFILE_CREATED, 'Profile created'),
+        (PROFILE_UPDATED, 'Profile updated'),
+        (PHONE_CHANGED, 'Phone number changed'),
+        (PASSWORD_CHANGED, 'Password changed'),
+        (PROFILE_DELETED, 'Profile deleted'),
+    ]
+
+    event_type = models.CharField(max_length=32, choices=EVENT_TYPES)
+    user_id = models.BigIntegerField()
+    firebase_uid = models.CharField(max_length=255, blank=True, null=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # The relay's "next batch" scan: unpublished events in id order.
+            models.Index(fields=['id'], condition=models.Q(published_at__isnull=True), name='outbox_pending_idx'),
+            # Purging published events past retention.
+            models.Index(fields=['published_at'], name='outbox_published_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} #{self.pk} (user {self.user_id})'
+
+
+class Job(models.Model):
+    """
+    A unit of background work, enqueued by ``user.jobs.enqueue`` and run by
+    ``manage.py runworker``.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    queue = models.CharField(max_length=50, default='default')
+    kwargs = models.JSONField(default=dict)
+    # Enqueueing a key that already exists returns the existing job instead.
+    idempotency_key = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=255, blank=True, default='')
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # The worker's "next jobs" scan: queued jobs that are due, oldest first.
+            models.Index(fields=['queue', 'run_at', 'id'], condition=models.Q(status='queued'),
+                         name='job_ready_idx'),
+            # Requeueing jobs whose worker stopped mid-run.
+            models.Index(fields=['locked_at'], condition=models.Q(status='running'), name='job_running_idx'),
+            # Purging finished jobs past retention.
+            models.Index(fields=['finished_at'], name='job_finished_at_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk} ({self.status})'
@@ -0,0 +1,261 @@
+"""
+Transactional outbox for ``CustomUser`` changes.
+
+Every create, update, phone change, password change and delete writes an
+``OutboxEvent`` in the same transaction as the row itself (``CustomUser.save``
+opens the transaction; ``user.signals`` and the bulk importer record the
+events). ``OutboxRelay`` publishes pending events in id order to a sink and
+marks them published only after the sink accepted the batch, so delivery is
+at-least-once: consumers should skip event ids they have already applied.
+
+Sinks are chosen like the signing-key source: an ``http(s)://`` URL posts
+batches to a webhook, anything else is a JSON Lines file to append to.
+
+Writes that bypass model signals (``QuerySet.update``) publish nothing.
+"""
+import json
+import logging
+import os
+import time
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .metrics import Counter
+from .models import CustomUser, OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+PUBLISHED = Counter('outbox_events_published_total', 'Outbox events accepted by the sink.')
+PUBLISH_FAILURES = Counter('outbox_publish_failures_total', 'Outbox batches the sink rejected.')
+
+# Seconds between deletes of published events past retention.
+PURGE_INTERVAL = 60
+
+# Fields copied into event payloads. Never the password hash.
+PAYLOAD_FIELDS = ('id', 'firebase_uid', 'email', 'first_name', 'last_name', 'phone_number', 'is_active')
+
+
+def payload(values, changed=None):
+    data = {name: values[name] for name in PAYLOAD_FIELDS}
+    updated_at = values.get('updated_at')
+    data['updated_at'] = updated_at.isoformat() if updated_at else None
+    if changed is not None:
+        # 'password' says it changed, without the hash itself.
+        data['changed'] = sorted(changed)
+    return data
+
+
+def changed_fields(user, update_fields=None):
+    """Published columns this save changes, judged against the values loaded from the DB."""
+    loaded = getattr(user, '_outbox_loaded', None)
+    candidates = CustomUser.OUTBOX_FIELDS if update_fields is None else CustomUser.OUTBOX_FIELDS & set(update_fields)
+    if loaded is None:
+        # Not loaded from the database (e.g. built with an explicit pk): assume everything changed.
+        return set(candidates)
+    # Deferred columns that were never loaded or assigned can't have changed.
+    return {
+        name for name in candidates
+        if name in user.__dict__ and (name not in loaded or loaded[name] != user.__dict__[name])
+    }
+
+
+def event_type_for(changed):
+    if changed == {'password'}:
+        return OutboxEvent.PASSWORD_CHANGED
+    if changed == {'phone_number'}:
+        return OutboxEvent.PHONE_CHANGED
+    return OutboxEvent.PROFILE_UPDATED
+
+
+def record_save(user, created, update_fields=None, using=None):
+    """Write the event for a ``CustomUser`` save; call inside the save's transaction."""
+    if created:
+        event_type, changed = OutboxEvent.PROFILE_CREATED, None
+    else:
+        changed = changed_fields(user, update_fields)
+        if not changed:
+            return None  # e.g. only last_login or updated_at moved
+        event_type = event_type_for(changed)
+    values = {name: getattr(user, name) for name in PAYLOAD_FIELDS}
+    values['updated_at'] = user.updated_at
+    event = OutboxEvent.objects.using(using).create(
+        event_type=event_type, user_id=user.pk, firebase_uid=user.firebase_uid,
+        payload=payload(values, changed),
+    )
+    user._outbox_loaded = {name: user.__dict__[name] for name in CustomUser.OUTBOX_FIELDS if name in user.__dict__}
+    return event
+
+
+def record_delete(user, using=None):
+    return OutboxEvent.objects.using(using).create(
+        event_type=OutboxEvent.PROFILE_DELETED, user_id=user.pk, firebase_uid=user.firebase_uid,
+        payload={'id': user.pk, 'firebase_uid': user.firebase_uid},
+    )
+
+
+def record_bulk(queryset, created_keys, key_field, changed):
+    """
+    Events for rows written by ``bulk_create`` (which sends no signals), read
+    back from ``queryset`` inside the same transaction. ``created_keys`` holds
+    the ``key_field`` values that were inserts rather than updates, and
+    ``changed`` the columns the updates wrote. Returns the ids of the
+    created rows.
+    """
+    events = []
+    for values in queryset.values(*PAYLOAD_FIELDS, 'updated_at'):
+        created = values[key_field] in created_keys
+        events.append(OutboxEvent(
+            event_type=OutboxEvent.PROFILE_CREATED if created else OutboxEvent.PROFILE_UPDATED,
+            user_id=values['id'], firebase_uid=values['firebase_uid'],
+            payload=payload(values, None if created else changed),
+        ))
+    OutboxEvent.objects.bulk_create(events)
+    return [event.user_id for event in events if event.event_type == OutboxEvent.PROFILE_CREATED]
+
+
+def serialize(event):
+    """The wire form of an event, as sinks deliver it."""
+    return {
+        'id': event.pk,
+        'type': event.event_type,
+        'user_id': event.user_id,
+        'firebase_uid': event.firebase_uid,
+        'occurred_at': event.created_at.isoformat(),
+        'payload': event.payload,
+    }
+
+
+class JSONLSink:
+    """Appends one JSON object per event to a local file."""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+
+    def publish(self, events):
+        lines = ''.join(json.dumps(serialize(event), separators=(',', ':')) + '\n' for event in events)
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            fh.write(lines)
+            fh.flush()
+            if self.fsync:
+                os.fsync(fh.fileno())
+
+
+class WebhookSink:
+    """POSTs ``{"events": [...]}`` per batch; any non-2xx response fails the batch."""
+
+    def __init__(self, url, timeout=5, headers=None):
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+
+    def publish(self, events):
+        response = self.session.post(self.url, json={'events': [serialize(event) for event in events]},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+
+
+def sink_from_setting(value):
+    """``http(s)://`` values are webhooks, anything else is a JSON Lines file path."""
+    value = str(value)
+    if value.startswith(('http://', 'https://')):
+        return WebhookSink(value, timeout=getattr(settings, 'OUTBOX_WEBHOOK_TIMEOUT', 5))
+    return JSONLSink(value)
+
+
+class OutboxRelay:
+    """
+    Moves pending events to a sink in batches. A batch is marked published
+    only once the sink returns, so a crash or sink error means the batch is
+    sent again (at-least-once). Where the database supports ``SKIP LOCKED``
+    the batch stays row-locked while it is published, so several relays can
+    share the table; on SQLite run a single relay.
+    """
+
+    def __init__(self, sink, batch_size=None, flush_interval=None, retention=None, using=None):
+        self.sink = sink
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'OUTBOX_FLUSH_INTERVAL', 1.0)
+        if retention is None:
+            retention = timedelta(hours=getattr(settings, 'OUTBOX_RETENTION_HOURS', 168))
+        self.batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.using = using or router.db_for_write(OutboxEvent)
+        self._stop = False
+        self._purged_at = 0.0
+
+    def stop(self):
+        self._stop = True
+
+    def pending(self):
+        return OutboxEvent.objects.using(self.using).filter(published_at__isnull=True).order_by('id')
+
+    def publish_batch(self):
+        """Publish up to ``batch_size`` events; returns how many were published."""
+        skip_locked = connections[self.using].features.has_select_for_update_skip_locked
+        error = None
+        with transaction.atomic(using=self.using) if skip_locked else nullcontext():
+            queryset = self.pending()
+            if skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            events = list(queryset[:self.batch_size])
+            if not events:
+                return 0
+            ids = [event.pk for event in events]
+            try:
+                self.sink.publish(events)
+            except Exception as e:
+                error = e
+            else:
+                OutboxEvent.objects.using(self.using).filter(pk__in=ids).update(published_at=timezone.now())
+        if error is not None:
+            PUBLISH_FAILURES.inc()
+            logger.warning("Outbox publish of %d events failed: %s", len(events), error)
+            OutboxEvent.objects.using(self.using).filter(pk__in=ids).update(
+                attempts=F('attempts') + 1, last_error=str(error)[:1000],
+            )
+            raise error
+        PUBLISHED.inc(len(events))
+        return len(events)
+
+    def purge(self):
+        """Delete events published longer ago than the retention period."""
+        cutoff = timezone.now() - self.retention
+        deleted, _ = OutboxEvent.objects.using(self.using).filter(published_at__lt=cutoff).delete()
+        return deleted
+
+    def run(self, once=False):
+        """
+        Publish until stopped (or, with ``once``, until nothing is pending).
+        Full batches go out back to back; otherwise the relay waits
+        ``flush_interval`` before looking again. A failed batch is retried
+        after the same wait.
+        """
+        total = 0
+        while not self._stop:
+            try:
+                published = self.publish_batch()
+            except Exception:
+                if once:
+                    raise
+                time.sleep(self.flush_interval)
+                continue
+            total += published
+            if published == self.batch_size:
+                continue
+            if once:
+                break
+            if time.monotonic() - self._purged_at >= PURGE_INTERVAL:
+                self.purge()
+                self._purged_at = time.monotonic()
+            time.sleep(self.flush_interval)
+        return total
@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProfileCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (email, id). ``email`` is unique, so the cursor
+    position alone identifies the next page and every page is an index range
+    scan, however deep the client pages.
+    """
+    ordering = ('email', 'id')
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 500
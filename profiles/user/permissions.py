@@ -1,7 +1,11 @@
 # permissions.py
 from rest_framework import permissions
 from .firebase_utils import verify_firebase_id_token
-from .models import CustomUser
+from .principal import get_principal
+from .resilience import FirebaseUnavailable
+from .routers import replica_reads
+from .throttling import RateLimited
+from .token_cache import remember_principal, remembered_principal
 import logging
 
 logger = logging.getLogger(__name__)
@@ -10,7 +14,7 @@ class IsFirebaseAuthenticated(permissions.BasePermission):
     """
     Verifies Firebase ID token from Authorization header and sets:
     - request.firebase_user (decoded token)
-    - request.user (CustomUser instance)
+    - request.user (the caller's cached ``Principal``, see user.principal)
     """
 
     def has_permission(self, request, view):
@@ -23,7 +27,7 @@ class IsFirebaseAuthenticated(permissions.BasePermission):
         id_token = auth_header[7:]  # Remove "Bearer "
 
         try:
-            decoded_token = verify_firebase_id_token(id_token)
+            decoded_token = verify_firebase_id_token(id_token, request=request)
             request.firebase_user = decoded_token
 
             uid = decoded_token.get('uid')
@@ -31,14 +35,23 @@ class IsFirebaseAuthenticated(permissions.BasePermission):
                 logger.warning("Decoded Firebase token missing UID.")
                 return False
 
-            user = CustomUser.objects.filter(firebase_uid=uid).first()
-            if user:
-                request.user = user  # Set request.user
+            # FirebaseAuthentication has normally remembered the principal
+            # already (creating the profile if needed), so this is a lookup
+            # only when the permission is used without it.
+            principal = remembered_principal(request, uid)
+            if principal is None:
+                with replica_reads(firebase_uid=uid):
+                    principal = get_principal(uid)
+            if principal:
+                remember_principal(request, principal)
+                request.user = principal  # Set request.user
                 return True
             else:
-                logger.warning(f"No CustomUser found for UID: {uid}")
+                logger.warning("No CustomUser found for UID: %s", uid)
                 return False
 
+        except (FirebaseUnavailable, RateLimited):
+            raise
         except Exception as e:
-            logger.error(f"Firebase authentication failed: {e}")
+            logger.warning("Firebase authentication failed: %s", e)
             return False
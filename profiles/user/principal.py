@@ -0,0 +1,162 @@
+"""
+Slim, cached stand-in for ``CustomUser`` on the auth path.
+
+``FirebaseAuthentication`` and ``IsFirebaseAuthenticated`` only need to
+know who the caller is and whether they are active or staff, not the
+password hash, names or phone number. ``Principal`` is a ``__slots__``
+record of ``id``, ``firebase_uid``, ``is_active``, ``is_staff`` and
+``is_superuser``, cached as a plain tuple (under ``PROFILE_CACHE_ALIAS``,
+for ``AUTH_PRINCIPAL_CACHE_TTL`` seconds), so an authenticated request for
+a known user usually makes no query at all.
+
+The permission set (``"app_label.codename"`` strings from the user's own
+and group permissions) is computed the first time ``has_perm`` needs it and
+then cached with the record, so ``has_perm`` never walks the group and
+permission M2M tables again until something changes. ``user.signals``
+drops the record when the user is saved or deleted and when their groups or
+permissions change; writes that bypass signals (``QuerySet.update``) are
+picked up when the TTL runs out.
+"""
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.db.models import Q
+
+from .metrics import Counter
+from .models import CustomUser
+from .profile_cache import get_cache
+
+PRINCIPAL_HITS = Counter('auth_principal_cache_hits_total', 'Auth lookups answered from the principal cache.')
+PRINCIPAL_MISSES = Counter('auth_principal_cache_misses_total', 'Auth lookups that missed the principal cache.')
+
+KEY_PREFIX = 'principal:v1'
+PRINCIPAL_FIELDS = ('id', 'firebase_uid', 'is_active', 'is_staff', 'is_superuser')
+
+
+def uid_key(firebase_uid):
+    return f'{KEY_PREFIX}:uid:{firebase_uid}'
+
+
+def _timeout():
+    return getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 300)
+
+
+class Principal:
+    """The authenticated caller, as DRF's ``request.user``."""
+    __slots__ = ('id', 'firebase_uid', 'is_active', 'is_staff', 'is_superuser', 'permissions')
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, firebase_uid, is_active, is_staff, is_superuser, permissions=None):
+        self.id = id
+        self.firebase_uid = firebase_uid
+        self.is_active = is_active
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+        # frozenset of "app_label.codename", or None until first needed.
+        self.permissions = permissions
+
+    @property
+    def pk(self):
+        return self.id
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(*(getattr(user, name) for name in PRINCIPAL_FIELDS))
+
+    def as_tuple(self):
+        return (self.id, self.firebase_uid, self.is_active, self.is_staff, self.is_superuser, self.permissions)
+
+    def get_all_permissions(self, obj=None):
+        if self.permissions is None:
+            self.permissions = load_permissions(self.id)
+            store(self)
+        return self.permissions
+
+    def has_perm(self, perm, obj=None):
+        # Same rules as PermissionsMixin with ModelBackend.
+        if not self.is_active:
+            return False
+        return self.is_superuser or perm in self.get_all_permissions()
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, app_label):
+        if not self.is_active:
+            return False
+        return self.is_superuser or any(perm.startswith(f'{app_label}.') for perm in self.get_all_permissions())
+
+    def get_user(self):
+        """The full ``CustomUser`` row, for the rare caller that needs it."""
+        return CustomUser.objects.get(pk=self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, Principal) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<Principal {self.id} {self.firebase_uid}>'
+
+
+def load_permissions(user_id):
+    rows = Permission.objects.filter(
+        Q(user__id=user_id) | Q(group__user__id=user_id)
+    ).values_list('content_type__app_label', 'codename').distinct()
+    return frozenset(f'{app_label}.{codename}' for app_label, codename in rows)
+
+
+def store(principal):
+    get_cache().set(uid_key(principal.firebase_uid), principal.as_tuple(), timeout=_timeout())
+    return principal
+
+
+def principal_for(user):
+    """Cache and return the principal of a ``CustomUser`` already in hand."""
+    return store(Principal.from_user(user))
+
+
+def cached_principal(firebase_uid):
+    """The cached principal for ``firebase_uid``, or None on a cache miss."""
+    row = get_cache().get(uid_key(firebase_uid))
+    if row is None:
+        PRINCIPAL_MISSES.inc()
+        return None
+    PRINCIPAL_HITS.inc()
+    return Principal(*row)
+
+
+def get_principal(firebase_uid):
+    """The cached principal for ``firebase_uid``, reading one narrow row on a miss; None if no such user."""
+    principal = cached_principal(firebase_uid)
+    if principal is not None:
+        return principal
+    row = CustomUser.objects.filter(firebase_uid=firebase_uid).values_list(*PRINCIPAL_FIELDS).first()
+    if row is None:
+        return None
+    return store(Principal(*row))
+
+
+def invalidate(*firebase_uids):
+    keys = [uid_key(uid) for uid in firebase_uids if uid]
+    if keys:
+        get_cache().delete_many(keys)
+
+
+def invalidate_m2m(instance, model, pk_set):
+    """Drop the principals whose permissions a groups/permissions M2M change on ``instance`` affects."""
+    if isinstance(instance, CustomUser):
+        invalidate(instance.firebase_uid)
+        return
+    if model is CustomUser:
+        # group.user_set / permission.user_set changed; pk_set is None on clear.
+        users = CustomUser.objects.filter(pk__in=pk_set) if pk_set is not None else instance.user_set.all()
+    elif isinstance(instance, Group):
+        users = CustomUser.objects.filter(groups=instance)
+    else:
+        # permission.group_set changed.
+        groups = pk_set if pk_set is not None else instance.group_set.values('pk')
+        users = CustomUser.objects.filter(groups__in=groups)
+    invalidate(*users.values_list('firebase_uid', flat=True).distinct())
@@ -0,0 +1,185 @@
+"""
+Read-through cache of serialized user profiles.
+
+Entries hold the ``UserProfileSerializer`` payload together with an ETag and
+Last-Modified timestamp, and are stored under both ``firebase_uid`` and ``pk``
+in the cache named by ``PROFILE_CACHE_ALIAS``. ``user.signals`` drops them
+whenever a ``CustomUser`` is saved or deleted; writes that bypass model
+signals (``QuerySet.update``, ``bulk_create``) must call ``invalidate``.
+
+A ``firebase_uid`` with no ``CustomUser`` is cached as ``MISSING`` for
+``PROFILE_MISSING_CACHE_TTL`` seconds, so clients polling before they have
+created a profile don't query for it every time. Creating the profile
+saves a ``CustomUser``, which drops the marker like any other entry.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .instrumentation import stage
+from .models import CustomUser
+from .token_cache import NEGATIVE_CACHE_HITS, NEGATIVE_CACHE_MISSES
+
+KEY_PREFIX = 'profile:v1'
+MISSING = 'missing'
+# Must match UserProfileSerializer.Meta.fields.
+PROFILE_FIELDS = ('id', 'first_name', 'last_name', 'email', 'phone_number')
+
+
+def get_cache():
+    return caches[getattr(settings, 'PROFILE_CACHE_ALIAS', 'default')]
+
+
+def pk_key(pk):
+    return f'{KEY_PREFIX}:pk:{pk}'
+
+
+def uid_key(firebase_uid):
+    return f'{KEY_PREFIX}:uid:{firebase_uid}'
+
+
+def make_entry(data, updated_at):
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()
+    return {
+        'data': data,
+        'etag': f'"{digest}"',
+        'last_modified': updated_at.timestamp() if updated_at else None,
+    }
+
+
+def build_entry(user):
+    from .serializers import UserProfileSerializer
+
+    with stage('serialize'):
+        return make_entry(dict(UserProfileSerializer(user).data), user.updated_at)
+
+
+def _entry_keys(pk, firebase_uid, entry):
+    keys = {pk_key(pk): entry}
+    if firebase_uid:
+        keys[uid_key(firebase_uid)] = entry
+    return keys
+
+
+def _timeout():
+    return getattr(settings, 'PROFILE_CACHE_TTL', 300)
+
+
+def _missing_timeout():
+    return getattr(settings, 'PROFILE_MISSING_CACHE_TTL', 30)
+
+
+def is_known_missing(firebase_uid):
+    """True if ``firebase_uid`` was recently looked up and had no ``CustomUser``."""
+    if get_cache().get(uid_key(firebase_uid)) == MISSING:
+        NEGATIVE_CACHE_HITS.inc(kind='uid')
+        return True
+    return False
+
+
+def remember_missing(firebase_uid):
+    NEGATIVE_CACHE_MISSES.inc(kind='uid')
+    get_cache().set(uid_key(firebase_uid), MISSING, timeout=_missing_timeout())
+
+
+def store(user):
+    entry = build_entry(user)
+    get_cache().set_many(_entry_keys(user.pk, user.firebase_uid, entry), timeout=_timeout())
+    return entry
+
+
+def get_profile(pk=None, firebase_uid=None, user=None):
+    """
+    Return the cached entry for ``pk`` or ``firebase_uid``, loading and caching
+    it on a miss. ``user`` can be passed when the caller already holds the
+    instance, which saves the query on a miss. Returns None if there is no
+    such user.
+    """
+    key = pk_key(pk) if pk is not None else uid_key(firebase_uid)
+    entry = get_cache().get(key)
+    if entry == MISSING:
+        NEGATIVE_CACHE_HITS.inc(kind='uid')
+        return None
+    if entry is not None:
+        return entry
+
+    if user is None:
+        lookup = {'pk': pk} if pk is not None else {'firebase_uid': firebase_uid}
+        user = CustomUser.objects.filter(**lookup).first()
+    if user is None:
+        if pk is None:
+            remember_missing(firebase_uid)
+        return None
+    return store(user)
+
+
+def get_many(pks=(), firebase_uids=()):
+    """
+    Profile payloads for many users as ``{pk or firebase_uid: data}``.
+    Cache hits are served with one ``get_many``; all misses are resolved with
+    a single ``IN`` query over ``.values()`` rows (no model instances or
+    serializer passes) and written back. Unknown ids are left out.
+    """
+    by_uid = bool(firebase_uids)
+    wanted = list(dict.fromkeys(firebase_uids if by_uid else pks))
+    key_for = uid_key if by_uid else pk_key
+    cache = get_cache()
+
+    cached = cache.get_many([key_for(value) for value in wanted])
+    found = {}
+    missing = []
+    for value in wanted:
+        entry = cached.get(key_for(value))
+        if entry is None:
+            missing.append(value)
+        elif entry != MISSING:
+            found[value] = entry['data']
+
+    if missing:
+        lookup = {'firebase_uid__in' if by_uid else 'pk__in': missing}
+        new_entries = {}
+        for row in CustomUser.objects.filter(**lookup).values(*PROFILE_FIELDS, 'firebase_uid', 'updated_at'):
+            firebase_uid = row.pop('firebase_uid')
+            updated_at = row.pop('updated_at')
+            entry = make_entry(row, updated_at)
+            found[firebase_uid if by_uid else row['id']] = row
+            new_entries.update(_entry_keys(row['id'], firebase_uid, entry))
+        cache.set_many(new_entries, timeout=_timeout())
+    return found
+
+
+async def aget_profile(pk=None, firebase_uid=None):
+    """Async ``get_profile`` using the async cache and ORM APIs."""
+    key = pk_key(pk) if pk is not None else uid_key(firebase_uid)
+    cache = get_cache()
+    entry = await cache.aget(key)
+    if entry == MISSING:
+        NEGATIVE_CACHE_HITS.inc(kind='uid')
+        return None
+    if entry is not None:
+        return entry
+
+    lookup = {'pk': pk} if pk is not None else {'firebase_uid': firebase_uid}
+    user = await CustomUser.objects.filter(**lookup).afirst()
+    if user is None:
+        if pk is None:
+            NEGATIVE_CACHE_MISSES.inc(kind='uid')
+            await cache.aset(key, MISSING, timeout=_missing_timeout())
+        return None
+    entry = build_entry(user)
+    await cache.aset_many(_entry_keys(user.pk, user.firebase_uid, entry), timeout=_timeout())
+    return entry
+
+
+def invalidate(user=None, pk=None, firebase_uid=None):
+    if user is not None:
+        pk, firebase_uid = user.pk, user.firebase_uid
+    keys = []
+    if pk is not None:
+        keys.append(pk_key(pk))
+    if firebase_uid:
+        keys.append(uid_key(firebase_uid))
+    if keys:
+        get_cache().delete_many(keys)
@@ -0,0 +1,61 @@
+"""
+DRF renderers and parsers. ``settings.API_JSON_BACKEND`` picks the stdlib
+``json`` classes or the orjson ones for ``REST_FRAMEWORK``.
+
+orjson is optional: without it the orjson classes behave exactly like their
+stdlib parents, so the setting can stay on everywhere.
+"""
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import stage
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that reports its work as the ``render`` stage."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with stage('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class ORJSONRenderer(TimedJSONRenderer):
+    """
+    ``TimedJSONRenderer`` on orjson, with the same compact UTF-8 output.
+    Types orjson doesn't handle the way DRF does (datetimes, Decimals, lazy
+    strings, ...) go through DRF's encoder. Indented output (``; indent=``
+    in the Accept header) is left to the stdlib renderer.
+    """
+    _default = staticmethod(JSONEncoder().default)
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        with stage('render'):
+            # Non-str keys occur in DRF errors for list items ({"ids": {0: [...]}}).
+            ret = orjson.dumps(
+                data, default=self._default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS,
+            )
+        # Like JSONRenderer: escape U+2028/U+2029 so the output is also valid JavaScript.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class ORJSONParser(JSONParser):
+    """``JSONParser`` on orjson. Request bodies must be UTF-8, as RFC 8259 requires."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f'JSON parse error - {exc}')
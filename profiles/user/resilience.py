@@ -0,0 +1,239 @@
+"""
+Guard around calls to Google (Firebase Admin SDK verification and signing
+key fetches).
+
+When Google is slow, every worker thread would otherwise block in the same
+call and the whole API stalls. ``CallGuard`` bounds that:
+
+* a semaphore caps calls in flight; a caller that can't get a slot within
+  ``FIREBASE_QUEUE_TIMEOUT`` gives up;
+* each call runs in a thread of its own pool and is abandoned after
+  ``FIREBASE_CALL_TIMEOUT`` (the call keeps its slot until it really ends);
+* a ``CircuitBreaker`` opens after ``FIREBASE_BREAKER_FAILURES`` failures in
+  a row and rejects calls outright for ``FIREBASE_BREAKER_RESET`` seconds,
+  then lets a single trial call through to decide whether to close again.
+
+Rejections and failed calls raise ``FirebaseUnavailable`` (503 +
+Retry-After). Tokens already
+in the verified-token cache never reach the guard, so while the breaker is
+open clients whose tokens were verified before keep working until the token
+expires (degraded mode); only new tokens are turned away.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+REJECTED = Counter(
+    'firebase_calls_rejected_total', 'Firebase calls refused or abandoned, by reason (open, saturated, timeout).',
+)
+FAILURES = Counter('firebase_call_failures_total', 'Firebase calls that raised or timed out.')
+DEGRADED_HITS = Counter(
+    'firebase_degraded_cache_hits_total', 'Tokens accepted from the verified cache while the breaker was open.',
+)
+BREAKER_OPEN = Gauge(
+    'firebase_breaker_open', 'Whether the Firebase circuit breaker is rejecting calls (1) or not (0).',
+    lambda: int(_guard is not None and _guard.breaker.state == CircuitBreaker.OPEN),
+)
+
+
+class FirebaseUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Token verification is temporarily unavailable, please retry shortly.'
+    default_code = 'firebase_unavailable'
+
+    def __init__(self, wait, detail=None):
+        super().__init__(detail)
+        # DRF's exception handler turns ``wait`` into a Retry-After header.
+        self.wait = wait
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through and consecutive failures are counted. Open:
+    calls are refused until ``reset_timeout`` has passed. Half-open: one
+    trial call goes through; success closes the breaker, failure reopens it.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go ahead now; a True in half-open state claims the trial."""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if self.clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Firebase circuit breaker closed")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning("Firebase circuit breaker opened after %d failures", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+
+    def release_trial(self):
+        """Give back a half-open trial claimed by ``allow`` without calling."""
+        with self._lock:
+            self._trial_running = False
+
+    def retry_after(self):
+        """Whole seconds until the breaker lets a trial call through (at least 1)."""
+        with self._lock:
+            remaining = self.reset_timeout - (self.clock() - self._opened_at)
+        return max(1, int(remaining + 0.999))
+
+
+class CallGuard:
+    """
+    Runs calls under a concurrency limit, a timeout and a circuit breaker.
+    Exceptions listed in ``ignore`` (e.g. a rejected token) are answers,
+    not failures: they pass through without counting against the breaker.
+    """
+
+    def __init__(self, max_concurrent=8, queue_timeout=0.5, call_timeout=5.0, breaker=None, ignore=()):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.call_timeout = call_timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.ignore = tuple(ignore)
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._executor = ThreadPoolExecutor(max_concurrent, thread_name_prefix='firebase')
+
+    @property
+    def available(self):
+        """False while the breaker is open and would refuse a call."""
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def call(self, func, *args, **kwargs):
+        if not self.breaker.allow():
+            REJECTED.inc(reason='open')
+            raise FirebaseUnavailable(self.breaker.retry_after())
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            # Our own backlog rather than a failed call: not counted against
+            # the breaker, but a claimed half-open trial is handed back.
+            REJECTED.inc(reason='saturated')
+            self.breaker.release_trial()
+            raise FirebaseUnavailable(1, 'Too many token verifications in flight, please retry shortly.')
+        try:
+            future = self._executor.submit(self._run, func, args, kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        try:
+            result = future.result(timeout=self.call_timeout)
+        except FutureTimeoutError:
+            REJECTED.inc(reason='timeout')
+            FAILURES.inc()
+            self.breaker.record_failure()
+            logger.warning("Firebase call timed out after %.1fs", self.call_timeout)
+            raise FirebaseUnavailable(self.breaker.retry_after(), 'Token verification timed out.')
+        except self.ignore:
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            FAILURES.inc()
+            self.breaker.record_failure()
+            logger.warning("Firebase call failed: %s", e)
+            raise FirebaseUnavailable(self.breaker.retry_after()) from e
+        self.breaker.record_success()
+        return result
+
+    def _run(self, func, args, kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def note_cache_hit():
+    """Count a verified-cache hit served while the breaker is open."""
+    if _guard is not None and _guard.breaker.state == CircuitBreaker.OPEN:
+        DEGRADED_HITS.inc()
+
+
+def get_firebase_guard():
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                from .token_verifier import InvalidFirebaseToken
+
+                _guard = CallGuard(
+                    max_concurrent=getattr(settings, 'FIREBASE_MAX_CONCURRENT_CALLS', 8),
+                    queue_timeout=getattr(settings, 'FIREBASE_QUEUE_TIMEOUT', 0.5),
+                    call_timeout=getattr(settings, 'FIREBASE_CALL_TIMEOUT', 5.0),
+                    breaker=CircuitBreaker(
+                        failure_threshold=getattr(settings, 'FIREBASE_BREAKER_FAILURES', 5),
+                        reset_timeout=getattr(settings, 'FIREBASE_BREAKER_RESET', 30),
+                    ),
+                    ignore=(InvalidFirebaseToken,),
+                )
+    return _guard
+
+
+def reset_firebase_guard():
+    global _guard
+    with _guard_lock:
+        if _guard is not None:
+            _guard.shutdown()
+        _guard = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting.startswith('FIREBASE_'):
+        reset_firebase_guard()
@@ -0,0 +1,57 @@
+"""
+Retry for writes that lose the race for the SQLite write lock.
+
+SQLite has one writer at a time. ``busy_timeout`` makes a connection wait for
+the lock, but a writer can still give up with "database is locked" when the
+wait runs out under a burst of signups/logins. ``retry_on_lock`` re-runs such
+a write with exponential backoff and full jitter, so contending writers
+spread out instead of retrying in lockstep. It only retries when it owns the
+transaction: inside an outer ``atomic`` block the error is re-raised for the
+outermost caller to handle. Other backends never raise these errors, so the
+wrapper costs nothing there.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+from .metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+LOCK_ERRORS = ('database is locked', 'database table is locked', 'database is busy')
+
+LOCK_RETRIES = Counter('db_lock_retries_total', 'Writes retried after a database lock error.')
+LOCK_FAILURES = Counter('db_lock_failures_total', 'Writes that still hit a lock error after all retries.')
+
+
+def is_lock_error(exc):
+    return isinstance(exc, OperationalError) and any(message in str(exc).lower() for message in LOCK_ERRORS)
+
+
+def retry_on_lock(func, using=DEFAULT_DB_ALIAS):
+    """Wrap ``func`` (a self-contained write) to retry it on lock errors."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempts = getattr(settings, 'DB_LOCK_RETRY_ATTEMPTS', 5)
+        base_delay = getattr(settings, 'DB_LOCK_RETRY_BASE_DELAY', 0.05)
+        max_delay = getattr(settings, 'DB_LOCK_RETRY_MAX_DELAY', 1.0)
+        for attempt in range(attempts):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if not is_lock_error(e) or connections[using].in_atomic_block:
+                    raise
+                if attempt == attempts - 1:
+                    LOCK_FAILURES.inc()
+                    raise
+                LOCK_RETRIES.inc()
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+                logger.debug("Database locked, retrying %s in %.3fs", func.__qualname__, delay)
+                time.sleep(delay)
+
+    return wrapper
@@ -0,0 +1,73 @@
+"""
+Primary/replica routing.
+
+All writes, and all reads by default, go to ``default``. Code that does a
+read-only profile lookup wraps it in ``replica_reads()`` to send those
+queries to the ``replica`` alias when one is configured. A user whose row was
+written in the last ``DATABASE_REPLICA_STICKY_SECONDS`` stays on the
+primary, so a read after a create, phone update or password reset never sees
+a lagging replica (and never re-caches the old profile). Reads inside a
+transaction on the primary also stay there.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_ALIAS = 'replica'
+PIN_PREFIX = 'replica:pin'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+def _pin_keys(pk=None, firebase_uid=None):
+    keys = []
+    if pk is not None:
+        keys.append(f'{PIN_PREFIX}:pk:{pk}')
+    if firebase_uid:
+        keys.append(f'{PIN_PREFIX}:uid:{firebase_uid}')
+    return keys
+
+
+def mark_written(pk=None, firebase_uid=None):
+    """Keep reads of this user on the primary until the replica has caught up."""
+    if not replica_configured():
+        return
+    timeout = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 5)
+    cache.set_many(dict.fromkeys(_pin_keys(pk, firebase_uid), 1), timeout=timeout)
+
+
+def recently_written(pk=None, firebase_uid=None):
+    keys = _pin_keys(pk, firebase_uid)
+    return bool(keys) and bool(cache.get_many(keys))
+
+
+@contextmanager
+def replica_reads(pk=None, firebase_uid=None):
+    """Route the block's reads to the replica, unless this user was just written."""
+    use = replica_configured() and not recently_written(pk, firebase_uid)
+    token = _use_replica.set(use)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return REPLICA_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
@@ -1,8 +1,12 @@
 from rest_framework import serializers
+from django.db import transaction
+from . import jobs, tasks
+from .hashing import set_password
 from .models import CustomUser
+from .retry import retry_on_lock
+from .validators import normalize_phone_number
 from django.contrib.auth.password_validation import validate_password
-from django.core.exceptions import ValidationError
-import re
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 import logging
 
 logger = logging.getLogger(__name__)
@@ -22,13 +26,10 @@ class UserProfileCreateSerializer(serializers.ModelSerializer):
         ]
 
     def validate_phone_number(self, value):
-        phone_regex = r'^(?:\+234|0)[789][01]\d{8}$'
-        if not re.match(phone_regex, value):
-            raise serializers.ValidationError("Please enter a valid Nigerian phone number.")
-        return value
+        # Stored as E.164 so every spelling of a number is one value.
+        return normalize_phone_number(value)
 
     def validate(self, data):
-        logger.debug(f"Serializer input data: {data}")
         if data.get('password') != data.get('retype_password'):
             raise serializers.ValidationError("Passwords do not match.")
         try:
@@ -38,20 +39,50 @@ class UserProfileCreateSerializer(serializers.ModelSerializer):
         return data
 
     def create(self, validated_data):
-        logger.debug(f"Validated data: {validated_data}")
         validated_data.pop('retype_password')
         password = validated_data.pop('password')
         user = CustomUser(**validated_data)
-        user.set_password(password)
+        set_password(user, password)
         try:
             user.save()
-        except Exception as e:
-            logger.error(f"Error occurred while saving user: {str(e)}", exc_info=True)
+        except Exception:
+            logger.exception("Error occurred while saving user")
             raise serializers.ValidationError("Failed to create user.")
-        logger.debug(f"Saved user: {user.__dict__}")
+        logger.debug("Saved user %s", user.pk)
         return user
 
 
+class ProfileUpsertSerializer(UserProfileCreateSerializer):
+    """
+    ``UserProfileCreateSerializer`` for the create/upsert endpoints. Email
+    uniqueness is left to the database constraint instead of a lookup query,
+    since the write itself is an upsert on ``firebase_uid``.
+    """
+    email = serializers.EmailField(max_length=254)
+
+
+class BulkProfileRowSerializer(UserProfileCreateSerializer):
+    """
+    One row of a bulk import. Same rules as ``UserProfileCreateSerializer``
+    but without per-row uniqueness queries, since rows are upserted.
+    """
+    firebase_uid = serializers.CharField(required=False, allow_blank=False, max_length=255)
+    email = serializers.EmailField(max_length=254)
+    first_name = serializers.CharField(required=True, allow_blank=False, max_length=30)
+    last_name = serializers.CharField(required=True, allow_blank=False, max_length=30)
+    phone_number = serializers.CharField(required=True, allow_blank=False, max_length=15)
+    retype_password = serializers.CharField(write_only=True, required=False)
+
+    class Meta(UserProfileCreateSerializer.Meta):
+        fields = [
+            'firebase_uid', 'first_name', 'last_name', 'email', 'phone_number', 'password', 'retype_password'
+        ]
+
+    def validate(self, data):
+        data.setdefault('retype_password', data.get('password'))
+        return super().validate(data)
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     """Read-only serializer for returning user info."""
     class Meta:
@@ -65,11 +96,83 @@ class UserProfileSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password', None)
         user = CustomUser(**validated_data)
         if password:
-            user.set_password(password)  # This hashes the password!
+            set_password(user, password)  # This hashes the password!
         user.save()
         return user
 
 
+class ValuesRowSerializer:
+    """
+    Read-only fast path for a ``ModelSerializer``: produces the same dicts as
+    ``serializer_class(instances, many=True).data`` straight from
+    ``QuerySet.values()`` rows, without model instances or a per-field
+    serializer walk.
+
+    The field list is compiled once. Fields whose model values are already
+    what DRF would output (ints, strings, booleans) are copied as-is; any
+    other field keeps its ``to_representation``. Fields that aren't plain
+    model columns (methods, relations, nested serializers, other sources)
+    can't come from ``.values()`` and are rejected up front.
+    """
+    PASSTHROUGH = (
+        serializers.IntegerField, serializers.CharField, serializers.BooleanField, serializers.ReadOnlyField,
+    )
+    # Subclasses of CharField that transform the value on the way out.
+    CONVERTED = (serializers.UUIDField, serializers.IPAddressField)
+
+    def __init__(self, serializer_class):
+        columns = {field.name for field in serializer_class.Meta.model._meta.concrete_fields}
+        fields = []
+        self.converters = {}
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if field.source != name or name not in columns or isinstance(field, serializers.RelatedField):
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{name} is not a plain model column; it can't be read from .values()."
+                )
+            fields.append(name)
+            if not isinstance(field, self.PASSTHROUGH) or isinstance(field, self.CONVERTED):
+                self.converters[name] = field.to_representation
+        self.fields = tuple(fields)
+
+    def values(self, queryset):
+        """``queryset`` as ``.values()`` rows with exactly the serializer's fields, in order."""
+        return queryset.values(*self.fields)
+
+    def to_representation(self, row):
+        for name, convert in self.converters.items():
+            value = row[name]
+            if value is not None:
+                row[name] = convert(value)
+        return row
+
+    def many(self, rows):
+        if not self.converters:
+            return list(rows)
+        return [self.to_representation(row) for row in rows]
+
+
+PROFILE_ROWS = ValuesRowSerializer(UserProfileSerializer)
+
+
+class ProfileBatchRequestSerializer(serializers.Serializer):
+    """Body of POST /api/user/profiles/batch/: either ``ids`` or ``firebase_uids``."""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    firebase_uids = serializers.ListField(
+        child=serializers.CharField(max_length=255), required=False, allow_empty=False
+    )
+
+    def validate(self, data):
+        if len(data) != 1:
+            raise serializers.ValidationError("Provide exactly one of 'ids' or 'firebase_uids'.")
+        (values,) = data.values()
+        limit = self.context.get('max_items', 300)
+        if len(values) > limit:
+            raise serializers.ValidationError(f"At most {limit} ids per request.")
+        return data
+
+
 class UserProfileUpdateSerializer(serializers.ModelSerializer):
     """Optional serializer for updating user info (not password)."""
     class Meta:
@@ -100,6 +203,14 @@ class PasswordResetSerializer(serializers.Serializer):
         email = self.validated_data['email']
         new_password = self.validated_data['new_password']
         user = CustomUser.objects.get(email=email)
-        user.set_password(new_password)
-        user.save()
+        set_password(user, new_password)
+        retry_on_lock(self._save_and_notify)(user)
         return user
+
+    @staticmethod
+    def _save_and_notify(user):
+        # The new password and the job that tells the user about it commit
+        # (or roll back) together.
+        with transaction.atomic():
+            user.save()
+            jobs.enqueue(tasks.PASSWORD_CHANGED_EMAIL, user_id=user.pk)
@@ -0,0 +1,54 @@
+from django.contrib.auth.models import Group
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import jobs, outbox, principal, profile_cache, routers, tasks
+from .models import CustomUser
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_profile(sender, instance, created=False, using=None, **kwargs):
+    pk, firebase_uid = instance.pk, instance.firebase_uid
+
+    def invalidate():
+        profile_cache.invalidate(pk=pk, firebase_uid=firebase_uid)
+        principal.invalidate(firebase_uid)
+
+    invalidate()
+    routers.mark_written(pk=pk, firebase_uid=firebase_uid)
+    # A concurrent lookup may re-cache the old row (or the uid as missing)
+    # before this transaction commits; drop it again once the change is
+    # visible. Runs immediately outside a transaction.
+    transaction.on_commit(invalidate, using=using)
+
+
+@receiver(post_save, sender=CustomUser)
+def record_outbox_save(sender, instance, created, update_fields=None, using=None, **kwargs):
+    # Runs inside the transaction CustomUser.save opened for the row.
+    outbox.record_save(instance, created, update_fields, using=using)
+
+
+@receiver(post_delete, sender=CustomUser)
+def record_outbox_delete(sender, instance, using=None, **kwargs):
+    # Runs inside the deletion's transaction.
+    outbox.record_delete(instance, using=using)
+
+
+@receiver(post_save, sender=CustomUser)
+def enqueue_welcome_email(sender, instance, created, raw=False, using=None, **kwargs):
+    # Signup, login and authentication create profiles through save() and
+    # land here, inside the row's transaction. Bulk import's bulk_create
+    # sends no post_save; user.bulk queues its welcome emails itself.
+    if created and not raw:
+        jobs.enqueue(tasks.WELCOME_EMAIL, using=using, user_id=instance.pk)
+
+
+@receiver(m2m_changed, sender=CustomUser.groups.through)
+@receiver(m2m_changed, sender=CustomUser.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_principal_permissions(sender, instance, action, model, pk_set, **kwargs):
+    # pre_clear: the affected users can't be found once the rows are gone.
+    if action in ('post_add', 'post_remove', 'pre_clear'):
+        principal.invalidate_m2m(instance, model, pk_set)
@@ -0,0 +1,48 @@
+"""
+Background tasks for profile side effects, run by ``manage.py runworker``.
+
+Each task looks the user up again when it runs, so it sees the profile as it
+is then (or skips it if the profile was deleted meanwhile).
+"""
+import logging
+
+from django.core.mail import send_mail
+
+from .jobs import task
+from .models import CustomUser
+
+logger = logging.getLogger(__name__)
+
+WELCOME_EMAIL = 'user.send_welcome_email'
+PASSWORD_CHANGED_EMAIL = 'user.send_password_changed_email'
+
+
+def _recipient(user_id):
+    user = CustomUser.objects.filter(pk=user_id).only('email', 'first_name').first()
+    if user is None or not user.email:
+        logger.info("Skipping email for user %s: no profile or no address", user_id)
+        return None
+    return user
+
+
+@task(WELCOME_EMAIL)
+def send_welcome_email(user_id):
+    user = _recipient(user_id)
+    if user is not None:
+        send_mail(
+            "Welcome!",
+            f"Hi {user.first_name or 'there'},\n\nYour profile has been created.",
+            None, [user.email],
+        )
+
+
+@task(PASSWORD_CHANGED_EMAIL)
+def send_password_changed_email(user_id):
+    user = _recipient(user_id)
+    if user is not None:
+        send_mail(
+            "Your password was changed",
+            f"Hi {user.first_name or 'there'},\n\nThe password for your profile was just changed. "
+            "If this wasn't you, reset it now.",
+            None, [user.email],
+        )
@@ -0,0 +1,119 @@
+"""
+Helpers for exercising the Firebase code paths without Google.
+
+``LocalTokenSigner`` mints Firebase-shaped ID tokens with a throwaway RSA key
+and publishes the matching certificate in Google's x509 format, so it can back
+a ``FileKeySource`` or be served by a local stand-in HTTP server.
+``FakeFirebaseAuth`` and ``FlakyKeySource`` stand in for the SDK's
+``verify_id_token`` and for a key source, with injectable latency and errors.
+"""
+import datetime
+import json
+import threading
+import time
+
+import jwt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+
+class LocalTokenSigner:
+    def __init__(self, project_id='test-project', kid='test-key'):
+        self.project_id = project_id
+        self.kid = kid
+        self.private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        self.certificate_pem = self._self_signed_certificate()
+
+    def _self_signed_certificate(self):
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken.local')])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(self.private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=30))
+            .sign(self.private_key, hashes.SHA256())
+        )
+        return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+    def certificates(self):
+        return {self.kid: self.certificate_pem}
+
+    def write_certificates(self, path, *extra_signers):
+        data = self.certificates()
+        for signer in extra_signers:
+            data.update(signer.certificates())
+        with open(path, 'w') as fh:
+            json.dump(data, fh)
+        return path
+
+    def sign(self, uid, email=None, expires_in=3600, audience=None, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': f'https://securetoken.google.com/{self.project_id}',
+            'aud': audience or self.project_id,
+            'auth_time': now,
+            'iat': now,
+            'exp': now + expires_in,
+            'sub': uid,
+            'user_id': uid,
+        }
+        if email is not None:
+            payload['email'] = email
+            payload['email_verified'] = True
+        payload.update(claims)
+        return jwt.encode(payload, self.private_key, algorithm='RS256', headers={'kid': self.kid})
+
+
+class FaultInjector:
+    """Counts calls and applies ``latency`` (seconds) and ``error`` (raised) to each."""
+
+    def __init__(self, latency=0.0, error=None):
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def inject(self):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error is not None:
+            raise self.error
+
+
+class FakeFirebaseAuth(FaultInjector):
+    """``firebase_admin.auth.verify_id_token`` backed by a local ``FirebaseTokenVerifier``."""
+
+    def __init__(self, verifier, **faults):
+        super().__init__(**faults)
+        self.verifier = verifier
+
+    def verify_id_token(self, id_token, app=None, check_revoked=False):
+        from firebase_admin import auth
+
+        from .token_verifier import InvalidFirebaseToken
+
+        self.inject()
+        try:
+            return self.verifier.verify(id_token)
+        except InvalidFirebaseToken as e:
+            raise auth.InvalidIdTokenError(str(e))
+
+
+class FlakyKeySource(FaultInjector):
+    """Wraps a ``KeySource`` so fetching keys is slow or fails on demand."""
+
+    def __init__(self, source, **faults):
+        super().__init__(**faults)
+        self.source = source
+
+    def fetch(self):
+        self.inject()
+        return self.source.fetch()
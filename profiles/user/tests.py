@@ -1,3 +1,1871 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import check_password
+from django.contrib.auth.models import Group, Permission
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+
+from benchmarks.compare import compare
+from benchmarks.load import queries_from_header
+
+from . import firebase_client, firebase_utils, jobs, outbox, profile_cache, routers, tasks
+from .bulk import import_profiles
+from .export import ExportWriter, iter_export
+from .hashing import HASH_SECONDS, HashingUnavailable, PasswordHashingService, get_hashing_service
+from .firebase_utils import verify_firebase_id_token
+from .instrumentation import REQUEST_SECONDS
+from .login import LAST_LOGIN_WRITES
+from .log import BackgroundHandler, JsonFormatter, RedactingFilter, RequestIdFilter
+from .models import CustomUser, Job, OutboxEvent
+from .serializers import PROFILE_ROWS, BulkProfileRowSerializer, UserProfileSerializer, ValuesRowSerializer
+from .renderers import ORJSONParser, ORJSONRenderer, TimedJSONRenderer
+from .retry import LOCK_RETRIES, retry_on_lock
+from .throttling import THROTTLED, CacheBackend, MemoryBackend, Rule
+from . import principal as principal_module
+from .principal import Principal, get_principal
+from .resilience import (
+    DEGRADED_HITS,
+    CallGuard,
+    CircuitBreaker,
+    FirebaseUnavailable,
+    get_firebase_guard,
+    reset_firebase_guard,
+)
+from .testing import FakeFirebaseAuth, FlakyKeySource, LocalTokenSigner
+from .token_cache import (
+    NEGATIVE_CACHE_HITS,
+    NEGATIVE_CACHE_MISSES,
+    VerifiedTokenCache,
+    get_rejected_tokens,
+    get_token_cache,
+)
+from .views import upsert_profile
+from . import validators
+from .token_verifier import (
+    FileKeySource,
+    FirebaseTokenVerifier,
+    HTTPKeySource,
+    InvalidFirebaseToken,
+    SigningKeyCache,
+    get_token_verifier,
+    parse_max_age,
+)
+
+
+class FirebaseTokenMixin:
+    """Points the local verifier at a throwaway signer for the whole class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.signer = LocalTokenSigner()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.keys_path = cls.signer.write_certificates(os.path.join(cls.tmpdir, 'certs.json'))
+        cls._firebase_settings = override_settings(
+            FIREBASE_TOKEN_VERIFIER='local',
+            FIREBASE_PROJECT_ID=cls.signer.project_id,
+            FIREBASE_KEY_SOURCE=cls.keys_path,
+            # Tests reuse one client IP and uid far beyond the production limits.
+            RATE_LIMIT_ENABLED=False,
+        )
+        cls._firebase_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._firebase_settings.disable()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def setUp(self):
+        super().setUp()
+        # Cached principals would outlive the rows each test rolls back.
+        cache.clear()
+
+    def auth_header(self, uid='uid-1', email='user@example.com', **claims):
+        return {'HTTP_AUTHORIZATION': f'Bearer {self.signer.sign(uid, email, **claims)}'}
+
+
+class TokenVerifierTests(FirebaseTokenMixin, SimpleTestCase):
+    def test_valid_token_is_verified_locally(self):
+        claims = verify_firebase_id_token(self.signer.sign('uid-1', 'a@example.com'))
+        self.assertEqual(claims['uid'], 'uid-1')
+        self.assertEqual(claims['email'], 'a@example.com')
+
+    def test_wrong_audience_is_rejected(self):
+        token = self.signer.sign('uid-1', audience='other-project')
+        with self.assertRaises(ValueError):
+            verify_firebase_id_token(token)
+
+    def test_expired_token_is_rejected(self):
+        token = self.signer.sign('uid-1', expires_in=-10)
+        with self.assertRaises(ValueError):
+            verify_firebase_id_token(token)
+
+    def test_token_from_unknown_key_is_rejected(self):
+        token = LocalTokenSigner(kid='test-key').sign('uid-1')
+        with self.assertRaises(ValueError):
+            verify_firebase_id_token(token)
+
+    def test_concurrent_refreshes_share_one_fetch(self):
+        source = FileKeySource(self.keys_path, max_age=60)
+        fetches = []
+
+        def slow_fetch():
+            fetches.append(1)
+            time.sleep(0.05)
+            return FileKeySource.fetch(source)
+
+        source.fetch = slow_fetch
+        cache = SigningKeyCache(source)
+        self.addCleanup(cache.close)
+        threads = [threading.Thread(target=cache.get, args=(self.signer.kid,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fetches), 1)
+        self.assertIsNotNone(cache.get(self.signer.kid))
+
+    def test_rotated_key_triggers_refresh(self):
+        path = os.path.join(self.tmpdir, 'rotating.json')
+        self.signer.write_certificates(path)
+        verifier = FirebaseTokenVerifier(
+            self.signer.project_id,
+            SigningKeyCache(FileKeySource(path), min_refresh_interval=0),
+        )
+        verifier.verify(self.signer.sign('uid-1'))
+
+        rotated = LocalTokenSigner(kid='rotated-key')
+        self.signer.write_certificates(path, rotated)
+        self.assertEqual(verifier.verify(rotated.sign('uid-2'))['uid'], 'uid-2')
+
+    def test_invalid_token_raises_invalid_firebase_token(self):
+        verifier = FirebaseTokenVerifier(
+            self.signer.project_id, SigningKeyCache(FileKeySource(self.keys_path))
+        )
+        with self.assertRaises(InvalidFirebaseToken):
+            verifier.verify('not-a-token')
+
+
+class HTTPKeySourceTests(SimpleTestCase):
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age('public, max-age=19302, must-revalidate'), 19302)
+        self.assertIsNone(parse_max_age('no-cache'))
+        self.assertIsNone(parse_max_age(None))
+
+    def test_fetches_from_local_stand_in_server(self):
+        signer = LocalTokenSigner()
+        body = json.dumps(signer.certificates()).encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', 'public, max-age=120')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        cache = SigningKeyCache(HTTPKeySource(f'http://127.0.0.1:{server.server_port}/'))
+        self.addCleanup(cache.close)
+        verifier = FirebaseTokenVerifier(signer.project_id, cache)
+
+        self.assertEqual(verifier.verify(signer.sign('uid-1'))['uid'], 'uid-1')
+        self.assertAlmostEqual(cache.expires_at - time.monotonic(), 120, delta=5)
+
+
+class VerifiedTokenCacheTests(SimpleTestCase):
+    def test_entries_expire_at_token_exp(self):
+        cache = VerifiedTokenCache()
+        cache.set('a', {'exp': time.time() - 1})
+        cache.set('b', {'exp': time.time() + 60})
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = VerifiedTokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.set('a', {'exp': exp})
+        cache.set('b', {'exp': exp})
+        cache.get('a')
+        cache.set('c', {'exp': exp})
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        self.assertEqual(len(cache), 2)
+
+
+class SingleVerificationTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        get_token_cache().clear()
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', password='x', firebase_uid='uid-1',
+            first_name='Ada', last_name='Lovelace', phone_number='08031234567',
+        )
+
+    def count_verifications(self):
+        verify = firebase_utils.get_token_verifier().verify
+        patcher = mock.patch.object(firebase_utils.get_token_verifier(), 'verify', side_effect=verify)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_profile_request_verifies_token_once(self):
+        verify = self.count_verifications()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/user/profile/', **self.auth_header())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'user@example.com')
+        self.assertEqual(verify.call_count, 1)
+
+    def test_repeat_requests_reuse_cached_claims(self):
+        verify = self.count_verifications()
+        headers = self.auth_header()
+        self.client.get('/api/user/profile/', **headers)
+        self.client.get(f'/api/user/profile/{self.user.pk}/', **headers)
+        self.assertEqual(verify.call_count, 1)
+
+
+class NegativeCacheTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        get_token_cache().clear()
+        get_rejected_tokens().clear()
+        cache.clear()
+
+    def count_verifications(self, **kwargs):
+        verifier = firebase_utils.get_token_verifier()
+        patcher = mock.patch.object(verifier, 'verify', **(kwargs or {'side_effect': verifier.verify}))
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_rejected_token_is_not_verified_again(self):
+        verify = self.count_verifications()
+        headers = self.auth_header(expires_in=-60)
+        hits = NEGATIVE_CACHE_HITS.value(kind='token')
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/user/async/profile/', **headers).status_code, 401)
+        self.assertEqual(verify.call_count, 1)
+        self.assertEqual(NEGATIVE_CACHE_HITS.value(kind='token'), hits + 2)
+        self.assertIn('negative_cache_hits_total{kind="token"}', scrape_metrics(self.client).content.decode())
+
+    def test_transient_failures_are_not_cached(self):
+        verify = self.count_verifications(side_effect=OSError('key server unreachable'))
+        headers = self.auth_header()
+        for _ in range(2):
+            self.client.get('/api/user/async/profile/', **headers)
+        self.assertEqual(verify.call_count, 2)
+
+    def test_clock_skew_and_unknown_keys_are_not_cached(self):
+        verify = self.count_verifications()
+        misses = NEGATIVE_CACHE_MISSES.value(kind='token')
+        ahead = int(time.time()) + 120
+        rotated = LocalTokenSigner(kid='rotated-key')
+        for headers in (
+            self.auth_header(iat=ahead),
+            self.auth_header(auth_time=ahead),
+            {'HTTP_AUTHORIZATION': f"Bearer {rotated.sign('uid-1', 'user@example.com')}"},
+        ):
+            for _ in range(2):
+                self.assertEqual(self.client.get('/api/user/async/profile/', **headers).status_code, 401)
+        self.assertEqual(verify.call_count, 6)
+        self.assertEqual(NEGATIVE_CACHE_MISSES.value(kind='token'), misses)
+
+    def test_unknown_uid_is_cached_until_the_profile_is_created(self):
+        with self.assertNumQueries(1):
+            self.assertIsNone(profile_cache.get_profile(firebase_uid='uid-new'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(profile_cache.get_profile(firebase_uid='uid-new'))
+            self.assertTrue(profile_cache.is_known_missing('uid-new'))
+
+        response = self.client.post(
+            '/api/user/profile/create/', PROFILE_PAYLOAD, content_type='application/json',
+            **self.auth_header(uid='uid-new', email='new@example.com'),
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(profile_cache.is_known_missing('uid-new'))
+        self.assertEqual(profile_cache.get_profile(firebase_uid='uid-new')['data']['first_name'], 'Ada')
+
+
+class ProfileCacheTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', password='x', firebase_uid='uid-1',
+            first_name='Ada', last_name='Lovelace', phone_number='08031234567',
+        )
+        self.headers = self.auth_header()
+
+    def test_second_read_is_served_from_cache(self):
+        url = f'/api/user/profile/{self.user.pk}/'
+        with self.assertNumQueries(2):
+            self.client.get(url, **self.headers)
+        with self.assertNumQueries(0):  # principal and profile both cached
+            response = self.client.get(url, **self.headers)
+        self.assertEqual(response.json()['first_name'], 'Ada')
+
+    def test_save_invalidates_cached_profile(self):
+        url = f'/api/user/profile/{self.user.pk}/'
+        self.client.get(url, **self.headers)
+        response = self.client.patch(
+            f'/api/user/profile/{self.user.pk}/update-phone/',
+            {'phone_number': '08039999999'}, content_type='application/json', **self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, **self.headers).json()['phone_number'], '+2348039999999')
+
+    def test_matching_etag_returns_304_without_body(self):
+        response = self.client.get('/api/user/profile/', **self.headers)
+        self.assertIn('Last-Modified', response)
+        revalidated = self.client.get(
+            '/api/user/profile/', HTTP_IF_NONE_MATCH=response['ETag'], **self.headers
+        )
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b'')
+
+
+def scrape_metrics(client, **extra):
+    with override_settings(METRICS_TOKEN='test-scraper'):
+        return client.get('/metrics', HTTP_AUTHORIZATION='Bearer test-scraper', **extra)
+
+
+PROFILE_PAYLOAD = {
+    'first_name': 'Ada',
+    'last_name': 'Lovelace',
+    'phone_number': '08031234567',
+    'password': 'Str0ng!Passw0rd',
+    'retype_password': 'Str0ng!Passw0rd',
+}
+
+
+class ProfileCreateTests(FirebaseTokenMixin, TestCase):
+    def test_create_sets_profile_fields_from_token_and_body(self):
+        response = self.client.post(
+            '/api/user/profile/create/', PROFILE_PAYLOAD,
+            content_type='application/json', **self.auth_header(uid='uid-9', email='new@example.com'),
+        )
+        self.assertEqual(response.status_code, 201)
+        user = CustomUser.objects.get(firebase_uid='uid-9')
+        self.assertEqual(user.email, 'new@example.com')
+        self.assertEqual(user.phone_number, '+2348031234567')
+        self.assertTrue(user.check_password('Str0ng!Passw0rd'))
+
+    def test_update_writes_only_changed_columns(self):
+        headers = self.auth_header(uid='uid-9', email='new@example.com')
+        self.client.post('/api/user/profile/create/', PROFILE_PAYLOAD, content_type='application/json', **headers)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                '/api/user/profile/create/', {**PROFILE_PAYLOAD, 'phone_number': '08039999999'},
+                content_type='application/json', **headers,
+            )
+        self.assertEqual(response.status_code, 201)
+        (update,) = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertIn('"phone_number"', update)
+        self.assertIn('"password"', update)
+        self.assertNotIn('"first_name"', update)
+        self.assertEqual(CustomUser.objects.get(firebase_uid='uid-9').phone_number, '+2348039999999')
+
+    def test_email_taken_by_another_account_is_a_validation_error(self):
+        CustomUser.objects.create_user(email='new@example.com', password='x', firebase_uid='uid-other')
+        with self.assertRaises(serializers.ValidationError) as ctx:
+            upsert_profile({**PROFILE_PAYLOAD, 'firebase_uid': 'uid-9', 'email': 'new@example.com'})
+        self.assertIn('email', ctx.exception.detail)
+
+    def test_invalid_phone_is_rejected(self):
+        response = self.client.post(
+            '/api/user/profile/create/', {**PROFILE_PAYLOAD, 'phone_number': '12345'},
+            content_type='application/json', **self.auth_header(uid='uid-9', email='new@example.com'),
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncEndpointTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.async_client = AsyncClient()
+
+    async def test_login_creates_then_reuses_user(self):
+        token = self.signer.sign('uid-a', 'async@example.com', name='Grace Hopper')
+        first = await self.async_client.post(
+            '/api/user/async/firebase-login/', {'id_token': token}, content_type='application/json'
+        )
+        second = await self.async_client.post(
+            '/api/user/async/firebase-login/', {'id_token': token}, content_type='application/json'
+        )
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.json()['created'])
+        self.assertFalse(second.json()['created'])
+        self.assertEqual(second.json()['full_name'], 'Grace')
+
+    async def test_create_then_read_profile(self):
+        token = self.signer.sign('uid-a', 'async@example.com')
+        headers = {'headers': {'Authorization': f'Bearer {token}'}}
+        created = await self.async_client.post(
+            '/api/user/async/profile/create/', PROFILE_PAYLOAD, content_type='application/json', **headers
+        )
+        self.assertEqual(created.status_code, 201)
+
+        response = await self.async_client.get('/api/user/async/profile/', **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'async@example.com')
+
+        by_pk = await self.async_client.get(f"/api/user/async/profile/{created.json()['id']}/", **headers)
+        self.assertEqual(by_pk.json()['first_name'], 'Ada')
+
+    async def test_missing_token_is_unauthorized(self):
+        response = await self.async_client.get('/api/user/async/profile/')
+        self.assertEqual(response.status_code, 401)
+
+
+def bulk_row(uid, email, **overrides):
+    row = {
+        'firebase_uid': uid, 'email': email, 'first_name': 'Ada', 'last_name': 'Lovelace',
+        'phone_number': '08031234567', 'password': 'Str0ng!Passw0rd',
+    }
+    row.update(overrides)
+    return row
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    BULK_IMPORT_HASH_WORKERS=0,
+    PASSWORD_HASHING_WORKERS=0,
+)
+class BulkImportTests(FirebaseTokenMixin, TestCase):
+    def jsonl(self, *rows):
+        return '\n'.join(json.dumps(row) for row in rows).encode()
+
+    def test_valid_rows_are_created_and_bad_rows_reported(self):
+        report = import_profiles(self.jsonl(
+            bulk_row('u1', 'one@example.com'),
+            bulk_row('u2', 'two@example.com', phone_number='123'),
+            bulk_row('u3', 'three@example.com'),
+        ) + b'\nnot json\n')
+        self.assertEqual((report['total'], report['created'], report['updated']), (4, 2, 0))
+        self.assertEqual([error['row'] for error in report['errors']], [2, 4])
+        self.assertIn('phone_number', report['errors'][0]['errors'])
+        self.assertTrue(CustomUser.objects.get(firebase_uid='u1').check_password('Str0ng!Passw0rd'))
+
+    def test_existing_profiles_are_upserted_by_uid_and_email(self):
+        CustomUser.objects.create_user(email='one@example.com', firebase_uid='u1', first_name='Old')
+        CustomUser.objects.create_user(email='mail@example.com', first_name='Old')
+        report = import_profiles(self.jsonl(
+            bulk_row('u1', 'one@example.com', first_name='New'),
+            bulk_row(None, 'mail@example.com', first_name='New'),
+        ).replace(b'"firebase_uid": null, ', b''), chunk_size=1)
+        self.assertEqual((report['created'], report['updated'], report['errors']), (0, 2, []))
+        self.assertEqual(CustomUser.objects.filter(first_name='New').count(), 2)
+
+    def test_conflicting_row_does_not_sink_its_chunk(self):
+        CustomUser.objects.create_user(email='taken@example.com', firebase_uid='other')
+        report = import_profiles(self.jsonl(
+            bulk_row('u1', 'one@example.com'),
+            bulk_row('u2', 'taken@example.com'),
+        ))
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([error['row'] for error in report['errors']], [2])
+
+    def test_csv_import_with_process_pool(self):
+        body = (
+            'firebase_uid,email,first_name,last_name,phone_number,password\n'
+            'u1,one@example.com,Ada,Lovelace,08031234567,Str0ng!Passw0rd\n'
+        )
+        hashed = HASH_SECONDS.count()
+        report = import_profiles(body, fmt='csv', workers=1)
+        self.assertEqual(report['created'], 1)
+        self.assertEqual(HASH_SECONDS.count(), hashed + 1)
+        self.assertTrue(CustomUser.objects.get(firebase_uid='u1').check_password('Str0ng!Passw0rd'))
+
+    def test_endpoint_requires_staff(self):
+        CustomUser.objects.create_user(email='user@example.com', firebase_uid='uid-1')
+        body = self.jsonl(bulk_row('u1', 'one@example.com'))
+        response = self.client.post(
+            '/api/user/profiles/bulk/', body, content_type='application/x-ndjson', **self.auth_header()
+        )
+        self.assertEqual(response.status_code, 403)
+
+        staff = CustomUser.objects.get(firebase_uid='uid-1')
+        staff.is_staff = True
+        staff.save(update_fields=['is_staff'])  # drops the cached principal
+        response = self.client.post(
+            '/api/user/profiles/bulk/', body, content_type='application/x-ndjson', **self.auth_header()
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+
+    @override_settings(BULK_IMPORT_HASH_WORKERS=4)
+    def test_endpoint_hashes_through_the_shared_service(self):
+        CustomUser.objects.create_user(email='user@example.com', firebase_uid='uid-1', is_staff=True)
+        body = self.jsonl(bulk_row('u1', 'one@example.com'), bulk_row('u2', 'two@example.com'))
+        hashed = HASH_SECONDS.count()
+        with mock.patch('user.bulk.PasswordHashingService') as private_service:
+            response = self.client.post(
+                '/api/user/profiles/bulk/', body, content_type='application/x-ndjson', **self.auth_header()
+            )
+        self.assertEqual(response.json()['created'], 2)
+        private_service.assert_not_called()
+        self.assertEqual(HASH_SECONDS.count(), hashed + 2)
+
+    def test_hash_many_keeps_order_through_the_pool(self):
+        service = PasswordHashingService(workers=2)
+        self.addCleanup(service.shutdown)
+        passwords = [f'Str0ng!Passw0rd{i}' for i in range(5)]
+        encoded = service.hash_many(passwords)
+        self.assertTrue(all(check_password(raw, hashed) for raw, hashed in zip(passwords, encoded)))
+        # Never forked from the (threaded) server process.
+        self.assertEqual(service._executor._mp_context.get_start_method(), 'spawn')
+        service._executor.shutdown(wait=True)  # slots are released by the pool's callback thread
+        self.assertEqual(service.queue_depth, 0)
+
+    def test_management_command(self):
+        path = os.path.join(self.tmpdir, 'profiles.jsonl')
+        with open(path, 'wb') as fh:
+            fh.write(self.jsonl(bulk_row('u1', 'one@example.com')))
+        out = StringIO()
+        call_command('import_profiles', path, '--workers', '0', stdout=out)
+        self.assertIn('1 created', out.getvalue())
+
+
+class ProfileBatchTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [
+            CustomUser.objects.create_user(
+                email=f'user{i}@example.com', firebase_uid=f'uid-{i}', first_name=f'User{i}',
+            )
+            for i in range(1, 4)
+        ]
+        self.headers = self.auth_header()
+
+    def batch(self, body):
+        return self.client.post('/api/user/profiles/batch/', body, content_type='application/json', **self.headers)
+
+    def test_resolves_pks_with_one_query_then_from_cache(self):
+        pks = [user.pk for user in self.users] + [999]
+        with self.assertNumQueries(2):  # authentication + one IN query
+            response = self.batch({'ids': pks})
+        body = response.json()
+        self.assertEqual(body['missing'], [999])
+        self.assertEqual(body['profiles'][str(self.users[1].pk)]['first_name'], 'User2')
+
+        with self.assertNumQueries(0):  # principal and profiles both cached
+            cached = self.batch({'ids': pks[:3]}).json()
+        self.assertEqual(cached['profiles'], body['profiles'])
+
+    def test_batch_payload_matches_single_profile_endpoint(self):
+        user = self.users[0]
+        self.batch({'firebase_uids': ['uid-1']})
+        single = self.client.get(f'/api/user/profile/{user.pk}/', **self.headers).json()
+        self.assertEqual(self.batch({'firebase_uids': ['uid-1']}).json()['profiles']['uid-1'], single)
+
+    def test_rejects_oversized_or_ambiguous_requests(self):
+        with override_settings(PROFILE_BATCH_MAX_IDS=2):
+            self.assertEqual(self.batch({'ids': [1, 2, 3]}).status_code, 400)
+        self.assertEqual(self.batch({'ids': [1], 'firebase_uids': ['a']}).status_code, 400)
+        self.assertEqual(self.batch({}).status_code, 400)
+
+    def test_invalid_ids_are_a_400(self):
+        # List item errors are keyed by int index, which orjson rejects by default.
+        response = self.batch({'ids': ['abc']})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('0', response.json()['ids'])
+
+
+class ProfileListFixture(FirebaseTokenMixin):
+    def setUp(self):
+        CustomUser.objects.create_user(email='admin@example.com', firebase_uid='uid-1', is_staff=True)
+        CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f'user{i:04d}@example.com', firebase_uid=f'bulk-{i}', first_name=f'First{i % 50}',
+                last_name=f'Last{i % 70}', phone_number=f'+23480{i:08d}', is_active=i % 10 != 0,
+            )
+            for i in range(200)
+        ])
+        self.headers = self.auth_header()
+
+    def list(self, url='/api/user/profiles/', **params):
+        return self.client.get(url, params, **self.headers)
+
+
+class ProfileListTests(ProfileListFixture, TestCase):
+    def test_cursor_walks_every_row_once_in_email_order(self):
+        emails = []
+        response = self.list(limit=64)
+        while True:
+            body = response.json()
+            emails += [row['email'] for row in body['results']]
+            if not body['next']:
+                break
+            response = self.client.get(body['next'], **self.headers)
+        self.assertEqual(len(emails), 201)
+        self.assertEqual(emails, sorted(emails))
+
+    def test_filters(self):
+        self.assertEqual(len(self.list(is_active='false', limit=500).json()['results']), 20)
+        phones = [row['phone_number'] for row in self.list(phone_prefix='0800000001').json()['results']]
+        self.assertEqual(sorted(phones), [f'+234800000001{i}' for i in range(10)])
+        names = self.list(name_prefix='First4', limit=500).json()['results']
+        self.assertTrue(names)
+        self.assertTrue(all(row['first_name'].startswith('First4') for row in names))
+        self.assertEqual(self.list(is_active='maybe').status_code, 400)
+
+    def test_requires_staff(self):
+        CustomUser.objects.filter(firebase_uid='uid-1').update(is_staff=False)
+        self.assertEqual(self.list().status_code, 403)
+
+
+class ProfileListQueryPlanTests(ProfileListFixture, TestCase):
+    """
+    Checks the plans SQLite picks for the list queries when its statistics
+    describe a 1M-row table. Real statistics come from ANALYZE over the test
+    rows and are then scaled up, which gives the same plans as a populated
+    1M-row table at a fraction of the setup time.
+    """
+    ROWS = 1_000_000
+    DISTINCT = {'first_name': 200, 'last_name': 150, 'is_active': ROWS // 2}
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plan assertions are written for SQLite.')
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'user_customuser'")
+            stats = [('user_customuser', None, str(self.ROWS))]
+            for (index,) in cursor.fetchall():
+                cursor.execute(f"PRAGMA index_info('{index}')")
+                per_prefix, rows = [], None
+                for column in [row[2] for row in cursor.fetchall()]:
+                    distinct = self.DISTINCT.get(column, 1)
+                    rows = distinct if rows is None else min(rows, distinct)
+                    per_prefix.append(rows)
+                stats.append(('user_customuser', index, ' '.join(map(str, [self.ROWS, *per_prefix]))))
+            cursor.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'user_customuser'")
+            cursor.executemany('INSERT INTO sqlite_stat1 VALUES (%s, %s, %s)', stats)
+            cursor.execute('ANALYZE sqlite_schema')
+
+    def assert_index_driven(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.list(**params).status_code, 200)
+        list_sql = [q['sql'] for q in queries if 'ORDER BY "user_customuser"."email"' in q['sql']]
+        self.assertEqual(len(list_sql), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + list_sql[0])
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertFalse([step for step in plan if step == 'SCAN user_customuser'], plan)
+        self.assertTrue([step for step in plan if 'USING INDEX' in step], plan)
+
+    def test_plans_use_indexes(self):
+        self.assert_index_driven()
+        cursor_url = self.list(limit=10).json()['next']
+        self.assert_index_driven(url=cursor_url)
+        self.assert_index_driven(is_active='true')
+        self.assert_index_driven(phone_prefix='0803')
+        self.assert_index_driven(name_prefix='Ada')
+
+    def test_phone_uniqueness_check_uses_index(self):
+        sql, params = CustomUser.objects.filter(phone_number='+2348031234567').exclude(pk=1).query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('USING INDEX user_phone_number_idx', plan)
+
+
+class ExportTests(ProfileListFixture, TestCase):
+    def export(self, **params):
+        response = self.list('/api/user/profiles/export/', **params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_streams_every_row_without_passwords(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="profiles.csv"', response['Content-Disposition'])
+        rows = list(csv.DictReader(body.decode().splitlines()))
+        self.assertEqual(len(rows), 201)
+        self.assertNotIn('password', rows[0])
+        self.assertEqual([int(row['id']) for row in rows], sorted(int(row['id']) for row in rows))
+        self.assertEqual(rows[1]['phone_number'], '+2348000000000')
+
+    def test_jsonl_field_selection_since_id_and_gzip(self):
+        last = CustomUser.objects.order_by('-id').values_list('id', flat=True)[5]
+        response, body = self.export(output='jsonl', fields='id,email', since_id=last, gzip='true')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(line) for line in gzip.decompress(body).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(set(rows[0]), {'id', 'email'})
+        self.assertTrue(all(row['id'] > last for row in rows))
+
+    def test_since_timestamp(self):
+        cutoff = timezone.now() + timedelta(minutes=1)
+        CustomUser.objects.filter(firebase_uid='bulk-7').update(updated_at=cutoff + timedelta(minutes=1))
+        _, body = self.export(output='jsonl', since=cutoff.isoformat())
+        self.assertEqual([json.loads(line)['email'] for line in body.decode().splitlines()], ['user0007@example.com'])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.list('/api/user/profiles/export/', fields='email,password').status_code, 400)
+        self.assertEqual(self.list('/api/user/profiles/export/', output='xml').status_code, 400)
+        self.assertEqual(self.list('/api/user/profiles/export/', since='yesterday').status_code, 400)
+        for since_id in ('\u00b2', '-1', str(2 ** 63)):
+            self.assertEqual(self.list('/api/user/profiles/export/', since_id=since_id).status_code, 400)
+        CustomUser.objects.filter(firebase_uid='uid-1').update(is_staff=False)
+        cache.clear()
+        self.assertEqual(self.list('/api/user/profiles/export/').status_code, 403)
+
+    def test_writer_buffers_rows_into_chunks(self):
+        chunks = list(iter_export(['id'], 'jsonl'))
+        self.assertEqual(len(chunks), 1)  # 201 short lines fit one buffer
+        writer = ExportWriter(['id', 'email'], 'csv', buffer_size=100)
+        self.assertEqual(writer.begin(), b'')
+        written = [writer.write((i, f'user{i}@example.com')) for i in range(10)]
+        self.assertTrue(0 < sum(map(bool, written)) < 10)
+        body = b''.join([b''] + written + [writer.finish()]).decode()
+        self.assertEqual(len(body.splitlines()), 11)
+
+    def test_async_stream(self):
+        async def fetch():
+            response = await AsyncClient().get(
+                '/api/user/profiles/export/', {'output': 'jsonl'},
+                headers={'Authorization': self.headers['HTTP_AUTHORIZATION']},
+            )
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        response, body = async_to_sync(fetch)()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(body.decode().splitlines()), 201)
+
+    def test_management_command(self):
+        path = os.path.join(self.tmpdir, 'profiles.jsonl.gz')
+        call_command('export_profiles', path, '--fields', 'email,is_active', '--chunk-size', '50', stderr=StringIO())
+        with gzip.open(path, 'rt') as fh:
+            rows = [json.loads(line) for line in fh]
+        self.assertEqual(len(rows), 201)
+        self.assertEqual(sum(not row['is_active'] for row in rows), 20)
+
+
+@override_settings(METRICS_ALLOWED_IPS=['10.0.0.9'], METRICS_TOKEN='scrape-secret')
+class MetricsAccessTests(SimpleTestCase):
+    def test_only_allowed_ips_and_the_token_can_scrape(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.9').status_code, 200)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN='', DEBUG=False)
+    def test_closed_by_default_outside_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+
+class PasswordHashingTests(FirebaseTokenMixin, TestCase):
+    def test_pool_hashes_with_configured_hasher(self):
+        service = PasswordHashingService(workers=1)
+        self.addCleanup(service.shutdown)
+        observed = HASH_SECONDS.count()
+        encoded = service.hash('Str0ng!Passw0rd')
+        self.assertTrue(check_password('Str0ng!Passw0rd', encoded))
+        self.assertEqual(HASH_SECONDS.count(), observed + 1)
+
+    def test_saturated_service_fails_fast(self):
+        service = PasswordHashingService(workers=0, max_pending=1, retry_after=3)
+        service._pending = 1
+        with self.assertRaises(HashingUnavailable) as ctx:
+            service.hash('Str0ng!Passw0rd')
+        self.assertEqual(ctx.exception.wait, 3)
+
+    def test_timed_out_hash_holds_its_slot_until_it_finishes(self):
+        service = PasswordHashingService(workers=1, max_pending=1, timeout=0.05)
+        service._executor = ThreadPoolExecutor(1)
+        self.addCleanup(service.shutdown)
+        finish = threading.Event()
+        with mock.patch('user.hashing._timed_make_password', lambda raw: (finish.wait(5) and 'x', 0.0)):
+            with self.assertRaisesMessage(HashingUnavailable, 'timed out'):
+                service.hash('Str0ng!Passw0rd')
+            self.assertEqual(service.queue_depth, 1)
+            with self.assertRaisesMessage(HashingUnavailable, 'saturated'):
+                service.hash('Str0ng!Passw0rd')
+            finish.set()
+            service._executor.shutdown(wait=True)
+        self.assertEqual(service.queue_depth, 0)
+
+    @override_settings(PASSWORD_HASHING_MAX_PENDING=1, PASSWORD_HASHING_RETRY_AFTER=2)
+    def test_create_returns_503_with_retry_after_when_saturated(self):
+        service = get_hashing_service()
+        service._pending = 1
+        self.addCleanup(setattr, service, '_pending', 0)
+        response = self.client.post(
+            '/api/user/profile/create/', PROFILE_PAYLOAD,
+            content_type='application/json', **self.auth_header(uid='uid-9', email='new@example.com'),
+        )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_metrics_endpoint_exposes_hashing_metrics(self):
+        body = scrape_metrics(self.client).content.decode()
+        self.assertIn('# TYPE password_hash_queue_depth gauge', body)
+        self.assertIn('# TYPE password_hash_seconds histogram', body)
+
+
+def server_timing(response):
+    """``Server-Timing`` header as ``{metric: {'dur': ..., 'desc': ...}}``."""
+    metrics = {}
+    for entry in response['Server-Timing'].split(','):
+        name, *params = entry.strip().split(';')
+        metrics[name] = dict(param.split('=', 1) for param in params)
+    return metrics
+
+
+@override_settings(SERVER_TIMING_HEADER=True)
+class InstrumentationTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', password='x', firebase_uid='uid-1', first_name='Ada',
+        )
+
+    def test_server_timing_reports_each_stage(self):
+        get_token_cache().clear()
+        response = self.client.get(f'/api/user/profile/{self.user.pk}/', **self.auth_header())
+        timings = server_timing(response)
+        self.assertEqual(set(timings), {'verify', 'db', 'serialize', 'render', 'total'})
+        self.assertEqual(timings['db']['desc'], '"2 queries"')
+        self.assertGreaterEqual(float(timings['total']['dur']), float(timings['verify']['dur']))
+
+    async def test_async_views_report_into_the_same_request(self):
+        response = await AsyncClient().get(
+            '/api/user/async/profile/', headers={'Authorization': self.auth_header()['HTTP_AUTHORIZATION']},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db', server_timing(response))
+
+    def test_latency_histograms_are_labelled_by_url_name(self):
+        observed = REQUEST_SECONDS.count(url_name='view_user_profile_api', method='GET')
+        self.client.get(f'/api/user/profile/{self.user.pk}/', **self.auth_header())
+        self.assertEqual(REQUEST_SECONDS.count(url_name='view_user_profile_api', method='GET'), observed + 1)
+        body = scrape_metrics(self.client).content.decode()
+        self.assertIn('http_request_stage_seconds_count{stage="db",url_name="view_user_profile_api"}', body)
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_can_be_disabled(self):
+        response = self.client.get('/api/user/profile/', **self.auth_header())
+        self.assertNotIn('Server-Timing', response)
+
+
+class BenchmarkToolsTests(SimpleTestCase):
+    def test_queries_are_read_from_server_timing(self):
+        self.assertEqual(queries_from_header('verify;dur=1.00, db;dur=0.52;desc="3 queries", total;dur=4.10'), 3)
+        self.assertEqual(queries_from_header('render;dur=0.10, total;dur=0.30'), 0)
+
+    def test_compare_flags_throughput_latency_and_query_regressions(self):
+        def run(rps, p95, queries):
+            return {'results': [{'scenario': 'read', 'concurrency': 10, 'rps': rps,
+                                 'p95_ms': p95, 'queries_per_request': queries}]}
+
+        _, regressed = compare(run(1000, 10, 1), run(950, 10.5, 1), threshold=10)
+        self.assertFalse(regressed)
+        for new in (run(800, 10, 1), run(1000, 12, 1), run(1000, 10, 2)):
+            _, regressed = compare(run(1000, 10, 1), new, threshold=10)
+            self.assertTrue(regressed)
+
+
+STARTUP_BUDGET_SECONDS = 3.0
+
+COLD_START_SCRIPT = """
+import json, os, sys, time
+started = time.perf_counter()
+import profiles.wsgi
+from django.urls import resolve
+resolve('/api/user/profile/')
+print(json.dumps({'seconds': time.perf_counter() - started, 'firebase_admin': 'firebase_admin' in sys.modules}))
+"""
+
+
+class FirebaseStartupTests(SimpleTestCase):
+    """Worker boot and management commands must not touch the Firebase SDK."""
+
+    def run_cold(self, *args):
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'profiles.settings',
+            # Would fail any eager initialization.
+            'FIREBASE_CREDENTIALS': os.path.join(tempfile.gettempdir(), 'missing-credentials.json'),
+        }
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, *args], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        elapsed = time.perf_counter() - started
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result, elapsed
+
+    def test_wsgi_boot_within_budget_without_firebase(self):
+        result, _ = self.run_cold('-c', COLD_START_SCRIPT)
+        report = json.loads(result.stdout)
+        self.assertFalse(report['firebase_admin'])
+        self.assertLess(report['seconds'], STARTUP_BUDGET_SECONDS)
+
+    def test_manage_py_check_within_budget(self):
+        result, elapsed = self.run_cold('manage.py', 'check')
+        self.assertNotIn('FIREBASE_CREDENTIALS', result.stdout)
+        self.assertLess(elapsed, STARTUP_BUDGET_SECONDS)
+
+    def test_app_is_initialized_once_across_threads(self):
+        self.addCleanup(setattr, firebase_client, '_app', firebase_client._app)
+        firebase_client._app = None
+        with mock.patch('firebase_admin.get_app', side_effect=ValueError), \
+                mock.patch('firebase_admin.credentials.Certificate'), \
+                mock.patch('firebase_admin.initialize_app', side_effect=lambda cred: time.sleep(0.05) or object()) as init, \
+                override_settings(FIREBASE_CREDENTIALS=__file__):
+            threads = [threading.Thread(target=firebase_client.get_firebase_app) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(init.call_count, 1)
+
+    def test_missing_credentials_fail_on_first_use(self):
+        self.addCleanup(setattr, firebase_client, '_app', firebase_client._app)
+        firebase_client._app = None
+        with mock.patch('firebase_admin.get_app', side_effect=ValueError), \
+                override_settings(FIREBASE_CREDENTIALS='/nonexistent/credentials.json'):
+            with self.assertRaises(ImproperlyConfigured):
+                firebase_client.get_firebase_app()
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch.object(routers, 'replica_configured', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_wrapped_reads_go_to_the_replica(self):
+        self.assertEqual(CustomUser.objects.filter(pk=1).db, 'default')
+        with routers.replica_reads(pk=1):
+            self.assertEqual(CustomUser.objects.filter(pk=1).db, 'replica')
+            self.assertEqual(CustomUser.objects.select_for_update().db, 'default')
+
+    def test_recently_written_user_sticks_to_primary(self):
+        routers.mark_written(pk=1, firebase_uid='uid-1')
+        with routers.replica_reads(pk=1):
+            self.assertEqual(CustomUser.objects.filter(pk=1).db, 'default')
+        with routers.replica_reads(firebase_uid='uid-1'):
+            self.assertEqual(CustomUser.objects.filter(firebase_uid='uid-1').db, 'default')
+        with routers.replica_reads(pk=2):
+            self.assertEqual(CustomUser.objects.filter(pk=2).db, 'replica')
+
+    def test_without_replica_everything_uses_default(self):
+        with mock.patch.object(routers, 'replica_configured', return_value=False):
+            with routers.replica_reads(pk=1):
+                self.assertEqual(CustomUser.objects.filter(pk=1).db, 'default')
+
+
+REPLICA_SCRIPT = """
+import os, sqlite3
+import django
+django.setup()
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client
+from user.models import CustomUser
+from user.testing import LocalTokenSigner
+
+signer = LocalTokenSigner()
+for alias in ('default', 'replica'):
+    call_command('migrate', database=alias, verbosity=0)
+user = CustomUser.objects.create_user(email='a@example.com', password='x', firebase_uid='uid-1')
+headers = {'HTTP_AUTHORIZATION': 'Bearer ' + signer.sign('uid-1', 'a@example.com')}
+url = '/api/user/profile/%d/' % user.pk
+signer.write_certificates(os.environ['FIREBASE_KEY_SOURCE'])
+
+print(Client().get(url, **headers).status_code)  # just written: served by the primary
+cache.clear()  # sticky window over; the replica has not caught up yet
+print(Client().get(url, **headers).status_code)
+sqlite3.connect(os.environ['DB_NAME']).backup(sqlite3.connect(os.environ['DB_REPLICA_NAME']))  # "replication"
+print(Client().get(url, **headers).status_code)
+"""
+
+
+class ReplicaRoutingIntegrationTests(SimpleTestCase):
+    def test_profile_reads_use_a_second_sqlite_file_as_replica(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'profiles.settings',
+            'DB_NAME': os.path.join(tmpdir, 'primary.sqlite3'),
+            'DB_REPLICA_NAME': os.path.join(tmpdir, 'replica.sqlite3'),
+            'FIREBASE_TOKEN_VERIFIER': 'local',
+            'FIREBASE_PROJECT_ID': 'test-project',
+            'FIREBASE_KEY_SOURCE': os.path.join(tmpdir, 'certs.json'),
+            'ALLOWED_HOSTS': 'testserver',
+            'PASSWORD_HASHING_WORKERS': '0',
+        }
+        result = subprocess.run(
+            [sys.executable, '-c', REPLICA_SCRIPT], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        # The replica lacks the new row until it is copied over.
+        self.assertEqual(result.stdout.split(), ['200', '404', '200'])
+
+
+def flaky_write(failures, message='database is locked'):
+    calls = []
+
+    def write():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise OperationalError(message)
+        return 'ok'
+    return write, calls
+
+
+@override_settings(DB_LOCK_RETRY_ATTEMPTS=3, DB_LOCK_RETRY_BASE_DELAY=0)
+class LockRetryTests(SimpleTestCase):
+
+    def test_lock_errors_are_retried(self):
+        write, calls = flaky_write(2)
+        retried = LOCK_RETRIES.value()
+        self.assertEqual(retry_on_lock(write)(), 'ok')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(LOCK_RETRIES.value(), retried + 2)
+
+    def test_gives_up_after_the_configured_attempts(self):
+        write, calls = flaky_write(5)
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(len(calls), 3)
+
+    def test_other_errors_are_not_retried(self):
+        write, calls = flaky_write(1, message='no such table: user_customuser')
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(len(calls), 1)
+
+
+@override_settings(DB_LOCK_RETRY_ATTEMPTS=3, DB_LOCK_RETRY_BASE_DELAY=0)
+class LockRetryInTransactionTests(TestCase):
+    def test_lock_error_inside_atomic_is_left_to_the_outer_caller(self):
+        write, calls = flaky_write(1)
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            retry_on_lock(write)()
+        self.assertEqual(len(calls), 1)
+
+
+class SQLiteWritersTests(SimpleTestCase):
+    def test_concurrent_signups_on_tuned_sqlite(self):
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_writers', '--modes', 'tuned+retry',
+             '--writers', '50', '--processes', '5', '--writes', '2', '--json'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        self.assertEqual(report['journal_mode'], 'wal')
+        self.assertEqual(report['requests'], 100)
+        self.assertEqual(report['error_rate'], 0)
+
+
+@override_settings(PASSWORD_HASHING_WORKERS=0, PASSWORD_HASHING_MAX_PENDING=64)
+class ConcurrentUpsertTests(FirebaseTokenMixin, TransactionTestCase):
+    def test_parallel_creates_for_one_uid_leave_one_row(self):
+        headers = self.auth_header(uid='uid-race', email='race@example.com')
+        statuses = []
+        barrier = threading.Barrier(8)
+
+        def create(index):
+            barrier.wait()
+            response = Client(raise_request_exception=False).post(
+                '/api/user/profile/create/', {**PROFILE_PAYLOAD, 'first_name': f'Racer{index}'},
+                content_type='application/json', **headers,
+            )
+            statuses.append(response.status_code)
+            connection.close()
+
+        threads = [threading.Thread(target=create, args=(index,)) for index in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(statuses, [201] * 8)
+        self.assertEqual(CustomUser.objects.filter(firebase_uid='uid-race').count(), 1)
+
+
+class LoggingPipelineTests(SimpleTestCase):
+    def make_record(self, msg, args=(), **extra):
+        record = logging.LogRecord('user.views', logging.INFO, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_redaction_masks_sensitive_keys_tokens_and_claims(self):
+        token = LocalTokenSigner().sign('uid-1', 'user@example.com')
+        record = self.make_record(
+            'Create profile %s with header %s',
+            ({'first_name': 'Ada', 'password': 'Str0ng!Passw0rd', 'nested': {'id_token': token}},
+             f'Bearer {token}'),
+            claims={'uid': 'uid-1', 'email': 'user@example.com'},
+        )
+        RedactingFilter().filter(record)
+        message = record.getMessage()
+        self.assertIn("'first_name': 'Ada'", message)
+        self.assertNotIn('Str0ng!Passw0rd', message)
+        self.assertNotIn(token, message)
+        self.assertEqual(record.claims, '[redacted]')
+
+    def test_mapping_argument_is_redacted(self):
+        record = self.make_record('Login data: %s', ({'id_token': 'abc', 'uid': 'u'},))
+        RedactingFilter().filter(record)
+        self.assertEqual(record.getMessage(), "Login data: {'id_token': '[redacted]', 'uid': 'u'}")
+
+    def test_background_handler_writes_json_lines(self):
+        stream = StringIO()
+        handler = BackgroundHandler(stream)
+        handler.setFormatter(JsonFormatter())
+        handler.addFilter(RequestIdFilter())
+        handler.handle(self.make_record('hello %s', ('world',), uid='uid-1'))
+        handler.close()  # stops the listener after draining the queue
+        entry = json.loads(stream.getvalue())
+        self.assertEqual(entry['message'], 'hello world')
+        self.assertEqual(entry['request_id'], '-')
+        self.assertEqual(entry['uid'], 'uid-1')
+
+
+class RequestIdTests(TestCase):
+    def test_request_id_is_generated_echoed_and_logged(self):
+        records = []
+        handler = logging.Handler()
+        handler.addFilter(RequestIdFilter())
+        handler.emit = records.append
+        views_logger = logging.getLogger('user.async_views')
+        views_logger.addHandler(handler)
+        self.addCleanup(views_logger.removeHandler, handler)
+
+        response = self.client.get('/api/user/async/profile/', HTTP_AUTHORIZATION='Bearer not-a-token')
+        self.assertEqual(len(response['X-Request-ID']), 32)
+        self.assertEqual(records[0].request_id, response['X-Request-ID'])
+
+    def test_django_request_error_logs_carry_the_id(self):
+        records = []
+        handler = logging.Handler()
+        handler.addFilter(RequestIdFilter())
+        handler.emit = records.append
+        request_logger = logging.getLogger('django.request')
+        request_logger.addHandler(handler)
+        self.addCleanup(request_logger.removeHandler, handler)
+
+        response = self.client.get('/no-such-page/', HTTP_X_REQUEST_ID='edge-404')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual([record.request_id for record in records], ['edge-404'])
+
+    def test_valid_incoming_request_id_is_kept(self):
+        self.assertEqual(scrape_metrics(self.client, HTTP_X_REQUEST_ID='edge-1234')['X-Request-ID'], 'edge-1234')
+        self.assertNotEqual(scrape_metrics(self.client, HTTP_X_REQUEST_ID='bad id\n')['X-Request-ID'], 'bad id\n')
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_BACKEND='memory')
+class RateLimitTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        CustomUser.objects.create_user(email='user@example.com', password='x', firebase_uid='uid-1')
+
+    def reset(self, email='user@example.com', **extra):
+        return self.client.post(
+            '/api/user/reset-password/',
+            {'email': email, 'new_password': 'n3w-Passw0rd!', 'confirm_password': 'n3w-Passw0rd!'},
+            content_type='application/json', **self.auth_header(), **extra,
+        )
+
+    @override_settings(RATE_LIMITS={'reset_password_api': ['ip:2/m']})
+    def test_over_limit_gets_cheap_429(self):
+        rejected = THROTTLED.value(url_name='reset_password_api', scope='ip')
+        self.assertEqual([self.reset().status_code for _ in range(2)], [200, 200])
+        with self.assertNumQueries(0), mock.patch('user.firebase_utils.verify_firebase_id_token') as verify:
+            response = self.reset()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        verify.assert_not_called()
+        self.assertEqual(THROTTLED.value(url_name='reset_password_api', scope='ip'), rejected + 1)
+        # Another client address has its own budget.
+        self.assertEqual(self.reset(REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(RATE_LIMITS={'firebase_login_api': ['uid:1/m']})
+    def test_uid_limit_follows_the_token_across_addresses(self):
+        def login(uid, address):
+            token = self.signer.sign(uid, f'{uid}@example.com')
+            return self.client.post(
+                '/api/user/firebase-login/', {'id_token': token}, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {token}', REMOTE_ADDR=address,
+            ).status_code
+
+        self.assertEqual(login('uid-1', '10.0.0.1'), 200)
+        self.assertEqual(login('uid-1', '10.0.0.2'), 429)
+        self.assertEqual(login('uid-2', '10.0.0.1'), 200)
+
+    @override_settings(RATE_LIMITS={'firebase_login_api': ['uid:1/m']})
+    def test_forged_tokens_do_not_spend_the_victims_uid_budget(self):
+        forger = LocalTokenSigner(kid=self.signer.kid)  # same kid, wrong key
+
+        def login(signer, address):
+            token = signer.sign('uid-1', 'user@example.com')
+            return self.client.post(
+                '/api/user/firebase-login/', {'id_token': token}, content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {token}', REMOTE_ADDR=address,
+            ).status_code
+
+        self.assertEqual([login(forger, '10.0.0.9') for _ in range(3)], [403] * 3)
+        self.assertEqual(login(self.signer, '10.0.0.1'), 200)
+
+    @override_settings(RATE_LIMITS={'reset_password_api': ['email:1/h']})
+    def test_email_limit_is_case_insensitive(self):
+        self.assertEqual(self.reset().status_code, 200)
+        self.assertEqual(self.reset(email='USER@example.com', REMOTE_ADDR='10.0.0.2').status_code, 429)
+
+    @override_settings(RATE_LIMITS={'reset_password_api': ['ip:1/m']})
+    def test_unlisted_urls_are_not_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/user/profile/', **self.auth_header()).status_code, 200)
+
+    def test_rule_parsing(self):
+        self.assertEqual(Rule.parse('email:5/h'), Rule('email', 5, 3600))
+        with self.assertRaises(ValueError):
+            Rule.parse('user:5/week')
+
+
+class RateLimitBackendTests(SimpleTestCase):
+    def test_memory_window_slides(self):
+        backend = MemoryBackend()
+        with mock.patch('user.throttling.time.time', return_value=600.0):  # start of a window
+            self.assertEqual([backend.hit('k', 4, 60)[0] for _ in range(5)], [True] * 4 + [False])
+        # Half way into the next window, half of the previous 4 still count.
+        with mock.patch('user.throttling.time.time', return_value=690.0):
+            self.assertEqual([backend.hit('k', 4, 60)[0] for _ in range(3)], [True, True, False])
+            self.assertEqual(backend.hit('k', 4, 60), (False, 1))
+        # Two windows later nothing counts.
+        with mock.patch('user.throttling.time.time', return_value=780.0):
+            self.assertTrue(backend.hit('k', 4, 60)[0])
+
+    def test_memory_backend_prunes_stale_keys(self):
+        backend = MemoryBackend(max_keys=2)
+        with mock.patch('user.throttling.time.time', return_value=0.0):
+            backend.hit('a', 1, 1)
+            backend.hit('b', 1, 1)
+        with mock.patch('user.throttling.time.time', return_value=10.0):
+            backend.hit('c', 1, 1)
+        self.assertEqual(list(backend._windows), ['c'])
+
+    def test_cache_backend_is_shared_between_instances(self):
+        cache.clear()
+        workers = [CacheBackend(), CacheBackend()]
+        results = [workers[i % 2].hit('shared', 3, 60)[0] for i in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+
+class JSONFastPathTests(FirebaseTokenMixin, TestCase):
+    def test_orjson_renderer_matches_stdlib_renderer(self):
+        from decimal import Decimal
+        from datetime import datetime, timezone as dt_timezone
+
+        from django.utils.translation import gettext_lazy
+        from rest_framework.exceptions import ErrorDetail
+
+        data = {
+            'name': 'Adaé \u2028 ☃', 'id': 7, 'ratio': 0.5, 'flag': True, 'none': None,
+            'when': datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc), 'amount': Decimal('1.50'),
+            'lazy': gettext_lazy('This field is required.'), 'errors': [ErrorDetail('bad', code='invalid')],
+        }
+        self.assertEqual(ORJSONRenderer().render(data), TimedJSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+        self.assertEqual(
+            ORJSONRenderer().render({'a': 1}, 'application/json; indent=2'),
+            TimedJSONRenderer().render({'a': 1}, 'application/json; indent=2'),
+        )
+
+    def test_orjson_parser(self):
+        from io import BytesIO
+
+        from rest_framework.exceptions import ParseError
+
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"name": "Adaé"}'.encode())), {'name': 'Adaé'})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"name": NaN}'))
+
+    def test_malformed_body_is_a_400(self):
+        response = self.client.post(
+            '/api/user/reset-password/', b'{nope', content_type='application/json', **self.auth_header(),
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_values_rows_match_model_serializer(self):
+        CustomUser.objects.create_user(
+            email='a@example.com', firebase_uid='u1', first_name='Adaé', last_name='L', phone_number='08031234567',
+        )
+        CustomUser.objects.create_user(email='b@example.com', firebase_uid='u2')
+        queryset = CustomUser.objects.order_by('id')
+        rows = PROFILE_ROWS.many(PROFILE_ROWS.values(queryset))
+        self.assertEqual(rows, UserProfileSerializer(queryset, many=True).data)
+        self.assertEqual(PROFILE_ROWS.fields, profile_cache.PROFILE_FIELDS)
+
+    def test_values_rows_reject_computed_fields(self):
+        class WithName(UserProfileSerializer):
+            full_name = serializers.CharField(source='get_full_name')
+
+            class Meta(UserProfileSerializer.Meta):
+                fields = UserProfileSerializer.Meta.fields + ['full_name']
+
+        with self.assertRaises(ImproperlyConfigured):
+            ValuesRowSerializer(WithName)
+
+
+class ValidatorTests(FirebaseTokenMixin, TestCase):
+    def test_phone_numbers_normalize_to_e164(self):
+        for spelling in ('08031234567', '+2348031234567', '2348031234567', '0803 123 4567', '(0803) 123-4567'):
+            self.assertEqual(validators.to_e164(spelling), '+2348031234567')
+        for invalid in ('12345', '0603123456', '+14155550123', ''):
+            self.assertIsNone(validators.to_e164(invalid))
+        self.assertEqual(validators.normalize_phone_prefix('0803'), '+234803')
+
+    def test_phone_uniqueness_sees_every_spelling(self):
+        CustomUser.objects.create_user(email='a@example.com', firebase_uid='uid-a', phone_number='08031234567')
+        user = CustomUser.objects.create_user(email='b@example.com', firebase_uid='uid-1')
+        url = f'/api/user/profile/{user.pk}/update-phone/'
+        taken = self.client.patch(url, {'phone_number': '+234 803 123 4567'}, content_type='application/json',
+                                  **self.auth_header())
+        self.assertEqual(taken.json(), {'phone_number': ['Phone number already exists.']})
+        with self.assertNumQueries(4):  # user, uniqueness, update, outbox event (auth from the principal cache)
+            self.client.patch(url, {'phone_number': '0903 000 0000'}, content_type='application/json',
+                              **self.auth_header())
+        user.refresh_from_db()
+        self.assertEqual(user.phone_number, '+2349030000000')
+
+    def test_common_passwords_are_loaded_once(self):
+        first, second = validators.CommonPasswordValidator(), validators.CommonPasswordValidator()
+        self.assertIsInstance(first.passwords, frozenset)
+        self.assertIs(first.passwords, second.passwords)
+        with self.assertRaises(ValidationError):
+            first.validate('Password123')
+
+    def test_symbol_validator(self):
+        validators.SymbolValidator().validate('Str0ng!Passw0rd')
+        with self.assertRaises(ValidationError):
+            validators.SymbolValidator().validate('Str0ngPassw0rd')
+
+    def test_batch_validator_matches_serializer(self):
+        rows = [
+            (1, bulk_row('u1', 'one@example.com', phone_number='0803 123 4567')),
+            (2, bulk_row('u2', 'not-an-email', phone_number='123')),
+            (3, bulk_row('u3', 'three@example.com', password='password1')),
+        ]
+        results = list(validators.validate_batch(BulkProfileRowSerializer, rows))
+        self.assertEqual([key for key, _, _ in results], [1, 2, 3])
+        self.assertEqual(results[0][1]['phone_number'], '+2348031234567')
+        for (_, row), (_, data, errors) in zip(rows[1:], results[1:]):
+            serializer = BulkProfileRowSerializer(data=row)
+            self.assertFalse(serializer.is_valid())
+            self.assertIsNone(data)
+            self.assertEqual(errors, serializer.errors)
+
+    def test_migration_rewrites_stored_numbers(self):
+        import importlib
+        from types import SimpleNamespace
+
+        from django.apps import apps
+
+        migration = importlib.import_module('user.migrations.0004_phone_numbers_e164')
+        CustomUser.objects.bulk_create([
+            CustomUser(email='a@example.com', firebase_uid='a', phone_number='08031234567'),
+            CustomUser(email='b@example.com', firebase_uid='b', phone_number='not a number'),
+        ])
+        migration.normalize_phone_numbers(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(
+            dict(CustomUser.objects.values_list('firebase_uid', 'phone_number')),
+            {'a': '+2348031234567', 'b': 'not a number'},
+        )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'], BULK_IMPORT_HASH_WORKERS=0)
+class OutboxTests(FirebaseTokenMixin, TestCase):
+    def events(self):
+        return list(OutboxEvent.objects.order_by('id').values_list('event_type', 'payload'))
+
+    def test_each_kind_of_change_writes_one_event(self):
+        headers = self.auth_header(uid='uid-1', email='user@example.com')
+        created = self.client.post('/api/user/profile/create/', PROFILE_PAYLOAD, content_type='application/json',
+                                   **headers)
+        pk = created.json()['id']
+        self.client.patch(f'/api/user/profile/{pk}/update-phone/', {'phone_number': '09030000000'},
+                          content_type='application/json', **headers)
+        self.client.post('/api/user/reset-password/', {
+            'email': 'user@example.com', 'new_password': 'N3w!Passw0rd', 'confirm_password': 'N3w!Passw0rd',
+        }, content_type='application/json', **headers)
+        self.client.post('/api/user/firebase-login/', {}, content_type='application/json', **headers)
+        CustomUser.objects.get(pk=pk).delete()
+
+        events = self.events()
+        # The login's auth get_or_create made the row; the upsert then filled it in.
+        self.assertEqual([event_type for event_type, _ in events], [
+            OutboxEvent.PROFILE_CREATED, OutboxEvent.PROFILE_UPDATED, OutboxEvent.PHONE_CHANGED,
+            OutboxEvent.PASSWORD_CHANGED, OutboxEvent.PROFILE_DELETED,
+        ])
+        self.assertEqual(events[2][1]['phone_number'], '+2349030000000')
+        self.assertEqual(events[3][1]['changed'], ['password'])
+        self.assertEqual(events[4][1], {'id': pk, 'firebase_uid': 'uid-1'})
+        self.assertNotIn('password', json.dumps([payload for _, payload in events]).replace('"password"', ''))
+
+    def test_event_and_row_commit_together(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            CustomUser.objects.create_user(email='a@example.com', firebase_uid='a')
+            raise RuntimeError
+        with mock.patch.object(outbox, 'record_save', side_effect=OperationalError('outbox full')):
+            with self.assertRaises(OperationalError), transaction.atomic():
+                CustomUser.objects.create_user(email='b@example.com', firebase_uid='b')
+        self.assertFalse(CustomUser.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_saves_without_published_changes_write_nothing(self):
+        user = CustomUser.objects.create_user(email='a@example.com', firebase_uid='a')
+        user = CustomUser.objects.get(pk=user.pk)
+        user.save(update_fields=['last_login'])
+        user.first_name = 'Ada'
+        user.save()
+        self.assertEqual([event_type for event_type, _ in self.events()],
+                         [OutboxEvent.PROFILE_CREATED, OutboxEvent.PROFILE_UPDATED])
+        self.assertEqual(self.events()[1][1]['changed'], ['first_name'])
+
+    def test_bulk_import_writes_events(self):
+        CustomUser.objects.create_user(email='one@example.com', firebase_uid='u1')
+        import_profiles('\n'.join(json.dumps(row) for row in (
+            bulk_row('u1', 'one@example.com'), bulk_row('u2', 'two@example.com'),
+        )))
+        events = OutboxEvent.objects.order_by('id').values_list('event_type', 'firebase_uid')
+        self.assertEqual(list(events)[1:], [(OutboxEvent.PROFILE_UPDATED, 'u1'), (OutboxEvent.PROFILE_CREATED, 'u2')])
+
+    def test_relay_publishes_in_order_at_least_once(self):
+        for i in range(5):
+            CustomUser.objects.create_user(email=f'{i}@example.com', firebase_uid=f'u{i}')
+        path = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        sink = outbox.JSONLSink(path, fsync=False)
+
+        with mock.patch.object(sink, 'publish', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                outbox.OutboxRelay(sink, batch_size=2).run(once=True)
+        self.assertEqual(set(OutboxEvent.objects.values_list('attempts', flat=True)), {0, 1})
+        self.assertEqual(OutboxEvent.objects.filter(published_at__isnull=True).count(), 5)
+
+        self.assertEqual(outbox.OutboxRelay(sink, batch_size=2).run(once=True), 5)
+        self.assertEqual(outbox.OutboxRelay(sink, batch_size=2).run(once=True), 0)
+        with open(path) as fh:
+            lines = [json.loads(line) for line in fh]
+        self.assertEqual([line['id'] for line in lines], sorted(line['id'] for line in lines))
+        self.assertEqual([line['firebase_uid'] for line in lines], [f'u{i}' for i in range(5)])
+
+    def test_webhook_sink_posts_batches(self):
+        CustomUser.objects.create_user(email='a@example.com', firebase_uid='a')
+        sink = outbox.sink_from_setting('https://hooks.example.com/profiles')
+        with mock.patch.object(sink.session, 'post') as post:
+            self.assertEqual(outbox.OutboxRelay(sink).run(once=True), 1)
+        (url,), kwargs = post.call_args
+        self.assertEqual(url, 'https://hooks.example.com/profiles')
+        self.assertEqual(kwargs['json']['events'][0]['type'], OutboxEvent.PROFILE_CREATED)
+
+    def test_relay_command(self):
+        CustomUser.objects.create_user(email='a@example.com', firebase_uid='a')
+        path = os.path.join(tempfile.mkdtemp(), 'events.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        out = StringIO()
+        call_command('relay_outbox', '--sink', path, '--once', stdout=out)
+        self.assertIn('1 events published', out.getvalue())
+        self.assertFalse(OutboxEvent.objects.filter(published_at__isnull=True).exists())
+
+
+JOB_CALLS = []
+
+
+@jobs.task('tests.record')
+def record_job(value, fail_times=0, sleep=0):
+    time.sleep(sleep)
+    JOB_CALLS.append(value)
+    if JOB_CALLS.count(value) <= fail_times:
+        raise RuntimeError(f'attempt {JOB_CALLS.count(value)} failed')
+
+
+class JobQueueFixture:
+    def setUp(self):
+        super().setUp()
+        JOB_CALLS.clear()
+
+    def run_worker(self, **kwargs):
+        return jobs.Worker(concurrency=kwargs.pop('concurrency', 1), poll_interval=0.01, **kwargs).run(once=True)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class JobQueueTests(JobQueueFixture, FirebaseTokenMixin, TestCase):
+    def test_signup_and_password_reset_send_email_from_the_worker(self):
+        headers = self.auth_header(uid='uid-1', email='user@example.com')
+        self.client.post('/api/user/profile/create/', PROFILE_PAYLOAD, content_type='application/json', **headers)
+        self.client.post('/api/user/reset-password/', {
+            'email': 'user@example.com', 'new_password': 'N3w!Passw0rd', 'confirm_password': 'N3w!Passw0rd',
+        }, content_type='application/json', **headers)
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(list(Job.objects.order_by('id').values_list('task', flat=True)),
+                         [tasks.WELCOME_EMAIL, tasks.PASSWORD_CHANGED_EMAIL])
+
+        self.assertEqual(self.run_worker(), 2)
+        self.assertEqual([message.subject for message in mail.outbox], ['Welcome!', 'Your password was changed'])
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertEqual(set(Job.objects.values_list('status', flat=True)), {Job.SUCCEEDED})
+
+    def test_password_change_rolls_back_if_its_notice_cant_be_queued(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='0ld!Passw0rd', firebase_uid='uid-1')
+        with mock.patch('user.jobs.enqueue', side_effect=RuntimeError('queue down')):
+            response = self.client.post('/api/user/reset-password/', {
+                'email': 'user@example.com', 'new_password': 'N3w!Passw0rd', 'confirm_password': 'N3w!Passw0rd',
+            }, content_type='application/json', **self.auth_header())
+        self.assertEqual(response.status_code, 500)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('0ld!Passw0rd'))
+
+    def test_bulk_import_queues_welcome_emails_for_created_rows_only(self):
+        existing = CustomUser.objects.create_user(email='one@example.com', firebase_uid='u1')
+        Job.objects.all().delete()
+        rows = [bulk_row('u1', 'one@example.com'), bulk_row('u2', 'two@example.com'), bulk_row(None, 'three@example.com')]
+        rows[2].pop('firebase_uid')
+        report = import_profiles('\n'.join(json.dumps(row) for row in rows), workers=0)
+        self.assertEqual((report['created'], report['updated']), (2, 1))
+        queued = {job.kwargs['user_id'] for job in Job.objects.filter(task=tasks.WELCOME_EMAIL)}
+        self.assertEqual(queued, set(CustomUser.objects.exclude(pk=existing.pk).values_list('pk', flat=True)))
+
+    def test_welcome_job_commits_with_the_profile(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            CustomUser.objects.create_user(email='a@example.com', firebase_uid='a')
+            raise RuntimeError
+        self.assertFalse(Job.objects.exists())
+
+    def test_idempotency_key_enqueues_once(self):
+        first = jobs.enqueue('tests.record', key='once', value='a')
+        second = jobs.enqueue('tests.record', key='once', value='b')
+        self.assertEqual(first.pk, second.pk)
+        self.run_worker()
+        self.assertEqual(JOB_CALLS, ['a'])
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(LookupError):
+            jobs.enqueue('tests.missing')
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        retried = jobs.enqueue('tests.record', value='retried', fail_times=1)
+        failed = jobs.enqueue('tests.record', value='failed', fail_times=10)
+        Job.objects.filter(pk=failed.pk).update(max_attempts=2)
+
+        with mock.patch.object(jobs, 'retry_delay', return_value=60), self.assertLogs('user.jobs', 'WARNING'):
+            self.run_worker()
+        retried.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts), (Job.QUEUED, 1))
+        self.assertIn('attempt 1 failed', retried.last_error)
+        self.assertGreater(retried.run_at, timezone.now() + timedelta(seconds=50))
+        self.assertEqual(self.run_worker(), 0)  # not due yet
+
+        Job.objects.update(run_at=timezone.now())
+        with self.assertLogs('user.jobs', 'ERROR'):
+            self.run_worker()
+        retried.refresh_from_db()
+        failed.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts, retried.last_error), (Job.SUCCEEDED, 2, ''))
+        self.assertEqual((failed.status, failed.attempts), (Job.FAILED, 2))
+
+    def test_expired_leases_are_requeued(self):
+        job = jobs.enqueue('tests.record', value='a')
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=1, locked_by='gone:1',
+                                             locked_at=timezone.now() - timedelta(hours=1))
+        with self.assertLogs('user.jobs', 'WARNING'):
+            self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 2))
+        self.assertEqual(JOB_CALLS, ['a'])
+
+    def test_runworker_command(self):
+        jobs.enqueue('tests.record', value='a')
+        out = StringIO()
+        call_command('runworker', '--once', '--concurrency', '1', '--poll-interval', '0', stdout=out)
+        self.assertIn('1 jobs processed', out.getvalue())
+        self.assertEqual(JOB_CALLS, ['a'])
+
+
+class JobConcurrencyTests(JobQueueFixture, TransactionTestCase):
+    def test_jobs_run_concurrently_and_once_each(self):
+        for i in range(8):
+            jobs.enqueue('tests.record', value=i, sleep=0.05)
+        started = time.monotonic()
+        self.assertEqual(self.run_worker(concurrency=4), 8)
+        self.assertLess(time.monotonic() - started, 8 * 0.05)
+        self.assertEqual(sorted(JOB_CALLS), list(range(8)))
+        self.assertEqual(Job.objects.filter(status=Job.SUCCEEDED).count(), 8)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_consecutive_failures_then_trials_one_call(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow())
+        now[0] = 4
+        self.assertEqual(breaker.retry_after(), 6)
+
+        now[0] = 10
+        self.assertTrue(breaker.allow())  # the trial
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 20
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertTrue(breaker.allow())
+
+    def test_guard_limits_calls_in_flight(self):
+        guard = CallGuard(max_concurrent=1, queue_timeout=0.01, call_timeout=5)
+        self.addCleanup(guard.shutdown)
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait(5)
+            return 'done'
+
+        thread = threading.Thread(target=guard.call, args=(slow,))
+        thread.start()
+        started.wait(5)
+        with self.assertRaises(FirebaseUnavailable):
+            guard.call(lambda: 'second')
+        release.set()
+        thread.join()
+        self.assertEqual(guard.call(lambda: 'third'), 'third')
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+
+
+@override_settings(
+    FIREBASE_TOKEN_VERIFIER='sdk', FIREBASE_CALL_TIMEOUT=0.2, FIREBASE_QUEUE_TIMEOUT=0.05,
+    FIREBASE_BREAKER_FAILURES=2, FIREBASE_BREAKER_RESET=60,
+)
+class FirebaseResilienceTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        self.auth = FakeFirebaseAuth(FirebaseTokenVerifier(
+            self.signer.project_id, SigningKeyCache(FileKeySource(self.keys_path)),
+        ))
+        patcher = mock.patch('firebase_admin.auth.verify_id_token', self.auth.verify_id_token)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(firebase_client, 'get_firebase_app')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        reset_firebase_guard()
+        self.addCleanup(get_token_cache().clear)
+        CustomUser.objects.create_user(email='user@example.com', firebase_uid='uid-1')
+
+    def get_profile(self, **claims):
+        return self.client.get('/api/user/profile/', **self.auth_header(uid='uid-1', **claims))
+
+    def test_slow_firebase_times_out_then_breaker_fails_fast(self):
+        self.auth.latency = 0.5
+        with self.assertLogs('user.resilience', 'WARNING'):
+            for nonce in ('a', 'b'):
+                response = self.get_profile(nonce=nonce)
+                self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '60')
+        self.assertEqual(get_firebase_guard().breaker.state, CircuitBreaker.OPEN)
+
+        started = time.monotonic()
+        self.assertEqual(self.get_profile(nonce='c').status_code, 503)
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(self.auth.calls, 2)
+
+    def test_degraded_mode_accepts_cached_tokens_only(self):
+        cached = self.auth_header(uid='uid-1')
+        self.assertEqual(self.client.get('/api/user/profile/', **cached).status_code, 200)
+
+        self.auth.error = ConnectionError('Google is down')
+        with self.assertLogs('user.resilience', 'WARNING'):
+            for nonce in ('a', 'b'):
+                self.assertEqual(self.get_profile(nonce=nonce).status_code, 503)
+        hits = DEGRADED_HITS.value()
+        self.assertEqual(self.client.get('/api/user/profile/', **cached).status_code, 200)
+        self.assertEqual(DEGRADED_HITS.value(), hits + 1)
+        token = self.signer.sign('uid-1', 'user@example.com', nonce='c')
+        response = async_to_sync(AsyncClient().get)('/api/user/async/profile/',
+                                                    headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '60'))
+        self.assertEqual(self.auth.calls, 3)  # the first verification and the two failures
+
+    def test_rejected_tokens_do_not_trip_the_breaker(self):
+        stranger = LocalTokenSigner(kid='other-key')
+        for nonce in range(3):
+            token = stranger.sign('uid-1', 'user@example.com', nonce=nonce)
+            response = self.client.get('/api/user/profile/', HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, 403)
+        self.assertEqual(get_firebase_guard().breaker.state, CircuitBreaker.CLOSED)
+
+    @override_settings(FIREBASE_TOKEN_VERIFIER='local')
+    def test_slow_signing_key_fetch_returns_503(self):
+        key_cache = get_token_verifier().key_cache
+        key_cache.source = FlakyKeySource(key_cache.source, latency=0.5)
+        with self.assertLogs('user.resilience', 'WARNING'):
+            self.assertEqual(self.get_profile().status_code, 503)
+        key_cache.source.latency = 0
+        self.assertEqual(self.get_profile().status_code, 200)
+
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'SAVEPOINT', 'RELEASE', 'BEGIN')
+
+
+class LoginFastPathTests(FirebaseTokenMixin, TestCase):
+    def login(self, uid='uid-1', **claims):
+        token = self.signer.sign(uid, f'{uid}@example.com', **claims)
+        return self.client.post('/api/user/firebase-login/', {'id_token': token}, content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def writes(self, queries):
+        return [query['sql'] for query in queries if query['sql'].lstrip().upper().startswith(WRITE_PREFIXES)]
+
+    def test_first_login_creates_the_user(self):
+        response = self.login(name='Ada Lovelace')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['created'])
+        user = CustomUser.objects.get(firebase_uid='uid-1')
+        self.assertEqual(user.first_name, 'Ada')
+        self.assertIsNotNone(user.last_login)
+
+    def test_repeat_login_is_one_read_without_writes(self):
+        self.login()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login(nonce='again')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['created'])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.writes(queries.captured_queries), [])
+        self.assertNotIn('"password"', queries.captured_queries[0]['sql'])
+
+    def test_last_login_is_written_once_per_interval(self):
+        self.login()
+        CustomUser.objects.update(last_login=timezone.now() - timedelta(hours=1))
+        writes = LAST_LOGIN_WRITES.value()
+        with CaptureQueriesContext(connection) as queries:
+            self.login(nonce='later')
+        self.assertEqual(len(self.writes(queries.captured_queries)), 1)
+        self.assertEqual(LAST_LOGIN_WRITES.value(), writes + 1)
+        self.assertGreater(CustomUser.objects.get().last_login, timezone.now() - timedelta(minutes=1))
+        self.assertFalse(OutboxEvent.objects.filter(event_type=OutboxEvent.PROFILE_UPDATED).exists())
+
+    def test_authenticated_requests_do_not_write(self):
+        self.login()
+        headers = self.auth_header(uid='uid-1', email='uid-1@example.com', nonce='request')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/user/profile/', **headers)
+        self.assertEqual(self.writes(queries.captured_queries), [])
+
+    def test_async_repeat_login_does_not_write(self):
+        token = self.signer.sign('uid-a', 'async@example.com')
+        login = async_to_sync(AsyncClient().post)
+        first = login('/api/user/async/firebase-login/', {'id_token': token}, content_type='application/json')
+        self.assertTrue(first.json()['created'])
+        with CaptureQueriesContext(connection) as queries:
+            second = login('/api/user/async/firebase-login/', {'id_token': token}, content_type='application/json')
+        self.assertFalse(second.json()['created'])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(self.writes(queries.captured_queries), [])
+
+
+class PrincipalTests(FirebaseTokenMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = CustomUser.objects.create_user(email='user@example.com', firebase_uid='uid-1')
+        self.group = Group.objects.create(name='support')
+        self.user.groups.add(self.group)
+
+    def test_requests_authenticate_as_a_cached_principal(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/user/profile/', **self.auth_header())
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('"password"', ' '.join(query['sql'] for query in queries.captured_queries))
+        principal = get_principal('uid-1')
+        self.assertIsInstance(principal, Principal)
+        self.assertFalse(hasattr(principal, '__dict__'))
+        self.assertEqual((principal.pk, principal.is_active, principal.is_staff), (self.user.pk, True, False))
+
+    def test_permission_set_is_loaded_once_and_dropped_on_change(self):
+        view_user = Permission.objects.get(codename='view_customuser')
+        self.group.permissions.add(view_user)
+        principal = get_principal('uid-1')
+        with self.assertNumQueries(1):
+            self.assertTrue(principal.has_perm('user.view_customuser'))
+            self.assertFalse(principal.has_perm('user.delete_customuser'))
+            self.assertTrue(principal.has_module_perms('user'))
+        with self.assertNumQueries(0):
+            self.assertTrue(get_principal('uid-1').has_perm('user.view_customuser'))
+
+        self.user.user_permissions.add(Permission.objects.get(codename='delete_customuser'))
+        self.assertTrue(get_principal('uid-1').has_perm('user.delete_customuser'))
+        self.group.permissions.clear()
+        self.assertFalse(get_principal('uid-1').has_perm('user.view_customuser'))
+        self.group.user_set.remove(self.user)
+        self.user.user_permissions.clear()
+        self.assertEqual(get_principal('uid-1').get_all_permissions(), frozenset())
+
+    def test_flags_follow_saves(self):
+        self.assertFalse(get_principal('uid-1').has_perm('user.view_customuser'))
+        self.user.is_superuser = True
+        self.user.save()
+        with self.assertNumQueries(1):  # the row; superusers skip the permission query
+            self.assertTrue(get_principal('uid-1').has_perm('user.anything'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(get_principal('uid-1').has_perm('user.anything'))
+
+    def test_rows_cached_before_commit_are_dropped_on_commit(self):
+        stale = Principal(self.user.pk, 'uid-1', True, False, False)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+            # A concurrent request re-caches the row as it was before the commit.
+            principal_module.store(stale)
+            profile_cache.get_cache().set(profile_cache.uid_key('uid-1'), {'is_staff': False})
+        self.assertIsNone(profile_cache.get_cache().get(profile_cache.uid_key('uid-1')))
+        self.assertTrue(get_principal('uid-1').is_staff)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+            principal_module.store(stale)
+        self.assertIsNone(get_principal('uid-1'))
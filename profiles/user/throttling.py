@@ -0,0 +1,279 @@
+"""
+Request rate limiting for the expensive endpoints.
+
+``settings.RATE_LIMITS`` maps URL names from ``user/urls.py`` to rules such
+as ``"ip:30/m"``, ``"uid:10/m"`` or ``"email:3/h"``. ``RateLimitMiddleware``
+checks them before the request reaches the view, so a throttled client gets
+a small 429 (with Retry-After) before any session, Firebase verification,
+password hashing or database work happens.
+
+Limits use a sliding-window counter: the count for the current fixed window
+plus the previous window's count, weighted by how much of it still overlaps
+the sliding window. ``MemoryBackend`` keeps the counters per process;
+``CacheBackend`` keeps them in a Django cache (Redis in production) so all
+workers share one limit.
+
+``ip`` and ``email`` (from the JSON body) rules are checked by the
+middleware. ``uid`` rules are charged by ``check_verified`` once the token
+has been verified (``firebase_utils`` calls it), never from unverified
+claims: otherwise anyone could mint an unsigned token with a victim's uid
+and spend the victim's budget.
+"""
+import json
+import math
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import Throttled
+
+from .metrics import Counter
+
+THROTTLED = Counter('rate_limited_total', 'Requests rejected with 429, by URL name and rule scope.')
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_RULE = re.compile(r'^(ip|uid|email):(\d+)/([smhd])$')
+# Bodies are only peeked at for the uid/email keys; anything larger is left to the view.
+MAX_BODY_BYTES = 64 * 1024
+
+
+class RateLimited(Throttled):
+    """A verified uid over its limit: 429 + Retry-After via DRF's exception handler."""
+    default_detail = 'Too many requests. Please try again later.'
+
+
+@dataclass(frozen=True)
+class Rule:
+    scope: str
+    limit: int
+    period: int
+
+    @classmethod
+    def parse(cls, text):
+        match = _RULE.match(text.strip())
+        if match is None:
+            raise ValueError(f"Invalid rate limit rule {text!r}; expected e.g. 'ip:30/m'.")
+        scope, limit, unit = match.groups()
+        return cls(scope, int(limit), PERIODS[unit])
+
+
+def retry_after(previous, current, limit, elapsed, period):
+    """Seconds until the sliding-window estimate drops below ``limit``."""
+    if current >= limit:
+        # Only the next window helps; this window's count then decays as the previous one.
+        wait = period - elapsed + period * (1 - limit / current)
+    else:
+        wait = period * (1 - (limit - current) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+class MemoryBackend:
+    """Per-process counters: exact for one worker, a per-worker cap for several."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        """Count one request against ``key``; returns ``(allowed, retry_after)``."""
+        now = time.time()
+        index, elapsed = divmod(now, period)
+        with self._lock:
+            window, current, previous, _ = self._windows.get(key, (index, 0, 0, 0))
+            if window != index:
+                previous = current if window == index - 1 else 0
+                current = 0
+            expires = (index + 2) * period
+            if previous * (1 - elapsed / period) + current >= limit:
+                self._windows[key] = (index, current, previous, expires)
+                return False, retry_after(previous, current, limit, elapsed, period)
+            self._windows[key] = (index, current + 1, previous, expires)
+            if len(self._windows) > self.max_keys:
+                self._prune(now)
+        return True, 0
+
+    def _prune(self, now):
+        # Counters older than the previous window no longer affect any estimate.
+        for key in [key for key, entry in self._windows.items() if entry[3] <= now]:
+            del self._windows[key]
+
+
+class CacheBackend:
+    """Counters in a Django cache, shared by every worker using that cache."""
+
+    def __init__(self, alias='default', prefix='ratelimit'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def hit(self, key, limit, period):
+        now = time.time()
+        index, elapsed = divmod(now, period)
+        current_key = f'{self.prefix}:{key}:{int(index)}'
+        previous_key = f'{self.prefix}:{key}:{int(index) - 1}'
+        counts = self.cache.get_many([current_key, previous_key])
+        current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+        if previous * (1 - elapsed / period) + current >= limit:
+            return False, retry_after(previous, current, limit, elapsed, period)
+        # add() + incr() is atomic on Redis/Memcached; concurrent hits can't lose counts.
+        self.cache.add(current_key, 0, timeout=2 * period + 1)
+        try:
+            self.cache.incr(current_key)
+        except ValueError:  # expired between add() and incr()
+            self.cache.set(current_key, 1, timeout=2 * period + 1)
+        return True, 0
+
+
+_backend = None
+_rules = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        if getattr(settings, 'RATE_LIMIT_BACKEND', 'memory') == 'cache':
+            _backend = CacheBackend(getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default'))
+        else:
+            _backend = MemoryBackend()
+    return _backend
+
+
+def get_rules():
+    """``{url_name: [Rule, ...]}`` parsed from ``settings.RATE_LIMITS``."""
+    global _rules
+    if _rules is None:
+        _rules = {
+            url_name: [Rule.parse(text) for text in texts]
+            for url_name, texts in getattr(settings, 'RATE_LIMITS', {}).items()
+        }
+    return _rules
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _backend, _rules
+    if setting.startswith('RATE_LIMIT'):
+        _backend = None
+        _rules = None
+
+
+def client_ip(request):
+    header = getattr(settings, 'RATE_LIMIT_CLIENT_IP_HEADER', '')
+    if header:
+        # e.g. HTTP_X_FORWARDED_FOR behind a proxy that sets it; the first hop is the client.
+        forwarded = request.META.get(header, '').split(',')[0].strip()
+        if forwarded:
+            return forwarded
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _json_body(request):
+    if request.content_type != 'application/json':
+        return {}
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        return {}
+    if not 0 < length <= MAX_BODY_BYTES:
+        return {}
+    try:
+        # request.body is cached, so the view still parses the same bytes.
+        data = json.loads(request.body)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def request_keys(request, scopes):
+    """The ``{scope: key}`` values checked before verification; missing ones are skipped."""
+    keys = {}
+    if 'ip' in scopes:
+        keys['ip'] = client_ip(request)
+    if 'email' in scopes:
+        email = _json_body(request).get('email')
+        if isinstance(email, str):
+            keys['email'] = email.strip().lower()
+    return {scope: key for scope, key in keys.items() if key}
+
+
+def _over_limit(url_name, rules, keys):
+    """Count a hit against each rule with a key; the Retry-After of the first one over, else None."""
+    backend = get_backend()
+    for rule in rules:
+        key = keys.get(rule.scope)
+        if key is None:
+            continue
+        allowed, wait = backend.hit(f'{url_name}:{rule.scope}:{rule.period}:{key}', rule.limit, rule.period)
+        if not allowed:
+            THROTTLED.inc(url_name=url_name, scope=rule.scope)
+            return wait
+    return None
+
+
+def _url_rules_configured():
+    return getattr(settings, 'RATE_LIMIT_ENABLED', True) and bool(get_rules())
+
+
+def _url_rules(url_name):
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return []
+    return get_rules().get(url_name) or []
+
+
+def check(request):
+    """Return a 429 response if ``request`` is over any of its URL's ip/email limits, else ``None``."""
+    if not _url_rules_configured():
+        return None
+    try:
+        url_name = resolve(request.path_info).url_name
+    except Resolver404:
+        return None
+    url_rules = [rule for rule in _url_rules(url_name) if rule.scope != 'uid']
+    if not url_rules:
+        return None
+
+    wait = _over_limit(url_name, url_rules, request_keys(request, {rule.scope for rule in url_rules}))
+    if wait is None:
+        return None
+    response = JsonResponse({'error': 'Too many requests. Please try again later.'}, status=429)
+    response['Retry-After'] = str(wait)
+    return response
+
+
+def check_verified(request, claims):
+    """Charge the verified uid's limits for ``request``'s URL; raises ``RateLimited`` when over."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return
+    url_rules = [rule for rule in _url_rules(match.url_name) if rule.scope == 'uid']
+    if url_rules and claims.get('uid'):
+        wait = _over_limit(match.url_name, url_rules, {'uid': claims['uid']})
+        if wait is not None:
+            raise RateLimited(wait)
+
+
+class RateLimitMiddleware:
+    """Applies ``settings.RATE_LIMITS``; sits early so throttled requests stay cheap."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return check(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return check(request) or await self.get_response(request)
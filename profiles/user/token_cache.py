@@ -0,0 +1,168 @@
+"""
+Cache of verified Firebase ID tokens.
+
+Two layers: a per-request memo, so authentication, permissions and the view
+share one verification and one ``CustomUser`` lookup, and a bounded LRU across
+requests keyed by the token's SHA-256 digest. Entries never outlive the
+token's own ``exp`` claim.
+
+Tokens that verification rejected are remembered too, for a short TTL, so a
+client retrying a garbage or expired token in a loop is turned away without
+another signature check. ``NEGATIVE_CACHE_HITS``/``NEGATIVE_CACHE_MISSES``
+count those lookups (and the unknown-uid ones in ``profile_cache``) for
+tuning the TTLs.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .metrics import Counter
+
+NEGATIVE_CACHE_HITS = Counter(
+    'negative_cache_hits_total', 'Lookups answered from a negative cache, by kind (token, uid).',
+)
+NEGATIVE_CACHE_MISSES = Counter(
+    'negative_cache_misses_total', 'Failed lookups that did the full work and were then negatively cached.',
+)
+
+
+def token_digest(id_token):
+    return hashlib.sha256(id_token.encode()).hexdigest()
+
+
+class VerifiedTokenCache:
+    """Thread-safe LRU of ``digest -> claims`` with per-entry expiry."""
+
+    def __init__(self, maxsize=10000, max_ttl=3600):
+        self.maxsize = maxsize
+        self.max_ttl = max_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            expires_at, claims = entry
+            if expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def set(self, digest, claims):
+        if self.maxsize <= 0:
+            return
+        self._store(digest, min(claims.get('exp', 0), time.time() + self.max_ttl), claims)
+
+    def _store(self, digest, expires_at, value):
+        if expires_at <= time.time():
+            return
+        with self._lock:
+            self._entries[digest] = (expires_at, value)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RejectedTokenCache(VerifiedTokenCache):
+    """``digest -> reason`` for tokens that failed verification, kept ``max_ttl`` seconds."""
+
+    def set(self, digest, reason):
+        if self.maxsize <= 0:
+            return
+        self._store(digest, time.time() + self.max_ttl, reason)
+
+
+_cache = None
+_rejected = None
+
+
+def get_token_cache():
+    global _cache
+    if _cache is None:
+        _cache = VerifiedTokenCache(
+            maxsize=getattr(settings, 'FIREBASE_TOKEN_CACHE_SIZE', 10000),
+            max_ttl=getattr(settings, 'FIREBASE_TOKEN_CACHE_TTL', 3600),
+        )
+    return _cache
+
+
+def get_rejected_tokens():
+    global _rejected
+    if _rejected is None:
+        _rejected = RejectedTokenCache(
+            maxsize=getattr(settings, 'FIREBASE_REJECTED_TOKEN_CACHE_SIZE', 10000),
+            max_ttl=getattr(settings, 'FIREBASE_REJECTED_TOKEN_CACHE_TTL', 60),
+        )
+    return _rejected
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    global _cache, _rejected
+    if setting.startswith('FIREBASE_'):
+        _cache = None
+        _rejected = None
+
+
+def _http_request(request):
+    # DRF's Request wraps the HttpRequest; memoize on the inner one so plain
+    # Django code (middleware, async views) sees the same entries.
+    return getattr(request, '_request', request)
+
+
+def request_memo(request):
+    """Per-request dict of ``digest -> claims``."""
+    http_request = _http_request(request)
+    memo = getattr(http_request, '_verified_firebase_tokens', None)
+    if memo is None:
+        memo = {}
+        http_request._verified_firebase_tokens = memo
+    return memo
+
+
+def remember_user(request, user, created=False):
+    http_request = _http_request(request)
+    http_request._firebase_custom_user = user
+    if created:
+        # The lookup that inserted the row; later ones in the request find it.
+        http_request._firebase_user_created = True
+
+
+def remembered_user_created(request):
+    """Whether the remembered user was created during this request."""
+    return getattr(_http_request(request), '_firebase_user_created', False)
+
+
+def remembered_user(request, uid):
+    """The ``CustomUser`` already loaded for ``uid`` during this request, if any."""
+    user = getattr(_http_request(request), '_firebase_custom_user', None)
+    if user is not None and user.firebase_uid == uid:
+        return user
+    return None
+
+
+def remember_principal(request, principal):
+    _http_request(request)._firebase_principal = principal
+
+
+def remembered_principal(request, uid):
+    """The ``Principal`` already resolved for ``uid`` during this request, if any."""
+    principal = getattr(_http_request(request), '_firebase_principal', None)
+    if principal is not None and principal.firebase_uid == uid:
+        return principal
+    return None
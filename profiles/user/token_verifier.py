@@ -0,0 +1,285 @@
+"""
+Local verification of Firebase ID tokens.
+
+Google's signing certificates are kept in-process and refreshed in the
+background according to the ``Cache-Control: max-age`` of the response, so
+verifying a token only costs an RS256 signature check and a few claim
+comparisons. The key source is pluggable: production reads Google's x509
+endpoint, tests point ``FIREBASE_KEY_SOURCE`` at a local file or server.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+import jwt
+from cryptography import x509
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_CERTS_URL = (
+    'https://www.googleapis.com/robot/v1/metadata/x509/'
+    'securetoken@system.gserviceaccount.com'
+)
+ISSUER_PREFIX = 'https://securetoken.google.com/'
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class InvalidFirebaseToken(ValueError):
+    """
+    Raised when an ID token fails signature or claim checks. ``cacheable``
+    is False for rejections the same token may pass shortly (a key not yet
+    loaded, an ``iat`` a little ahead of our clock), which must not be
+    remembered as rejected.
+    """
+
+    def __init__(self, message, cacheable=True):
+        super().__init__(message)
+        self.cacheable = cacheable
+
+
+def parse_max_age(cache_control):
+    """Return the ``max-age`` in seconds from a Cache-Control header, or None."""
+    match = MAX_AGE_RE.search(cache_control or '')
+    return int(match.group(1)) if match else None
+
+
+def load_public_keys(data):
+    """
+    Build a ``{kid: public_key}`` map from either Google's x509 format
+    (``{kid: "-----BEGIN CERTIFICATE-----..."}``) or a JWKS document.
+    """
+    if 'keys' in data:
+        return {
+            jwk['kid']: jwt.PyJWK(jwk, algorithm='RS256').key
+            for jwk in data['keys']
+        }
+    return {
+        kid: x509.load_pem_x509_certificate(pem.encode()).public_key()
+        for kid, pem in data.items()
+    }
+
+
+class KeySource:
+    """Where signing keys come from. ``fetch`` returns ``(keys, max_age)``."""
+
+    def fetch(self):
+        raise NotImplementedError
+
+
+class HTTPKeySource(KeySource):
+    """Fetches certificates over HTTP, honouring the Cache-Control max-age."""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, timeout=5):
+        self.url = url
+        self.timeout = timeout
+
+    def fetch(self):
+        import requests
+
+        response = requests.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        keys = load_public_keys(response.json())
+        return keys, parse_max_age(response.headers.get('Cache-Control'))
+
+
+class FileKeySource(KeySource):
+    """Reads certificates or a JWKS from a local file. Used by tests."""
+
+    def __init__(self, path, max_age=None):
+        self.path = path
+        self.max_age = max_age
+
+    def fetch(self):
+        with open(self.path) as fh:
+            return load_public_keys(json.load(fh)), self.max_age
+
+
+class SigningKeyCache:
+    """
+    Thread-safe holder for the current signing keys.
+
+    Keys are fetched on first use and then refreshed by a daemon timer shortly
+    before ``max-age`` runs out, so request threads normally never block on
+    the network. An unknown ``kid`` (key rotation) forces a synchronous
+    refresh, rate limited by ``min_refresh_interval``.
+    """
+
+    def __init__(self, source, min_refresh_interval=30, retry_interval=60,
+                 refresh_margin=0.1, guard=None):
+        self.source = source
+        # A user.resilience.CallGuard to fetch through, if any.
+        self.guard = guard
+        self.min_refresh_interval = min_refresh_interval
+        self.retry_interval = retry_interval
+        self.refresh_margin = refresh_margin
+        self._keys = None
+        self._expires_at = None
+        self._fetched_at = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def expires_at(self):
+        return self._expires_at
+
+    def get(self, kid):
+        keys, fetched_at = self._keys, self._fetched_at
+        if keys is None or self._is_expired():
+            keys = self.refresh(fetched_at)
+            fetched_at = self._fetched_at
+        key = keys.get(kid)
+        if key is None and time.monotonic() - fetched_at >= self.min_refresh_interval:
+            key = self.refresh(fetched_at).get(kid)
+        return key
+
+    def refresh(self, seen=None):
+        """
+        Fetch the keys now. With ``seen`` (the ``_fetched_at`` the caller
+        saw), threads that queued on the lock behind another thread's fetch
+        reuse its result instead of fetching again one after another.
+        """
+        with self._lock:
+            if seen is not None and self._keys is not None and self._fetched_at > seen:
+                return self._keys
+            keys, max_age = self.guard.call(self.source.fetch) if self.guard else self.source.fetch()
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+            self._expires_at = self._fetched_at + max_age if max_age else None
+            self._schedule(max_age)
+            logger.debug("Loaded %d Firebase signing keys (max-age=%s)", len(keys), max_age)
+            return keys
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _is_expired(self):
+        return self._expires_at is not None and time.monotonic() >= self._expires_at
+
+    def _schedule(self, delay):
+        self.close()
+        if not delay:
+            return
+        self._timer = threading.Timer(delay * (1 - self.refresh_margin), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.warning("Background refresh of Firebase signing keys failed", exc_info=True)
+            with self._lock:
+                self._schedule(self.retry_interval)
+
+
+class FirebaseTokenVerifier:
+    """Checks the RS256 signature and the ``aud``/``iss``/``exp`` claims locally."""
+
+    def __init__(self, project_id, key_cache, leeway=0):
+        if not project_id:
+            raise ValueError("A Firebase project id is required to verify ID tokens.")
+        self.project_id = project_id
+        self.issuer = ISSUER_PREFIX + project_id
+        self.key_cache = key_cache
+        self.leeway = leeway
+
+    def verify(self, id_token):
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError as e:
+            raise InvalidFirebaseToken(f"Malformed token: {e}")
+
+        if header.get('alg') != 'RS256':
+            raise InvalidFirebaseToken("Token must be signed with RS256.")
+        key = self.key_cache.get(header.get('kid'))
+        if key is None:
+            # May be a rotated key whose refresh is still rate limited.
+            raise InvalidFirebaseToken("Token signed with an unknown key id.", cacheable=False)
+
+        try:
+            claims = jwt.decode(
+                id_token,
+                key,
+                algorithms=['RS256'],
+                audience=self.project_id,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']},
+            )
+        except jwt.ImmatureSignatureError as e:
+            # iat in the future: clock skew with Google, not a bad token.
+            raise InvalidFirebaseToken(str(e), cacheable=False)
+        except jwt.PyJWTError as e:
+            raise InvalidFirebaseToken(str(e))
+
+        subject = claims['sub']
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise InvalidFirebaseToken("Token has an invalid subject.")
+        if claims.get('auth_time', 0) > time.time() + self.leeway:
+            raise InvalidFirebaseToken("Token auth_time is in the future.", cacheable=False)
+
+        claims['uid'] = subject
+        return claims
+
+
+def key_source_from_setting(value):
+    """``http(s)://`` values are fetched over the network, anything else is a file path."""
+    value = str(value)
+    if value.startswith(('http://', 'https://')):
+        return HTTPKeySource(value)
+    return FileKeySource(value)
+
+
+def get_project_id():
+    project_id = getattr(settings, 'FIREBASE_PROJECT_ID', '')
+    if project_id:
+        return project_id
+    try:
+        with open(settings.FIREBASE_CREDENTIALS) as fh:
+            return json.load(fh).get('project_id', '')
+    except (OSError, ValueError, AttributeError):
+        return ''
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_token_verifier():
+    """Return the process-wide verifier, building it from settings on first use."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                from .resilience import get_firebase_guard
+
+                source = key_source_from_setting(
+                    getattr(settings, 'FIREBASE_KEY_SOURCE', GOOGLE_CERTS_URL)
+                )
+                _verifier = FirebaseTokenVerifier(
+                    get_project_id(),
+                    SigningKeyCache(source, guard=get_firebase_guard()),
+                    leeway=getattr(settings, 'FIREBASE_TOKEN_LEEWAY', 0),
+                )
+    return _verifier
+
+
+def reset_token_verifier():
+    global _verifier
+    with _verifier_lock:
+        if _verifier is not None:
+            _verifier.key_cache.close()
+        _verifier = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(setting, **kwargs):
+    if setting.startswith('FIREBASE_'):
+        reset_token_verifier()
@@ -1,7 +1,7 @@
 # 
 
 from django.urls import path
-from . import views
+from . import async_views, views
 
 urlpatterns = [
     path('profile/', views.CurrentUserProfileAPIView.as_view(), name='current_user_profile_api'),
@@ -10,5 +10,15 @@ urlpatterns = [
     path('profile/<int:pk>/delete/', views.UserProfileDeleteAPIView.as_view(), name='delete_user_profile_api'),
     path('profile/<int:pk>/update-phone/', views.UserProfileUpdatePhoneAPIView.as_view(), name='update_phone_number_api'),
     path('firebase-login/', views.FirebaseLoginAPIView.as_view(), name='firebase_login_api'),
+    path('profiles/', views.UserProfileListAPIView.as_view(), name='list_user_profiles_api'),
+    path('profiles/batch/', views.UserProfileBatchAPIView.as_view(), name='batch_user_profiles_api'),
+    path('profiles/export/', views.UserProfileExportAPIView.as_view(), name='export_profiles_api'),
+    path('profiles/bulk/', views.UserProfileBulkImportAPIView.as_view(), name='bulk_import_profiles_api'),
     path('reset-password/', views.UserProfilePasswordResetAPIView.as_view(), name='reset_password_api'),
+
+    # ASGI-native variants of the hot read/create/login endpoints
+    path('async/profile/', async_views.AsyncCurrentUserProfileView.as_view(), name='async_current_user_profile_api'),
+    path('async/profile/create/', async_views.AsyncUserProfileCreateView.as_view(), name='async_create_user_profile_api'),
+    path('async/profile/<int:pk>/', async_views.AsyncUserProfileRetrieveView.as_view(), name='async_view_user_profile_api'),
+    path('async/firebase-login/', async_views.AsyncFirebaseLoginView.as_view(), name='async_firebase_login_api'),
 ]
@@ -1,11 +1,92 @@
-# profiles/validators.py
+"""
+Validation rules for profile input, compiled once per process.
+
+* Phone numbers are normalized to E.164 (``+234XXXXXXXXXX``) so the stored
+  value, uniqueness checks and prefix search all see one canonical form,
+  whichever local spelling the client sent.
+* ``CommonPasswordValidator`` shares one frozenset of Django's common
+  password list across every instance; ``prewarm`` loads it (and builds the
+  ``AUTH_PASSWORD_VALIDATORS`` chain) when a worker starts rather than on
+  the first signup. ``SymbolValidator``'s pattern is compiled once too.
+* ``BatchValidator``/``validate_batch`` run a serializer's rules over many
+  rows with a single serializer instance, for bulk import.
+"""
+import gzip
 import re
+import threading
+from pathlib import Path
+
+from django.contrib.auth import password_validation
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext as _
 
+# Nigerian mobile numbers: +234 / 234 / 0 followed by a 10-digit subscriber number.
+PHONE_PATTERN = re.compile(r'^(?:\+?234|0)([789][01]\d{8})$')
+# Spaces, dots, dashes and brackets people type between digit groups.
+PHONE_SEPARATORS = re.compile(r'[\s.()-]')
+SYMBOL_PATTERN = re.compile(r'[!@#$%^&*(),.?":{}|<>]')
+PHONE_COUNTRY_CODE = '+234'
+INVALID_PHONE_MESSAGE = "Please enter a valid Nigerian phone number."
+
+
+def non_empty_string(value):
+    if not value.strip():
+        raise ValidationError("This field cannot be empty.")
+
+
+def to_e164(value):
+    """``value`` as ``+234XXXXXXXXXX``, or None if it isn't a valid number."""
+    match = PHONE_PATTERN.match(PHONE_SEPARATORS.sub('', value))
+    return PHONE_COUNTRY_CODE + match.group(1) if match else None
+
+
+def normalize_phone_number(value):
+    normalized = to_e164(value)
+    if normalized is None:
+        raise ValidationError(INVALID_PHONE_MESSAGE, code='invalid_phone_number')
+    return normalized
+
+
+def normalize_phone_prefix(prefix):
+    """Map a local search prefix (``0803``) onto the stored E.164 form (``+234803``)."""
+    prefix = PHONE_SEPARATORS.sub('', prefix)
+    if prefix.startswith('0'):
+        return PHONE_COUNTRY_CODE + prefix[1:]
+    if prefix.startswith('234'):
+        return '+' + prefix
+    return prefix
+
+
+# The list CommonPasswordValidator reads by default.
+COMMON_PASSWORDS_PATH = Path(password_validation.__file__).resolve().parent / 'common-passwords.txt.gz'
+_common_passwords = None
+_common_passwords_lock = threading.Lock()
+
+
+def common_passwords():
+    """Django's bundled common-password list, loaded once per process."""
+    global _common_passwords
+    if _common_passwords is None:
+        with _common_passwords_lock:
+            if _common_passwords is None:
+                with gzip.open(COMMON_PASSWORDS_PATH, 'rt', encoding='utf-8') as fh:
+                    _common_passwords = frozenset(line.strip() for line in fh)
+    return _common_passwords
+
+
+class CommonPasswordValidator(password_validation.CommonPasswordValidator):
+    """Django's validator, backed by the shared frozenset for the default list."""
+
+    def __init__(self, password_list_path=None):
+        if password_list_path is None:
+            self.passwords = common_passwords()
+        else:
+            super().__init__(password_list_path)
+
+
 class SymbolValidator:
     def validate(self, password, user=None):
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+        if not SYMBOL_PATTERN.search(password):
             raise ValidationError(
                 _("Password must contain at least one symbol."),
                 code='password_no_symbol',
@@ -13,3 +94,37 @@ class SymbolValidator:
 
     def get_help_text(self):
         return _("Your password must contain at least one special symbol.")
+
+
+def prewarm():
+    """Load the password list and build the configured validator chain."""
+    common_passwords()
+    password_validation.get_default_password_validators()
+
+
+class BatchValidator:
+    """
+    Runs a serializer's rules over many rows with one serializer instance,
+    so its fields are built once instead of per row. Rules and error
+    messages are the serializer's own, as ``serializer_class(data=row)
+    .is_valid()`` would report them.
+    """
+
+    def __init__(self, serializer_class, context=None):
+        self.serializer = serializer_class(context=context or {})
+
+    def validate(self, data):
+        """``(validated_data, None)`` or ``(None, errors)`` for one row."""
+        from rest_framework import serializers
+
+        try:
+            return self.serializer.run_validation(data), None
+        except serializers.ValidationError as exc:
+            return None, exc.detail
+
+
+def validate_batch(serializer_class, rows, context=None):
+    """Validate ``(key, data)`` pairs; yields ``(key, validated_data, errors)``."""
+    validator = BatchValidator(serializer_class, context)
+    for key, data in rows:
+        yield key, *validator.validate(data)
@@ -1,22 +1,117 @@
-from rest_framework import generics, status
+from rest_framework import generics, serializers, status
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from . import export, profile_cache
+from .bulk import import_profiles
+from .hashing import HashingUnavailable, get_hashing_service, hash_password
+from .instrumentation import stage
+from .login import get_login_user, touch_last_login
 from .models import CustomUser
+from .resilience import FirebaseUnavailable
+from .throttling import RateLimited
 from .serializers import (
+    PROFILE_ROWS,
+    ProfileBatchRequestSerializer,
+    ProfileUpsertSerializer,
     UserProfileSerializer,
     PasswordResetSerializer,
     UserProfileCreateSerializer
 )
+from .pagination import ProfileCursorPagination
 from .permissions import IsFirebaseAuthenticated
+from .retry import retry_on_lock
+from .routers import replica_reads
+from .validators import normalize_phone_number, normalize_phone_prefix
 from .firebase_utils import verify_firebase_id_token
+from .token_cache import remembered_user
 import logging
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+
+class CachedProfileMixin:
+    """
+    Serves the serialized profile from ``profile_cache`` and answers
+    If-None-Match / If-Modified-Since revalidation with a bodiless 304.
+    """
+
+    def get_cache_lookup(self):
+        raise NotImplementedError
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.get_cache_lookup()
+        with replica_reads(pk=lookup.get('pk'), firebase_uid=lookup.get('firebase_uid')):
+            entry = profile_cache.get_profile(**lookup)
+        if entry is None:
+            raise Http404
+        response = Response(entry['data'])
+        response['ETag'] = entry['etag']
+        last_modified = entry['last_modified']
+        if last_modified is not None:
+            last_modified = int(last_modified)
+            response['Last-Modified'] = http_date(last_modified)
+        return get_conditional_response(
+            request, etag=entry['etag'], last_modified=last_modified, response=response
+        )
+
+@transaction.atomic
+def _write_profile(firebase_uid, fields):
+    instance = CustomUser.objects.select_for_update().filter(firebase_uid=firebase_uid).first()
+    if instance is None:
+        try:
+            with transaction.atomic():
+                return CustomUser.objects.create(firebase_uid=firebase_uid, **fields)
+        except IntegrityError:
+            # A concurrent request created this uid first: update its row instead.
+            instance = CustomUser.objects.select_for_update().filter(firebase_uid=firebase_uid).first()
+            if instance is None:
+                raise
+
+    changed = [name for name, value in fields.items() if getattr(instance, name) != value]
+    if changed:
+        for name in changed:
+            setattr(instance, name, fields[name])
+        instance.save(update_fields=changed + ['updated_at'])
+    return instance
+
+def upsert_profile(data):
+    """
+    Validate ``data`` (request fields plus the token's ``firebase_uid`` and
+    ``email``) and create or update the matching profile. Shared by the sync
+    and async create endpoints; raises ``serializers.ValidationError``.
+
+    The password is hashed first, then a single transaction locks the row
+    (or inserts it) and writes only the columns that changed. Concurrent
+    requests for the same uid end up with one row and no IntegrityError.
+    """
+    serializer = ProfileUpsertSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+
+    fields = dict(serializer.validated_data)
+    fields.pop('retype_password', None)
+    fields['email'] = CustomUser.objects.normalize_email(fields['email'])
+    fields['password'] = hash_password(fields['password'])
+    firebase_uid = data['firebase_uid']
+    try:
+        return retry_on_lock(_write_profile)(firebase_uid, fields)
+    except IntegrityError:
+        if CustomUser.objects.filter(email=fields['email']).exclude(firebase_uid=firebase_uid).exists():
+            raise serializers.ValidationError({'email': ['A profile with this email already exists.']})
+        raise
+
 @method_decorator(csrf_exempt, name='dispatch')
 class UserProfileCreateAPIView(generics.CreateAPIView):
     queryset = CustomUser.objects.all()
@@ -24,63 +119,53 @@ class UserProfileCreateAPIView(generics.CreateAPIView):
 
     def create(self, request, *args, **kwargs):
         try:
-            logger.debug(f"Raw request data: {dict(request.data)}")
+            logger.debug("Create profile request with fields %s", sorted(request.data))
             auth_header = request.headers.get('Authorization', '')
-            logger.debug(f"Authorization header: {auth_header}")
             if not auth_header.startswith('Bearer '):
                 logger.error("Missing or invalid Authorization header")
                 return Response({'error': 'Authorization header missing or invalid.'}, status=status.HTTP_401_UNAUTHORIZED)
 
             id_token = auth_header.split(' ')[1]
             try:
-                user_info = verify_firebase_id_token(id_token)
-                logger.debug(f"User info: {user_info}")
+                user_info = verify_firebase_id_token(id_token, request=request)
+            except (FirebaseUnavailable, RateLimited):
+                raise
             except Exception as e:
-                logger.error(f"Token verification failed: {str(e)}")
+                logger.warning("Token verification failed: %s", e)
                 return Response({'error': f"Invalid Firebase ID token: {str(e)}"}, status=status.HTTP_401_UNAUTHORIZED)
 
             # Validate required fields
             required_fields = ['first_name', 'last_name', 'phone_number', 'password', 'retype_password']
             missing_fields = [field for field in required_fields if field not in request.data or not request.data[field]]
             if missing_fields:
-                logger.error(f"Missing required fields: {missing_fields}")
+                logger.warning("Missing required fields: %s", missing_fields)
                 return Response({'error': f"Missing required fields: {missing_fields}"}, status=status.HTTP_400_BAD_REQUEST)
 
             data = request.data.copy()
             data['firebase_uid'] = user_info['uid']
             data['email'] = user_info.get('email', '')
-            logger.debug(f"Modified request data: {data}")
-            instance = CustomUser.objects.filter(firebase_uid=data['firebase_uid']).first()
-
-            serializer = self.get_serializer(data=data, instance=instance)
             try:
-                serializer.is_valid(raise_exception=True)
-            except Exception as e:
-                logger.error(f"Serializer validation failed: {str(e)}", exc_info=True)
+                instance = upsert_profile(data)
+            except HashingUnavailable:
+                raise
+            except serializers.ValidationError as e:
+                logger.warning("Profile validation failed for uid %s: %s", user_info['uid'], e.detail)
                 return Response({'error': f"Invalid data: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-            
-            try:
-                instance = CustomUser.objects.get(firebase_uid=data['firebase_uid'])
-                instance.email = data.get('email', instance.email)
-                instance.first_name = data.get('first_name', instance.first_name)
-                instance.last_name = data.get('last_name', instance.last_name)
-                
-                if password := data.get('password'):
-                    instance.set_password(password)
-                instance.save()
-            except CustomUser.DoesNotExist:
-                instance = CustomUser.objects.create_user(**data)
             except Exception as e:
-                logger.error(f"Error occurred while creating user profile: {str(e)}", exc_info=True)
+                logger.exception("Error occurred while creating user profile")
                 return Response({'error': f"Failed to create user profile: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             serializer = self.get_serializer(instance)
+            with stage('serialize'):
+                data = serializer.data
 
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(data, status=status.HTTP_201_CREATED)
+        except (HashingUnavailable, FirebaseUnavailable, RateLimited):
+            raise  # 503/429 + Retry-After via the exception handler
         except Exception as e:
-            logger.error(f"Unexpected error in UserProfileCreateAPIView: {str(e)}", exc_info=True)
+            logger.exception("Unexpected error in UserProfileCreateAPIView")
             return Response({'error': f"Server error: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class CurrentUserProfileAPIView(generics.RetrieveAPIView):
+class CurrentUserProfileAPIView(CachedProfileMixin, generics.RetrieveAPIView):
     """
     GET /api/user/profile/
     Returns the authenticated Firebase user's profile using firebase_uid.
@@ -90,15 +175,24 @@ class CurrentUserProfileAPIView(generics.RetrieveAPIView):
 
     def get_object(self):
         firebase_uid = self.request.firebase_user.get('uid')  # Provided by IsFirebaseAuthenticated permission
+        user = remembered_user(self.request, firebase_uid)
+        if user is not None:
+            return user
         return get_object_or_404(CustomUser, firebase_uid=firebase_uid)
 
+    def get_cache_lookup(self):
+        firebase_uid = self.request.firebase_user.get('uid')
+        return {
+            'firebase_uid': firebase_uid,
+            'user': remembered_user(self.request, firebase_uid),
+        }
+
 @method_decorator(csrf_exempt, name='dispatch')
 class FirebaseLoginAPIView(APIView):
     def post(self, request):
        #logger.debug("FirebaseLoginAPIView disabled for debugging")
         #return Response({'error': 'Endpoint disabled for debugging'}, status=status.HTTP_403_FORBIDDEN)"""
         # Original code commented out to prevent partial user creation
-        logger.debug(f"Firebase login request data: {request.data}")
         id_token = request.data.get('id_token')
         if not id_token:
             logger.error("No ID token provided")
@@ -106,24 +200,16 @@ class FirebaseLoginAPIView(APIView):
         
         try:
             logger.debug("Attempting to verify Firebase token")
-            user_info = verify_firebase_id_token(id_token)
-            logger.debug(f"Token verified successfully: {user_info}")
+            user_info = verify_firebase_id_token(id_token, request=request)
+            logger.debug("Token verified for uid %s", user_info['uid'])
 
 
             uid = user_info['uid']
             email = user_info.get('email')
-            name = user_info.get('name', '')
-            first_name = name.split()[0] if name else ''
-
-            
-            logger.debug(f"Creating/getting user with UID: {uid}")
-            user, created = CustomUser.objects.get_or_create(
-                firebase_uid=uid,
-                defaults={
-                    'email': email,
-                    'first_name': first_name,
-                }
-            )
+
+            # Usually already looked up by FirebaseAuthentication for this request.
+            user, created = get_login_user(user_info, request=request)
+            touch_last_login(user)
 
             response_data={
                 'message': 'Login successful.',
@@ -132,14 +218,16 @@ class FirebaseLoginAPIView(APIView):
                 'created': created,
             'full_name': f"{user.first_name} {user.last_name}" if user.last_name else user.first_name
             }
-            logger.debug(f"Returning success response: {response_data}")
+            logger.debug("Login for uid %s (created=%s)", uid, created)
             return Response(response_data, status=status.HTTP_200_OK)
-            
+
+        except (FirebaseUnavailable, RateLimited):
+            raise
         except Exception as e:
-            logger.error(f"Firebase login error: {str(e)}", exc_info=True)
+            logger.warning("Firebase login error: %s", e, exc_info=True)
             return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
 
-class UserProfileRetrieveAPIView(generics.RetrieveAPIView):
+class UserProfileRetrieveAPIView(CachedProfileMixin, generics.RetrieveAPIView):
     """
     GET /api/user/profile/<pk>/
     Retrieves a specific user profile by pk (not necessarily the authenticated user).
@@ -148,6 +236,74 @@ class UserProfileRetrieveAPIView(generics.RetrieveAPIView):
     serializer_class = UserProfileSerializer
     permission_classes = [IsFirebaseAuthenticated]
 
+    def get_cache_lookup(self):
+        return {'pk': self.kwargs['pk']}
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserProfileBatchAPIView(APIView):
+    """
+    POST /api/user/profiles/batch/
+    Resolves up to PROFILE_BATCH_MAX_IDS pks or firebase_uids in one call and
+    returns ``{"profiles": {id: profile}, "missing": [...]}``.
+    """
+    permission_classes = [IsFirebaseAuthenticated]
+
+    def post(self, request):
+        serializer = ProfileBatchRequestSerializer(
+            data=request.data,
+            context={'max_items': getattr(settings, 'PROFILE_BATCH_MAX_IDS', 300)},
+        )
+        serializer.is_valid(raise_exception=True)
+        if 'ids' in serializer.validated_data:
+            requested = serializer.validated_data['ids']
+            profiles = profile_cache.get_many(pks=requested)
+        else:
+            requested = serializer.validated_data['firebase_uids']
+            profiles = profile_cache.get_many(firebase_uids=requested)
+        return Response({
+            'profiles': {str(key): data for key, data in profiles.items()},
+            'missing': [value for value in dict.fromkeys(requested) if value not in profiles],
+        })
+
+def prefix_filter(field, prefix):
+    # A closed range rather than LIKE 'x%', so a plain B-tree index serves it
+    # on every backend regardless of LIKE collation rules.
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+class UserProfileListAPIView(generics.ListAPIView):
+    """
+    GET /api/user/profiles/?limit=&cursor=&is_active=&phone_prefix=&name_prefix=
+    Staff/service listing of profiles, keyset-paginated on (email, id).
+    ``name_prefix`` matches the start of the first or last name.
+    """
+    serializer_class = UserProfileSerializer
+    permission_classes = [IsFirebaseAuthenticated, IsAdminUser]
+    pagination_class = ProfileCursorPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        # .values() rows: the paginator reads the cursor fields from dicts too.
+        queryset = PROFILE_ROWS.values(CustomUser.objects.all())
+
+        is_active = params.get('is_active')
+        if is_active is not None:
+            if is_active.lower() not in ('true', 'false', '1', '0'):
+                raise serializers.ValidationError({'is_active': ['Must be true or false.']})
+            queryset = queryset.filter(is_active=is_active.lower() in ('true', '1'))
+        if phone_prefix := params.get('phone_prefix', '').strip():
+            queryset = queryset.filter(prefix_filter('phone_number', normalize_phone_prefix(phone_prefix)))
+        if name_prefix := params.get('name_prefix', '').strip():
+            queryset = queryset.filter(
+                prefix_filter('first_name', name_prefix) | prefix_filter('last_name', name_prefix)
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        with stage('serialize'):
+            data = PROFILE_ROWS.many(page)
+        return self.get_paginated_response(data)
+
 class UserProfileDeleteAPIView(generics.DestroyAPIView):
     queryset = CustomUser.objects.all()
     serializer_class = UserProfileSerializer
@@ -169,14 +325,78 @@ class UserProfileUpdatePhoneAPIView(APIView):
 
         if not phone_number:
             return Response({'phone_number': ['This field is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            phone_number = normalize_phone_number(phone_number)
+        except DjangoValidationError as e:
+            return Response({'phone_number': e.messages}, status=status.HTTP_400_BAD_REQUEST)
 
+        # One canonical form, so this catches the number however it was typed.
         if CustomUser.objects.filter(phone_number=phone_number).exclude(pk=pk).exists():
             return Response({'phone_number': ['Phone number already exists.']}, status=status.HTTP_400_BAD_REQUEST)
 
+        # The normalized number is already valid; no full_clean() re-validating
+        # every column (and querying for email/uid uniqueness) on each update.
         user.phone_number = phone_number
         try:
-            user.full_clean()
-            user.save()
+            retry_on_lock(user.save)(update_fields=['phone_number', 'updated_at'])
             return Response({'message': 'Phone number updated successfully.'}, status=status.HTTP_200_OK)
         except Exception as e:
-            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserProfileBulkImportAPIView(APIView):
+    """
+    POST /api/user/profiles/bulk/
+    Upserts profiles from a JSON Lines (default) or CSV (Content-Type: text/csv)
+    body and returns created/updated counts plus per-row errors. Staff only.
+    """
+    permission_classes = [IsFirebaseAuthenticated, IsAdminUser]
+
+    def post(self, request):
+        fmt = 'csv' if request.content_type.startswith('text/csv') else 'jsonl'
+        # Read the body as a stream rather than through DRF's parsers, and hash
+        # through the shared bounded pool rather than forking one per request.
+        report = import_profiles(request.stream or b'', fmt=fmt, hashing_service=get_hashing_service())
+        return Response(report, status=status.HTTP_200_OK)
+
+class UserProfileExportAPIView(APIView):
+    """
+    GET /api/user/profiles/export/?output=csv|jsonl&fields=&since_id=&since=&gzip=
+    Streams every profile (or those with an id above ``since_id`` and/or
+    updated after ``since``) as a CSV or JSON Lines download, gzipped with
+    ``gzip=true``. ``fields`` is a comma-separated subset of
+    ``export.EXPORT_FIELDS``. Staff only.
+    """
+    permission_classes = [IsFirebaseAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        params = request.query_params
+        # Not "format": DRF reserves that for renderer selection.
+        fmt = params.get('output', 'csv')
+        if fmt not in export.FORMATS:
+            raise serializers.ValidationError({'output': [f"Must be one of: {', '.join(export.FORMATS)}."]})
+        options = {'fmt': fmt, 'compress': params.get('gzip', '').lower() in ('true', '1')}
+        try:
+            options['fields'] = export.parse_fields(params.get('fields', ''))
+        except ValueError as e:
+            raise serializers.ValidationError({'fields': [str(e)]})
+        if since_id := params.get('since_id', '').strip():
+            try:
+                options['since_id'] = export.parse_since_id(since_id)
+            except ValueError:
+                raise serializers.ValidationError({'since_id': ['Must be a profile id.']})
+        if since := params.get('since', '').strip():
+            try:
+                options['since'] = export.parse_since(since)
+            except ValueError as e:
+                raise serializers.ValidationError({'since': [str(e)]})
+
+        # ASGI servers buffer a sync iterator in full, so give them an async one.
+        stream = export.aiter_export if isinstance(request._request, ASGIRequest) else export.iter_export
+        filename = f"profiles.{fmt}" + ('.gz' if options['compress'] else '')
+        response = StreamingHttpResponse(
+            stream(**options),
+            content_type='application/gzip' if options['compress'] else export.CONTENT_TYPES[fmt],
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response